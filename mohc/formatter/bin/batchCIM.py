@@ -0,0 +1,568 @@
+#!/usr/local/sci/bin/python2.7
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3 see
+# <http://www.gnu.org/licenses/>
+
+""" CLI that builds a batch of CIM documents.
+
+USAGE: batchCIM.py [-c config_dir] [-f xml|json|html[,...]] -j jobs_file
+    [-o output_dir] [-p project] [-q queue_size] [-w workers] [--gzip]
+    [--journal journal_file] [--layout flat|tree|hashed] [--resume]
+    [--skip-unchanged] [--times times_file]
+
+-c config_dir
+    Points to the directory containing your local "format.cfg" file,
+    as for formatCIM.py.
+
+-f xml|json|html[,...]
+    Format, or comma-separated list of formats, for jobs that don't
+    give one. The default is xml.
+
+-j jobs_file
+    File listing the documents to build, one JSON object per line,
+    with the same information you would give formatCIM.py:
+
+    {"doc": "submodel", "model": "HadGEM2-ES", "submodel": "Aerosols",
+     "template": "templates/submodel.fmt"}
+
+    "doc" is model, experiment or submodel and "template" is the
+    template file. "model", "experiment" and "submodel" name the
+    metadata to use, as for formatCIM.py's -m, -e and -s options.
+    "project", "format" and "output" override the -p, -f and -o
+    options. Blank lines and lines starting with "#" are ignored.
+
+-o output_dir
+    Location to store documents for jobs that don't give an "output".
+    The default is the current directory.
+
+-p project
+    Project for jobs that don't give one.
+
+-q queue_size
+    Number of documents that can wait between one stage and the next.
+    The default is 4.
+
+-w workers
+    Number of worker threads for each stage, as build,validate,write.
+    The default is 1,1,1.
+
+--gzip, --layout flat|tree|hashed
+    Write gzipped files and spread them over sub-directories of the
+    output directory, as for formatCIM.py. Use them when writing
+    thousands of documents: "doc_index.jsonl" in the output directory
+    lists the id, type, encoding and path of every file written.
+
+--journal journal_file
+    File to note each job in as it finishes. The default is the jobs
+    file with ".journal" added.
+
+--resume
+    Carries on with a batch that didn't finish. Jobs noted in the
+    journal are skipped if neither they, their template nor the files
+    written for them have changed since, so only the jobs that failed
+    or weren't reached are run. Without --resume, the journal is
+    started again.
+
+--skip-unchanged
+    Only writes documents that have changed since they were last
+    written, as for formatCIM.py. Unchanged documents are found in the
+    build stage, before their ids are saved.
+
+--times times_file
+    File keeping how long each job took, used to start the longest
+    jobs first. The default is the jobs file with ".times" added.
+
+Documents go through three stages at once: build (querying the
+metadata store and making the pyesdoc document), validate and write.
+While one document is being built, the one before it can be validated
+and the one before that written. The workers are threads, so more
+build workers help when the metadata store is slow to answer queries
+and more write workers help when the output disk is slow.
+
+Jobs are started longest first, going by how long they took last
+time, so a big model document doesn't start last and hold up the end
+of the batch. Jobs that haven't been timed yet are expected to take
+as long as the other jobs for the same type of document did, on
+average, or as long as the longest job if there are none. Jobs
+expected to take as long as each other are started in the order
+they're given, and the report lists jobs in that order whatever order
+they ran in.
+
+Each template is parsed once for the whole batch and, with
+dao.crem_csv, each CSV table is read once. Parts of documents that
+turn up again in later jobs, such as the grids and responsible
+parties shared by a model's experiments, are built once and copied
+with new ids (see subtree_cache). Documents that fail validation are
+still written, as with formatCIM.py. The program prints a line for
+each job, then the number of documents written, unchanged, skipped,
+invalid and failed, the number of parts reused and the time spent in
+each stage on stderr. It exits with an error if any job was invalid or
+failed.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+
+from cli import PyesdocCli
+import config
+from dao import crem_csv
+import doc_request
+import formatCIM
+from lazy_import import lazy_module
+import output
+from pipeline import Pipeline, Result, Stage
+import subtree_cache
+
+pyesdoc = lazy_module("pyesdoc")
+template = lazy_module("template")
+
+JOURNAL_SUFFIX = ".journal"
+
+TIMES_SUFFIX = ".times"
+
+STAGES = ["build", "validate", "write"]
+
+
+class JobError(doc_request.RequestError):
+    """ Raised for jobs that can't be built as given. """
+    pass
+
+
+class Job(object):
+    """ A document to build, given by spec (a dictionary read from
+    the jobs file), and what happened to it.
+    """
+
+    __slots__ = ("spec", "doc", "invalid", "paths", "version", "skipped")
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.doc = None
+        self.invalid = []
+        self.paths = []
+        self.version = None
+        self.skipped = False
+
+    def name(self):
+        return "%s %s" % (self.spec.get("doc"), ":".join(self._names()))
+
+    def key(self):
+        """ Returns the key for the job's document in output manifests.
+        """
+        return output.doc_key(
+            self.spec.get("project"), self.spec.get("doc"), self._names())
+
+    def unchanged(self):
+        return self.version is not None and self.version.unchanged()
+
+    def _names(self):
+        keys = doc_request.DOC_NAMES.get(self.spec.get("doc"), [])
+        return [self.spec.get(key, "") for key in keys]
+
+
+class Journal(object):
+    """ The jobs a batch has finished, kept in the file at path so a
+    batch that dies part way through can be resumed. Each line is a
+    JSON object for one job, giving its job_hash, its invalid nodes and
+    the files written for it with their hashes. Lines are appended as
+    jobs finish. Unless resume is true, the journal is started again.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.lock = threading.Lock()
+        if resume:
+            self.entries = _read_journal(path)
+        else:
+            self.entries = {}
+            open(path, "w").close()
+
+    def finished(self, job):
+        """ Returns true, having filled in job's paths and invalid
+        nodes, if job finished in an earlier run and neither it nor its
+        files have changed since.
+        """
+        entry = self.entries.get(job_hash(job.spec))
+        if entry is None:
+            return False
+        try:
+            for path, saved_hash in entry["files"]:
+                if output.file_hash(path) != saved_hash:
+                    return False
+        except (IOError, OSError, KeyError, ValueError):
+            return False
+        job.paths = [path for path, saved_hash in entry["files"]]
+        job.invalid = entry.get("invalid", [])
+        return True
+
+    def record(self, job):
+        """ Notes that job has finished. """
+        line = json.dumps({
+            "job": job.name(), "hash": job_hash(job.spec),
+            "invalid": [unicode(node) for node in job.invalid],
+            "files": [[path, output.file_hash(path)] for path in job.paths]},
+            sort_keys=True)
+        # Each line goes to disk before the next job is noted, so a
+        # crash loses no more than the jobs still running.
+        with self.lock:
+            with open(self.path, "a") as journal:
+                journal.write(line + "\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+        return
+
+
+class JobTimes(object):
+    """ How long each job took the last time it ran, kept in the JSON
+    file at path by job key.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as times_file:
+                self.times = json.load(times_file)
+        except (IOError, ValueError):
+            # Not timed yet: jobs start in the order they're given.
+            self.times = {}
+        if not isinstance(self.times, dict):
+            self.times = {}
+
+    def estimate(self, job):
+        """ Returns the number of seconds job is expected to take. """
+        with self.lock:
+            entry = self.times.get(job.key())
+            if entry is not None:
+                return entry["seconds"]
+            same_doc = [
+                entry["seconds"] for entry in self.times.values()
+                if entry["doc"] == job.spec.get("doc")]
+            if same_doc:
+                return sum(same_doc) / len(same_doc)
+            return max([
+                entry["seconds"] for entry in self.times.values()] or [0])
+
+    def record(self, job, seconds):
+        with self.lock:
+            self.times[job.key()] = {
+                "doc": job.spec.get("doc"), "seconds": seconds}
+        return
+
+    def save(self):
+        with self.lock:
+            handle, temp_path = tempfile.mkstemp(
+                prefix=".%s." % os.path.basename(self.path),
+                dir=os.path.dirname(self.path) or os.curdir)
+            with os.fdopen(handle, "w") as times_file:
+                json.dump(self.times, times_file, indent=1, sort_keys=True)
+                times_file.write("\n")
+            os.chmod(temp_path, 0644)
+            os.rename(temp_path, self.path)
+        return
+
+
+class Batch(object):
+    """ Builds, validates and writes jobs in a pipeline. workers is
+    the number of threads for each of the STAGES. If skip_unchanged is
+    true, documents are only written if they've changed. writer is the
+    output.OutputLayout to write them with, or None for pyesdoc.write.
+    journal is the Journal to note finished jobs in and skip the jobs
+    it has, or None. times is the JobTimes to start the longest jobs
+    first by and to record how long they took in, or None.
+    """
+
+    def __init__(self, cfg, workers=(1, 1, 1), queue_size=4,
+                 skip_unchanged=False, writer=None, journal=None,
+                 times=None):
+        self.cfg = cfg
+        self.journal = journal
+        self.times = times
+        self.skip_unchanged = skip_unchanged
+        if skip_unchanged and writer is None:
+            writer = output.OutputLayout()
+        self.writer = writer
+        self.templates = {}
+        self.manifests = {}
+        self.lock = threading.Lock()
+        self.stages = [
+            Stage(name, getattr(self, name), count)
+            for name, count in zip(STAGES, workers)]
+        self.pipeline = Pipeline(self.stages, queue_size)
+
+    def run(self, jobs):
+        """ Returns a pipeline Result for each of jobs, in order. Jobs
+        the journal has are skipped, and the rest are run longest
+        first.
+        """
+        if crem_csv.table_cache is None:
+            crem_csv.table_cache = crem_csv.TableCache()
+        if subtree_cache.cache is None:
+            subtree_cache.cache = subtree_cache.SubtreeCache()
+        for job in jobs:
+            job.skipped = self.journal is not None and \
+                self.journal.finished(job)
+        to_run = self.schedule([job for job in jobs if not job.skipped])
+        ran = dict(
+            (id(result.item), result)
+            for result in self.pipeline.run(to_run))
+        results = []
+        for index, job in enumerate(jobs):
+            if job.skipped:
+                result = Result(index, job)
+            else:
+                result = ran[id(job)]
+                if self.times is not None and result.error is None:
+                    self.times.record(job, result.seconds)
+            result.index = index
+            results.append(result)
+        for manifest in self.manifests.values():
+            manifest.save()
+        return results
+
+    def schedule(self, jobs):
+        """ Returns jobs in the order to run them: longest first, going
+        by times.
+        """
+        if self.times is None:
+            return jobs
+        estimates = dict((id(job), self.times.estimate(job)) for job in jobs)
+        # sorted is stable, so jobs expected to take as long as each
+        # other keep their order.
+        return sorted(jobs, key=lambda job: -estimates[id(job)])
+
+    def build(self, job):
+        spec = job.spec
+        check_job(spec)
+        doc_builder = doc_request.doc_builder(
+            spec, self.template(spec["template"]), self.cfg)
+        job.doc = formatCIM.build_doc(doc_builder)
+        if self.skip_unchanged:
+            # This has to be done before the ids are saved, as other
+            # jobs may refer to them.
+            job.version = self.manifest(spec["output"]).compare(
+                job.key(), job.doc, _encodings(spec))
+            if job.version.unchanged():
+                doc_builder.node.id_dao.replace_ids(job.version.id_map())
+        doc_builder.node.id_dao.flush()
+        return job
+
+    def validate(self, job):
+        job.invalid = pyesdoc.validate(job.doc)
+        return job
+
+    def write(self, job):
+        encodings = _encodings(job.spec)
+        if job.unchanged():
+            job.paths = job.version.paths
+        else:
+            job.paths = formatCIM.write_doc(
+                job.doc, job.spec["output"], encodings, writer=self.writer)
+            for path in job.paths:
+                os.chmod(path, 0644)
+            if job.version is not None:
+                job.version.manifest.record(job.version, encodings, job.paths)
+        if self.journal is not None:
+            self.journal.record(job)
+        # We've finished with the document, so don't keep it while
+        # the rest of the batch is built.
+        job.doc = None
+        return job
+
+    def template(self, template_file):
+        """ Returns the parsed template, parsing it the first time
+        it's used.
+        """
+        with self.lock:
+            if template_file not in self.templates:
+                try:
+                    with open(template_file) as template_stream:
+                        self.templates[template_file] = \
+                            template.parse_template(template_stream)
+                except IOError:
+                    raise JobError(
+                        "Can't open template file %s" % template_file)
+            return self.templates[template_file]
+
+    def manifest(self, output_path):
+        """ Returns the output manifest for output_path, reading it
+        the first time it's used.
+        """
+        directory = output.manifest_dir(output_path)
+        with self.lock:
+            if directory not in self.manifests:
+                self.manifests[directory] = output.OutputManifest(directory)
+            return self.manifests[directory]
+
+
+def main():
+    cli = _cli()
+    option = cli.check_usage(sys.argv)
+    defaults = {"format": option.get("-f", "xml"),
+                "output": option.get("-o", os.curdir)}
+    if "-p" in option:
+        defaults["project"] = option["-p"]
+    for format in cli.formats(defaults["format"]):
+        if not cli.is_format_valid(format):
+            cli.usage_exit()
+    try:
+        queue_size = int(option.get("-q", 4))
+        workers = [
+            int(count) for count in option.get("-w", "1,1,1").split(",")]
+        if len(workers) != len(STAGES):
+            cli.usage_exit()
+        journal = Journal(
+            option.get("--journal", option["-j"] + JOURNAL_SUFFIX),
+            "--resume" in option)
+        batch = Batch(
+            read_config(cli, option), workers, queue_size,
+            "--skip-unchanged" in option, formatCIM.output_writer(option),
+            journal, JobTimes(
+                option.get("--times", option["-j"] + TIMES_SUFFIX)))
+    except ValueError:
+        cli.usage_exit()
+    except IOError as e:
+        cli.error_exit("Can't open journal: %s" % e)
+    try:
+        jobs = read_jobs(option["-j"], defaults)
+    except (IOError, JobError) as e:
+        cli.error_exit("Can't read jobs: %s" % e)
+    try:
+        results = batch.run(jobs)
+    except (IOError, OSError) as e:
+        cli.error_exit("Can't save output manifest: %s" % e)
+    try:
+        batch.times.save()
+    except (IOError, OSError) as e:
+        sys.stderr.write("Couldn't save job times: %s\n" % e)
+    if report(results, batch.stages) > 0:
+        sys.exit(1)
+    return
+
+
+def read_config(cli, option):
+    cfg = config.FormatConfig(dir=option.get("-c")).read_config()
+    if "daopkg" not in cfg.get("global", {}):
+        cli.error_exit("Missing daopkg in global configuration")
+    return cfg
+
+
+def read_jobs(path, defaults):
+    """ Returns a Job for each line of the jobs file, filling in
+    anything the line doesn't give from defaults.
+    """
+    jobs = []
+    with open(path) as jobs_file:
+        for number, line in enumerate(jobs_file, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                spec = json.loads(line)
+            except ValueError as e:
+                raise JobError("line %d: %s" % (number, e))
+            if not isinstance(spec, dict):
+                raise JobError("line %d isn't a JSON object" % number)
+            jobs.append(Job(dict(defaults, **spec)))
+    return jobs
+
+
+def check_job(spec):
+    doc_request.check(spec, JobError)
+    return
+
+
+def job_hash(spec):
+    """ Returns a hash of the job given by spec and the template it
+    uses, which changes if either of them does.
+    """
+    digest = hashlib.sha1(json.dumps(spec, sort_keys=True))
+    try:
+        with open(spec["template"], "rb") as template_file:
+            digest.update(template_file.read())
+    except (IOError, KeyError):
+        # The job will fail when it's built.
+        pass
+    return digest.hexdigest()
+
+
+def report(results, stages):
+    """ Prints what happened to each job and a summary, and returns
+    the number of jobs that were invalid or failed.
+    """
+    counts = {
+        "written": 0, "unchanged": 0, "skipped": 0, "invalid": 0,
+        "failed": 0}
+    for result in results:
+        job = result.item
+        if result.error is not None:
+            counts["failed"] += 1
+            print "FAILED %s: %s" % (job.name(), result.error)
+            continue
+        if job.skipped:
+            counts["skipped"] += 1
+            print "SKIPPED %s: %s" % (job.name(), ", ".join(job.paths))
+        elif job.unchanged():
+            counts["unchanged"] += 1
+            print "UNCHANGED %s: %s" % (job.name(), ", ".join(job.paths))
+        else:
+            counts["written"] += 1
+            print "%s: %s" % (job.name(), ", ".join(job.paths))
+        if job.invalid:
+            counts["invalid"] += 1
+            print "INVALID %s: %d invalid nodes" % (
+                job.name(), len(job.invalid))
+    sys.stderr.write(
+        "%(written)d written, %(unchanged)d unchanged, %(skipped)d skipped, "
+        "%(invalid)d invalid, %(failed)d failed\n" % counts)
+    cache = subtree_cache.cache
+    if cache is not None:
+        sys.stderr.write("subtrees: %d reused, %d built\n" % (
+            cache.hits, cache.misses))
+    for stage in stages:
+        sys.stderr.write("%-8s %2d workers %6d jobs %9.3f s\n" % (
+            stage.name, stage.workers, stage.items, stage.seconds))
+    return counts["invalid"] + counts["failed"]
+
+
+def _read_journal(path):
+    # Returns the journal's entries by job hash. A run that died while
+    # writing may have left half a line at the end, which we ignore.
+    entries = {}
+    try:
+        with open(path) as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                    entries[entry["hash"]] = entry
+                except (ValueError, KeyError, TypeError):
+                    continue
+    except IOError:
+        # No journal: nothing has finished.
+        pass
+    return entries
+
+
+def _encodings(spec):
+    cli = _cli()
+    return [cli.encoding(format) for format in cli.formats(spec["format"])]
+
+
+def _cli():
+    return PyesdocCli(
+        "c:f:j:o:p:q:w:", ["-j"],
+        "[-c config_dir] [-f xml|json|html[,...]] -j jobs_file "
+        "[-o output_dir] [-p project] [-q queue_size] [-w workers] "
+        "[--gzip] [--journal journal_file] [--layout flat|tree|hashed] "
+        "[--resume] [--skip-unchanged] [--times times_file]",
+        ["gzip", "journal=", "layout=", "resume", "skip-unchanged",
+         "times="])
+
+
+if __name__ == "__main__":
+    main()
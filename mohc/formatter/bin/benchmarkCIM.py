@@ -0,0 +1,279 @@
+#!/usr/local/sci/bin/python2.7
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3 see
+# <http://www.gnu.org/licenses/>
+
+""" CLI that benchmarks the formatter by building the model,
+experiment and submodel documents from the bundled CSV dump of the
+CREM database.
+
+USAGE: benchmarkCIM.py [-b baseline_file] [-d db_dir] [-f xml|json|html]
+    [-n repeats] [-o output_file] [-r threshold]
+
+-b baseline_file
+    Compares the results with a file written by an earlier run (using
+    -o) and exits with an error if any phase has slowed down by more
+    than the threshold.
+
+-d db_dir
+    Directory holding the tbl*.csv files. The default is the csv
+    directory of this package. Use syntheticCREM.py to make larger
+    ones.
+
+-f xml|json|html
+    Format to write the documents in. The default is xml.
+
+-n repeats
+    Number of times to build each document. Times are the fastest of
+    the repeats. The default is 3.
+
+-o output_file
+    File to write the results to. The default is standard output.
+
+-r threshold
+    Percentage slowdown, in wall or CPU time, that counts as a
+    regression. The default is 10.
+
+Each document is built in four phases: parse (reading the template
+and making the doc builder), build, validate and write. For each
+phase the results give the wall and CPU time in seconds, the process's
+peak RSS in kB at the end of the phase, the number of CSV queries,
+the number of CSV rows scanned and the number of pyesdoc objects
+created. The results are written as JSON, for example:
+
+    {"cases": {"model": {"template": "templates/model.fmt",
+        "env": {...}, "phases": {"parse": {"wall": 0.01, ...}, ...}},
+        ...}, "repeats": 3, ...}
+
+Phases that take less than MIN_SLOWDOWN seconds longer than the
+baseline are never reported as regressions, so that noise in very
+short phases doesn't fail the comparison.
+"""
+
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import pyesdoc
+
+from cli import PyesdocCli
+from dao import query_hook
+import elements.element
+import formatCIM
+
+
+PHASES = ["parse", "build", "validate", "write"]
+
+MIN_SLOWDOWN = 0.05
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+CASES = [
+    ("model", "templates/model.fmt", {
+        "model": "HadGEM2-ES", "project": "CMIP5"}),
+    ("experiment", "templates/experiment.fmt", {
+        "model": "HadGEM2-ES", "experiment": "rcp85",
+        "project": "CMIP5"}),
+    ("submodel", "templates/submodel.fmt", {
+        "model": "HadGEM2-ES", "submodel": "Aerosols",
+        "project": "CMIP5"}),
+    ]
+
+
+def main():
+    cli = _cli()
+    option = cli.check_usage(sys.argv)
+    db_dir = option.get("-d", os.path.join(PACKAGE_DIR, "csv"))
+    output_format = option.get("-f", "xml")
+    if not cli.is_format_valid(output_format):
+        cli.usage_exit()
+    try:
+        repeats = int(option.get("-n", 3))
+        threshold = float(option.get("-r", 10))
+    except ValueError:
+        cli.usage_exit()
+    result = run_benchmark(db_dir, cli.encoding(output_format), repeats)
+    save_result(result, option.get("-o"))
+    if "-b" in option:
+        slow = regressions(result, load_result(option["-b"]), threshold)
+        if slow:
+            cli.error_exit("Slower than baseline:\n%s" % "\n".join(slow))
+    return
+
+
+def run_benchmark(db_dir, encoding, repeats=1, cases=CASES):
+    """ Builds each case's document repeats times and returns the
+    results as a dictionary that can be dumped as JSON.
+    """
+    cfg = {
+        "global": {
+            "institute": "mohc", "daopkg": "dao.crem_csv",
+            "project": "CMIP5"},
+        "database": {"db_dir": db_dir}}
+    result = {
+        "cases": {}, "repeats": repeats, "python": sys.version.split()[0],
+        "pyesdoc": getattr(pyesdoc, "__version__", None),
+        "db_dir": os.path.abspath(db_dir)}
+    for name, template_file, env in cases:
+        runs = []
+        for repeat in range(repeats):
+            runs.append(_run_case(
+                os.path.join(PACKAGE_DIR, template_file), env, cfg, encoding))
+        result["cases"][name] = {
+            "template": template_file, "env": env,
+            "phases": _fastest(runs)}
+    return result
+
+
+def regressions(result, baseline, threshold):
+    """ Returns a message for each phase of each case that is more
+    than threshold percent slower than in the baseline.
+    """
+    slow = []
+    for name in sorted(result["cases"]):
+        if name not in baseline["cases"]:
+            continue
+        phases = result["cases"][name]["phases"]
+        baseline_phases = baseline["cases"][name]["phases"]
+        for phase in PHASES:
+            for measure in ["wall", "cpu"]:
+                now = phases[phase][measure]
+                before = baseline_phases[phase][measure]
+                if (now - before > MIN_SLOWDOWN and
+                        now > before * (1 + threshold / 100.0)):
+                    slow.append("%s %s %s time %.3fs, baseline %.3fs" % (
+                        name, phase, measure, now, before))
+    return slow
+
+
+def load_result(path):
+    try:
+        with open(path) as result_file:
+            return json.load(result_file)
+    except (IOError, ValueError) as e:
+        _cli().error_exit("Can't read results from %s: %s" % (path, e))
+
+
+def save_result(result, path=None):
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if path is None:
+        print text
+        return
+    try:
+        with open(path, "w") as result_file:
+            result_file.write(text + "\n")
+    except IOError as e:
+        _cli().error_exit("Can't write results to %s: %s" % (path, e))
+    return
+
+
+class QueryCounter(object):
+    """ Query hook that counts the queries made by daos, and the CSV
+    rows they scan, while it is installed.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+
+    def __call__(self, event):
+        self.queries += 1
+        self.rows += event.rows_scanned or 0
+        return
+
+    def install(self):
+        query_hook.add_hook(self)
+        return
+
+    def uninstall(self):
+        query_hook.remove_hook(self)
+        return
+
+
+class _Phase(object):
+    # Measures one phase of a run. Used as a context manager around
+    # the phase's code.
+
+    def __init__(self, counter):
+        self.counter = counter
+
+    def __enter__(self):
+        self.start = self._sample()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = self._sample()
+        self.stats = {
+            "wall": end["wall"] - self.start["wall"],
+            "cpu": end["cpu"] - self.start["cpu"],
+            "peak_rss_kb": end["peak_rss_kb"],
+            "queries": end["queries"] - self.start["queries"],
+            "rows_scanned": end["rows_scanned"] - self.start["rows_scanned"],
+            "objects": end["objects"] - self.start["objects"]}
+        return False
+
+    def _sample(self):
+        times = os.times()
+        return {
+            "wall": time.time(), "cpu": times[0] + times[1],
+            "peak_rss_kb": resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss,
+            "queries": self.counter.queries,
+            "rows_scanned": self.counter.rows,
+            "objects": elements.element._factory.created}
+
+
+def _run_case(template_file, env, cfg, encoding):
+    counter = QueryCounter()
+    counter.install()
+    output_dir = tempfile.mkdtemp()
+    stats = {}
+    try:
+        with _Phase(counter) as phase:
+            doc_builder = formatCIM.parse_template(
+                template_file, dict(env), cfg)
+        stats["parse"] = phase.stats
+        with _Phase(counter) as phase:
+            doc = formatCIM.build_doc(doc_builder)
+        stats["build"] = phase.stats
+        with _Phase(counter) as phase:
+            pyesdoc.validate(doc)
+        stats["validate"] = phase.stats
+        with _Phase(counter) as phase:
+            pyesdoc.write(doc, output_dir, encoding)
+        stats["write"] = phase.stats
+    finally:
+        counter.uninstall()
+        shutil.rmtree(output_dir)
+    return stats
+
+
+def _fastest(runs):
+    # Times are the fastest of the runs, the peak RSS is the largest.
+    # Counts are the same for every run.
+    phases = {}
+    for phase in PHASES:
+        stats = dict(runs[0][phase])
+        for run in runs[1:]:
+            stats["wall"] = min(stats["wall"], run[phase]["wall"])
+            stats["cpu"] = min(stats["cpu"], run[phase]["cpu"])
+            stats["peak_rss_kb"] = max(
+                stats["peak_rss_kb"], run[phase]["peak_rss_kb"])
+        phases[phase] = stats
+    return phases
+
+
+def _cli():
+    usage = (
+        "[-b baseline_file] [-d db_dir] [-f xml|json|html] [-n repeats] "
+        "[-o output_file] [-r threshold]")
+    return PyesdocCli("b:d:f:n:o:r:", [], usage)
+
+
+if __name__ == "__main__":
+    main()
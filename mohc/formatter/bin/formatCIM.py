@@ -8,8 +8,13 @@
 extracted from some sort of metadata store.
 
 USAGE: formatCIM.py [-c config_dir] -d model|experiment|submodel
-    [-e expt_name] -f xml|json|html [-m model_name] -o output_dir
+    [-e expt_name] -f xml|json|html[,...] [-m model_name] -o output_dir
     -p project [-s submodel_name] -t template_file
+    [--gzip] [--layout flat|tree|hashed] [--memprofile report_file]
+    [--parallel] [--profile profile_file] [--skip-unchanged]
+    [--snapshot snapshot_file] [--submodels all|name[,...]] [--timings]
+    [--trace trace_file]
+       formatCIM.py --help
 
 -c config_dir
     Points to the directory containing your local "format.cfg" file.
@@ -25,8 +30,11 @@ USAGE: formatCIM.py [-c config_dir] -d model|experiment|submodel
     how your DAOs query your metadata store. For example, a name could
     be a key for a database table, or a CIM short name.
 
--f xml|json|html
-    Specifies the format of the output document.
+-f xml|json|html[,...]
+    Specifies the format of the output document. Give a
+    comma-separated list, such as "xml,json,html", to write the
+    document in each format. The document is only built and validated
+    once, and there is one output file per format.
 
 -m model_name
     Specifies the name or id of the model to extract metadata for.
@@ -51,6 +59,75 @@ USAGE: formatCIM.py [-c config_dir] -d model|experiment|submodel
     At the moment the format is documented in lib/template.py. Once it
     has stabilised it will be documented more thoroughly elsewhere.
 
+--gzip
+    Writes gzipped files, with ".gz" added to their names.
+
+--layout flat|tree|hashed
+    Where to put the files in output_dir. flat, the default, puts
+    them all in output_dir. tree puts them in
+    <institute>/<project>/<document type> sub-directories and hashed
+    spreads them over 256 sub-directories named from the document's
+    id, so no directory gets too big when many documents are written
+    to one output_dir. With --gzip, --layout or --skip-unchanged, each
+    file is written to a temporary file and renamed into place, and
+    listed in output_dir's "doc_index.jsonl" with the document's id,
+    type and encoding.
+
+--memprofile report_file
+    Writes a memory report to report_file. It has a snapshot after
+    parsing the template, building the document, validating it and
+    writing it, with the process's RSS, the retained size of the
+    template's build tree and of the document, the largest types of
+    object, the number of daos and pyesdoc objects of each type and,
+    if the pytracemalloc package is installed, the top allocation
+    sites.
+
+--parallel
+    Writes the document's formats at the same time, each in its own
+    process, when there is more than one.
+
+--profile profile_file
+    Runs the program under cProfile and writes the profile to
+    profile_file, for reading with pstats. The time taken by each
+    phase of the run (reading the config, parsing the template,
+    building the document, saving ids, validating and writing) is
+    written as JSON to profile_file.json.
+
+--skip-unchanged
+    Only writes the document if it has changed since it was last
+    written to output_dir. Apart from their ids and creation dates,
+    which are new every time, the document is compared with the one
+    recorded in output_dir's "doc_hashes.json". If they're the same,
+    the files already written are kept and the document's elements
+    keep their old ids in the id store. See lib/output.py.
+
+--snapshot snapshot_file
+    Writes a snapshot of the metadata used to build the document to
+    snapshot_file (gzipped if the name ends in ".gz"). renderCIM.py
+    can build the document again from the snapshot, in any format,
+    without going back to the metadata store. See lib/snapshot.py.
+
+--submodels all|name[,...]
+    With -d model, also writes a sub-model document for each of the
+    model's components with the given names, or for all of them. The
+    documents are taken from the model document rather than built
+    again, so this is much quicker than running formatCIM.py with
+    -d submodel for each one. They are written (in the same formats)
+    before the model document and, as they are for review, they are
+    written even if they don't pass validation. See lib/submodels.py.
+
+--timings
+    Prints the time taken by each phase of the run on stderr.
+
+--trace trace_file
+    Writes a trace of the document build to trace_file, in the Chrome
+    trace-event JSON format that Perfetto (https://ui.perfetto.dev)
+    can display. There is a span for each template node, each row a
+    node expands to and each metadata query.
+
+--help
+    Prints this message.
+
 ASSUMED PYTHON ENVIRONMENT
     You need to run the script using python2.7. You need the following
     in your PYTHONPATH:
@@ -85,39 +162,116 @@ NOTES
     check for validation errors and it will report any it finds, but
     it will still save the document out so you can check it, rather
     than exiting as soon as it sees validation problems.
+
+    If your format.cfg has a [query_stats] section, the program totals
+    the time taken by each kind of metadata query and prints the
+    totals when it exits. Set slow_query_ms in the section to log each
+    query that takes at least that many milliseconds, and log_file to
+    write the log and totals to a file instead of stderr.
+
+    pyesdoc, the elements package and the metadata store's modules
+    are only imported once they're needed, so usage errors and --help
+    are reported without waiting for them.
 """
 
+import atexit
+import cProfile
+import importlib
+import multiprocessing
 import os
 import sys
 
-import pyesdoc
-
+import build_queue
+import build_trace
 from cli import PyesdocCli
 import config
-import dao
-import elements
-import template
+from lazy_import import lazy_module
+from memprofile import MemoryProfiler
+import output
+from timings import PhaseTimer
+
+# These take most of the start-up time, so they're only imported when
+# we get as far as using them, rather than for usage errors or --help.
+pyesdoc = lazy_module("pyesdoc")
+dao = lazy_module("dao")
+query_hook = lazy_module("dao.query_hook")
+elements = lazy_module("elements")
+snapshot = lazy_module("snapshot")
+submodels = lazy_module("submodels")
+subtree_cache = lazy_module("subtree_cache")
+template = lazy_module("template")
+
+
+# The options naming the metadata each document type needs.
+DOC_OPTIONS = {
+    "model": ["-m"], "experiment": ["-e", "-m"], "submodel": ["-m", "-s"]}
+
+timer = PhaseTimer()
+
+# The document and output directory being written by write_doc's
+# worker processes.
+_writing = None
 
 
 def main():
     option = check_usage()
-    dao_env = dao_metadata(option)
-    cfg = read_config(option)
-    doc_builder = parse_template(option["-t"], dao_env, cfg)
-    doc = build_doc(doc_builder)
-    save_doc(doc, doc_builder["node"], option["-o"], option["-f"])
+    profiler = _start_profile(option)
+    memprofiler = _start_memprofile(option)
+    tracer = None
+    try:
+        dao_env = dao_metadata(option)
+        with timer.phase("read_config"):
+            cfg = read_config(option)
+        _start_query_stats(cfg)
+        recorder = _start_snapshot(option)
+        with timer.phase("parse_template"):
+            doc_builder = parse_template(
+                option["-t"], dao_env, cfg, recorder)
+            _watch(memprofiler, "build tree", doc_builder)
+        tracer = _start_trace(option, cfg)
+        with timer.phase("build_doc"):
+            doc = build_doc(doc_builder)
+            _watch(memprofiler, "document", doc)
+        with timer.phase("compare"):
+            version = compare_doc(option, doc, doc_builder)
+        with timer.phase("save_ids"):
+            save_ids(doc_builder)
+        _save_snapshot(option, recorder)
+        save_submodels(option, doc)
+        save_doc(
+            doc, doc_builder.node, option["-o"], option["-f"],
+            "--parallel" in option, version, output_writer(option))
+    finally:
+        # save_doc exits with an error for invalid documents, so we
+        # report from here rather than at the end of main.
+        _report_timings(option, profiler)
+        _save_trace(option, tracer)
+        _save_memprofile(option, memprofiler)
     return
 
 
 def check_usage():
+    if "--help" in sys.argv[1:]:
+        print __doc__
+        sys.exit(0)
     cli = _cli()
     option = cli.check_usage(sys.argv)
-    if not cli.is_format_valid(option["-f"]):
-        cli.usage_exit()
+    check_formats(cli, option)
     _check_doc_option(cli, option)
+    if option.get("--layout", "flat") not in output.LAYOUTS:
+        cli.usage_exit()
+    if "--submodels" in option and option["-d"] != "model":
+        error_exit("--submodels needs a model doc")
     return option
 
 
+def check_formats(cli, option):
+    for format in cli.formats(option["-f"]):
+        if not cli.is_format_valid(format):
+            cli.usage_exit()
+    return
+
+
 def error_exit(msg):
     cli = _cli()
     cli.error_exit(msg)
@@ -125,7 +279,8 @@ def error_exit(msg):
 
 def dao_metadata(option):
     metadata_opt = {
-        "-e": "experiment", "-m": "model", "-p": "project", "-s": "submodel"}
+        "-e": "experiment", "-m": "model", "-o": "output_dir",
+        "-p": "project", "-s": "submodel"}
     dao = {}
     for opt in metadata_opt:
         try:
@@ -153,12 +308,16 @@ def read_config(option):
     return cfg
 
 
-def parse_template(template_file, dao_env, cfg):
+def parse_template(template_file, dao_env, cfg, recorder=None):
+    """ Returns the doc_builder tree for template_file. If recorder is
+    a snapshot.Snapshot, the metadata the tree's daos return is
+    recorded in it.
+    """
     try:
         t = open(template_file)
     except IOError:
         error_exit("Can't open template file %s" % template_file)
-    return _doc_builder(t, dao_env, cfg)
+    return _doc_builder(t, dao_env, cfg, recorder)
 
 
 def build_doc(doc_builder):
@@ -172,26 +331,82 @@ def build_doc(doc_builder):
     the top-level structure as we go.
     """
 
-    top_level = doc_builder["node"]
+    top_level = doc_builder.node
     doc = top_level.make_doc_from_metadata({}, [])
     constraint = {"id": top_level.id()}
 
-    for node in doc_builder["contents"]:
-        node["node"].container_metadata(top_level)
-        if _is_leaf(node):
-            node["node"].add_to_doc_from_metadata(constraint, doc)
-        else:
-            _build_container(constraint, doc, node)
+    for node in doc_builder.contents:
+        node.node.container_metadata(top_level)
+        _build_container(constraint, doc, node)
     return doc
 
 
-def save_doc(doc, top_node, output_path, output_format):
-    encoding = _cli().encoding(output_format)
-    invalid = pyesdoc.validate(doc)
+def compare_doc(option, doc, doc_builder):
+    """ Returns an output.DocVersion for doc if we're only writing
+    changed documents, otherwise None. If doc hasn't changed, its
+    elements are given their old ids in the id store.
+    """
+    if "--skip-unchanged" not in option:
+        return None
+    cli = _cli()
+    encodings = [cli.encoding(format) for format in cli.formats(option["-f"])]
+    names = [option[opt] for opt in ["-m", "-e", "-s"]
+             if opt in DOC_OPTIONS[option["-d"]]]
+    manifest = output.OutputManifest(output.manifest_dir(option["-o"]))
+    version = manifest.compare(
+        output.doc_key(option["-p"], option["-d"], names), doc, encodings)
+    if version.unchanged():
+        doc_builder.node.id_dao.replace_ids(version.id_map())
+    return version
+
+
+def output_writer(option):
+    """ Returns the output.OutputLayout to write the document with, or
+    None to write it with pyesdoc.write.
+    """
+    if not [opt for opt in ["--gzip", "--layout", "--skip-unchanged"]
+            if opt in option]:
+        return None
+    return output.OutputLayout(
+        option.get("--layout", "flat"), "--gzip" in option)
+
+
+def save_ids(doc_builder):
+    """ Saves the ids of the elements we've built, if the template
+    uses a persistent id store.
+    """
+    try:
+        doc_builder.node.id_dao.flush()
+    except dao.dao_exception.DaoConnectionException as e:
+        error_exit("Couldn't save document ids: %s" % e)
+    return
+
+
+def save_doc(doc, top_node, output_path, output_format, parallel=False,
+             version=None, writer=None):
+    """ Validates doc and writes it to output_path in each of the
+    comma-separated formats in output_format, with writer (see
+    write_doc). If version is an output.DocVersion (see compare_doc),
+    doc isn't written if it's unchanged.
+    """
+    cli = _cli()
+    encodings = [cli.encoding(format) for format in cli.formats(output_format)]
+    with timer.phase("validate"):
+        invalid = pyesdoc.validate(doc)
     try:
-        path = pyesdoc.write(doc, output_path, encoding)
-        print "File written to %s" % path
-        os.chmod(path, 0644)
+        if version is not None and version.unchanged():
+            for path in version.paths:
+                print "File unchanged at %s" % path
+        else:
+            with timer.phase("write"):
+                paths = write_doc(
+                    doc, output_path, encodings, parallel, writer)
+            for path in paths:
+                print "File written to %s" % path
+                os.chmod(path, 0644)
+            if version is not None:
+                version.manifest.record(version, encodings, paths)
+                version.manifest.save()
     except Exception as e:
         error_exit("save_file raised an error: %s" % e)
     if len(invalid) != 0:
@@ -201,22 +416,102 @@ def save_doc(doc, top_node, output_path, output_format):
     return
 
 
+def save_submodels(option, model_doc):
+    """ Writes a document for each of model_doc's components named by
+    the --submodels option, if it's given. Sub-models that don't pass
+    validation are reported, but don't stop the run.
+    """
+    if "--submodels" not in option:
+        return
+    cli = _cli()
+    encodings = [cli.encoding(format) for format in cli.formats(option["-f"])]
+    names = None
+    if option["--submodels"] != "all":
+        names = option["--submodels"].split(",")
+    try:
+        components = submodels.find(model_doc, names)
+    except submodels.SubModelError as e:
+        error_exit(str(e))
+    writer = output_writer(option)
+    with timer.phase("submodels"):
+        for component in components:
+            with submodels.standalone(component):
+                invalid = pyesdoc.validate(component)
+                try:
+                    paths = write_doc(
+                        component, option["-o"], encodings,
+                        "--parallel" in option, writer)
+                except Exception as e:
+                    error_exit("save_file raised an error: %s" % e)
+            for path in paths:
+                print "File written to %s" % path
+                os.chmod(path, 0644)
+            if len(invalid) != 0:
+                sys.stderr.write(
+                    "Sub-model %s didn't pass validation checks: %d "
+                    "invalid nodes\n" % (component.short_name, len(invalid)))
+    return
+
+
+def write_doc(doc, output_path, encodings, parallel=False, writer=None):
+    """ Writes doc in each of encodings and returns the paths written,
+    in the same order. If parallel is true, each encoding is written by
+    its own process. Files are written by writer, an
+    output.OutputLayout, or by pyesdoc.write if it's None.
+    """
+    write = pyesdoc.write if writer is None else writer.write
+    if not parallel or len(encodings) < 2:
+        return [write(doc, output_path, encoding) for encoding in encodings]
+    # The worker processes are forked from this one, so they already
+    # have the document and don't need it sent to them.
+    global _writing
+    _writing = (doc, output_path, write)
+    pool = multiprocessing.Pool(len(encodings))
+    try:
+        results = pool.map(_write_encoding, encodings)
+    finally:
+        pool.close()
+        pool.join()
+        _writing = None
+    for path, error in results:
+        if error is not None:
+            raise Exception(error)
+    return [path for path, error in results]
+
+
+def _write_encoding(encoding):
+    # Returns (path, None), or (None, message) if the write failed:
+    # a pool can't pass back exceptions it can't pickle, and pyesdoc's
+    # exceptions can't be pickled.
+    doc, output_path, write = _writing
+    try:
+        return write(doc, output_path, encoding), None
+    except Exception as e:
+        return None, str(e)
+
+
 def _cli():
     usage = (
         "[-c config_dir] -d model|experiment|submodel "
-        "[-e expt_name] -f xml|json|html [-m model_name] -o output_dir "
-        "-p project [-s submodel_name] -t template_file")
+        "[-e expt_name] -f xml|json|html[,...] [-m model_name] "
+        "-o output_dir "
+        "-p project [-s submodel_name] -t template_file "
+        "[--gzip] [--layout flat|tree|hashed] [--memprofile report_file] "
+        "[--parallel] [--profile profile_file] [--skip-unchanged] "
+        "[--snapshot snapshot_file] [--submodels all|name[,...]] "
+        "[--timings] [--trace trace_file]")
     cli = PyesdocCli(
-        "c:d:e:f:m:o:p:s:t:", ["-d", "-f", "-o", "-p", "-t"], usage)
+        "c:d:e:f:m:o:p:s:t:", ["-d", "-f", "-o", "-p", "-t"], usage,
+        [
+            "gzip", "layout=", "memprofile=", "parallel", "profile=",
+            "skip-unchanged", "snapshot=", "submodels=", "timings",
+            "trace="])
     return cli
 
 
 def _check_doc_option(cli, option):
-    extra = {
-        "model": ["-m"], "experiment": ["-e", "-m"],
-        "submodel": ["-m", "-s"]}
     try:
-        for required_extra in extra[option["-d"]]:
+        for required_extra in DOC_OPTIONS[option["-d"]]:
             if required_extra not in option:
                 error_exit("Require option %s to make %s doc" % (
                     required_extra, option["-d"]))
@@ -225,54 +520,142 @@ def _check_doc_option(cli, option):
     return
 
 
-def _doc_builder(template_stream, dao_env, cfg):
+def _start_profile(option):
+    if "--profile" not in option:
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _report_timings(option, profiler):
+    if profiler is not None:
+        profiler.disable()
+        profile_path = option["--profile"]
+        try:
+            profiler.dump_stats(profile_path)
+            timer.save("%s.json" % profile_path)
+        except IOError as e:
+            sys.stderr.write("Couldn't save profile: %s\n" % e)
+    if "--timings" in option:
+        sys.stderr.write("%s\n" % timer.summary())
+    return
+
+
+def _start_memprofile(option):
+    if "--memprofile" not in option:
+        return None
+    memprofiler = MemoryProfiler()
+    snapshot_phases = ["parse_template", "build_doc", "validate", "write"]
+
+    def take_snapshot(phase):
+        if phase in snapshot_phases:
+            memprofiler.snapshot(phase)
+    timer.listeners.append(take_snapshot)
+    return memprofiler
+
+
+def _watch(memprofiler, name, obj):
+    if memprofiler is not None:
+        memprofiler.watch(name, obj)
+    return
+
+
+def _save_memprofile(option, memprofiler):
+    if memprofiler is None:
+        return
+    try:
+        memprofiler.save(option["--memprofile"])
+    except IOError as e:
+        sys.stderr.write("Couldn't save memory report: %s\n" % e)
+    return
+
+
+def _start_query_stats(cfg):
+    if "query_stats" not in cfg:
+        return None
+    section = cfg["query_stats"]
+    slow_ms = None
+    if "slow_query_ms" in section:
+        try:
+            slow_ms = float(section["slow_query_ms"])
+        except ValueError:
+            error_exit("slow_query_ms must be a number of milliseconds")
+    log = sys.stderr
+    if "log_file" in section:
+        try:
+            log = open(section["log_file"], "a")
+        except IOError as e:
+            error_exit("Can't open query log: %s" % e)
+    stats = query_hook.QueryStats(slow_ms, log)
+    query_hook.add_hook(stats)
+    atexit.register(stats.dump, log)
+    return stats
+
+
+def _start_trace(option, cfg):
+    # The build functions and methods are only wrapped when we're
+    # tracing, so untraced runs aren't slowed down.
+    if "--trace" not in option:
+        return None
+    tracer = build_trace.Tracer()
+    module = sys.modules[__name__]
+    tracer.trace(module, "build_doc", build_trace.build_label)
+    tracer.trace_between(
+        build_queue.BuildQueue, "start_node", "finish_node",
+        build_trace.container_label)
+    tracer.trace_elements(elements.element.Element)
+    tracer.trace_queries(importlib.import_module(cfg["global"]["daopkg"]))
+    return tracer
+
+
+def _save_trace(option, tracer):
+    if tracer is None:
+        return
+    tracer.uninstall()
+    try:
+        tracer.save(option["--trace"])
+    except IOError as e:
+        sys.stderr.write("Couldn't save trace: %s\n" % e)
+    return
+
+
+def _start_snapshot(option):
+    if "--snapshot" not in option:
+        return None
+    return snapshot.Snapshot()
+
+
+def _save_snapshot(option, recorder):
+    if recorder is None:
+        return
+    try:
+        recorder.save(option["--snapshot"])
+    except (IOError, snapshot.SnapshotError) as e:
+        error_exit("Couldn't save snapshot: %s" % e)
+    return
+
+
+def _doc_builder(template_stream, dao_env, cfg, recorder=None):
     try:
         parsed_template = template.parse_template(template_stream)
+        if recorder is not None:
+            return recorder.record_builder(parsed_template, dao_env, cfg)
         return template.doc_builder(parsed_template, dao_env, cfg)
     except template.TemplateError as err:
         error_exit(str(err))
 
 
 def _build_container(constraint, parent_doc, node):
-    """ Builds a pyesdoc structure for an element that contains other
-    elements, and calls itself recursively to fill in the contents.
+    """ Builds a pyesdoc structure for an element and everything below
+    it, and adds it to parent_doc. The tree is walked with a queue of
+    tasks rather than by recursion (see build_queue).
     """
-    if _is_leaf(node):
-        return node["node"].add_to_doc_from_metadata(constraint, parent_doc)
-    # If we get to here, node is a container. It may also be a node
-    # type that can be expanded out to a list of nodes (such as
-    # sub-model), so we need to loop over each instance, make a
-    # document for each one and add all the node's contents to it.
-    daos = node["node"].daos_for_node(constraint)
-    for dao in daos:
-        # Make document for current node.
-        node["node"].dao = dao
-        node_doc = node["node"].make_doc_from_metadata(
-            constraint, _leaf_types(node))
-        # Add node's contents to the current document.
-        for leaf in node["contents"]:
-            leaf["node"].container_metadata(node["node"])
-            # Leaf may be a container in its own right.
-            _build_container(constraint, node_doc, leaf)
-        node["node"].add_to_doc(parent_doc, node_doc)
+    queue = build_queue.BuildQueue(constraint, subtree_cache.cache)
+    queue.build(node, parent_doc)
     return
 
 
-def _is_leaf(node):
-    return len(node["contents"]) == 0
-
-
-def _leaf_types(node):
-    #  Metadata for some nodes depends on their contents. For example,
-    #  GridMosaic needs attribute is_leaf set to true if it contains
-    #  GridTiles, and it is set to false if it contains GridMosaic
-    #  children.
-    leaf_types = []
-    for leaf in node["contents"]:
-        leaf_types.append(leaf["node"])
-    return leaf_types
-
-
 if __name__ == "__main__":
     # try:
     main()
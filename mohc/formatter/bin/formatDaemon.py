@@ -0,0 +1,237 @@
+#!/usr/local/sci/bin/python2.7
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3 see
+# <http://www.gnu.org/licenses/>
+
+""" Long-running formatter that builds CIM documents on request.
+
+USAGE: formatDaemon.py [-c config_dir] [-p port]
+
+-c config_dir
+    Points to the directory containing your local "format.cfg" file,
+    as for formatCIM.py.
+
+-p port
+    Port to listen on. The daemon only listens on the loopback
+    interface (127.0.0.1). The default port is 8000.
+
+Running formatCIM.py for each document means importing pyesdoc,
+reading the config, parsing the template and reading every CSV table
+from disk for every document. The daemon does all of that once and
+keeps it in memory between requests:
+
+- format.cfg is read again only when it changes;
+- each template is parsed again only when its file changes;
+- with dao.crem_csv, each CSV table is read again only when its file
+  changes.
+
+Only the parsing of templates is cached, not the tree of elements and
+daos that doc_builder makes from them. That tree is made for one
+request: its daos hold the request's model, experiment and so on, and
+its id store belongs to the request's output directory and collects
+the ids of the document being built. A cached tree would have to be
+kept for each combination of these and have its id store and daos
+reset for each request, and would save only a few milliseconds, as
+making the tree takes a small fraction of the time the build's queries
+take.
+
+To build a document, POST a JSON object to /build, with the same
+information you would give formatCIM.py:
+
+    {"doc": "experiment", "model": "HadGEM2-ES",
+     "experiment": "rcp85", "project": "CMIP5", "format": "xml",
+     "output": "/path/to/output_dir",
+     "template": "/path/to/templates/experiment.fmt"}
+
+"submodel" names the sub-model for submodel documents. "format" can be
+a comma-separated list of formats, such as "xml,json,html", to write
+the document in each format from one build. The response is a JSON
+object with the "paths" of the documents written (by format), the
+"path" of the first one, the
+"invalid" nodes pyesdoc found and the build time in "seconds". Errors
+are returned with status 400 (for a bad request) or 500, and an
+"error" message. GET /status returns the cached templates and
+tables.
+
+For example:
+
+    curl -d @request.json http://127.0.0.1:8000/build
+
+Requests are handled one at a time.
+"""
+
+import BaseHTTPServer
+import json
+import os
+import sys
+import time
+
+import pyesdoc
+
+from cli import PyesdocCli
+import config
+import dao
+from dao import crem_csv
+import doc_request
+from doc_request import RequestError
+import formatCIM
+import template
+
+
+class FormatService(object):
+    """ Builds documents for requests, keeping the config, parsed
+    templates and CSV tables in memory between requests.
+    """
+
+    def __init__(self, config_dir=None):
+        self.format_config = config.FormatConfig(dir=config_dir)
+        self.cfg = None
+        self.cfg_version = None
+        self.templates = {}
+        self.table_cache = crem_csv.TableCache()
+        crem_csv.table_cache = self.table_cache
+
+    def build(self, request):
+        """ Builds, validates and writes the document for request and
+        returns a description of the result.
+        """
+        start = time.time()
+        _check_request(request)
+        formats, encodings = self._encodings(request["format"])
+        # The tree is made for this request only (see the module
+        # docstring).
+        doc_builder = doc_request.doc_builder(
+            request, self.template(request["template"]), self.config())
+        doc = formatCIM.build_doc(doc_builder)
+        doc_builder.node.id_dao.flush()
+        invalid = pyesdoc.validate(doc)
+        paths = formatCIM.write_doc(doc, request["output"], encodings)
+        for path in paths:
+            os.chmod(path, 0644)
+        return {
+            "path": paths[0], "paths": dict(zip(formats, paths)),
+            "invalid": invalid, "seconds": time.time() - start}
+
+    def config(self):
+        """ Returns the configuration, reading it again if format.cfg
+        has changed.
+        """
+        version = _file_version(self.format_config.config_path())
+        if self.cfg is None or version != self.cfg_version:
+            cfg = self.format_config.read_config()
+            if "daopkg" not in cfg.get("global", {}):
+                raise RequestError("Missing daopkg in global configuration")
+            self.cfg = cfg
+            self.cfg_version = version
+        return self.cfg
+
+    def template(self, template_file):
+        """ Returns the parsed template, parsing it again if the file
+        has changed.
+        """
+        try:
+            version = _file_version(template_file)
+            cached_version, parsed = self.templates[template_file]
+            if cached_version == version:
+                return parsed
+        except OSError:
+            raise RequestError("Can't open template file %s" % template_file)
+        except KeyError:
+            pass
+        try:
+            with open(template_file) as template_stream:
+                parsed = template.parse_template(template_stream)
+        except IOError:
+            raise RequestError("Can't open template file %s" % template_file)
+        self.templates[template_file] = (version, parsed)
+        return parsed
+
+    def status(self):
+        return {
+            "templates": sorted(self.templates),
+            "tables": sorted(self.table_cache.tables)}
+
+    def _encodings(self, output_format):
+        cli = formatCIM._cli()
+        formats = cli.formats(output_format)
+        for format in formats:
+            if not cli.is_format_valid(format):
+                raise RequestError("Unknown format %s" % format)
+        return formats, [cli.encoding(format) for format in formats]
+
+
+class FormatRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Passes /build requests to the server's FormatService. """
+
+    def do_POST(self):
+        if self.path != "/build":
+            self._reply(404, {"error": "Unknown path %s" % self.path})
+            return
+        try:
+            length = int(self.headers.getheader("content-length", 0))
+            request = json.loads(self.rfile.read(length))
+            self._reply(200, self.server.service.build(request))
+        except (ValueError, RequestError, template.TemplateError,
+                dao.dao_exception.DaoMetadataException) as e:
+            self._reply(400, {"error": str(e)})
+        except Exception as e:
+            self._reply(500, {"error": "%s: %s" % (type(e).__name__, e)})
+        return
+
+    def do_GET(self):
+        if self.path != "/status":
+            self._reply(404, {"error": "Unknown path %s" % self.path})
+            return
+        self._reply(200, self.server.service.status())
+        return
+
+    def _reply(self, status, body):
+        text = json.dumps(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+        return
+
+
+def main():
+    cli = _cli()
+    option = cli.check_usage(sys.argv)
+    try:
+        port = int(option.get("-p", 8000))
+    except ValueError:
+        cli.usage_exit()
+    server = make_server(FormatService(option.get("-c")), port)
+    print "Listening on http://127.0.0.1:%d" % server.server_port
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return
+
+
+def make_server(service, port):
+    server = BaseHTTPServer.HTTPServer(
+        ("127.0.0.1", port), FormatRequestHandler)
+    server.service = service
+    return server
+
+
+def _check_request(request):
+    doc_request.check(request)
+    return
+
+
+def _file_version(path):
+    stat = os.stat(path)
+    return (stat.st_mtime, stat.st_size)
+
+
+def _cli():
+    return PyesdocCli("c:p:", [], "[-c config_dir] [-p port]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/local/sci/bin/python2.7
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3 see
+# <http://www.gnu.org/licenses/>
+
+""" CLI that builds a CIM document from a metadata snapshot.
+
+USAGE: renderCIM.py -f xml|json|html[,...] -i snapshot_file -o output_dir
+    [--parallel]
+
+-f xml|json|html[,...]
+    Specifies the format of the output document, or a comma-separated
+    list of formats, as for formatCIM.py.
+
+-i snapshot_file
+    A snapshot written by formatCIM.py's --snapshot option.
+
+-o output_dir
+    Location to store the output document.
+
+--parallel
+    Writes each format in its own process, as for formatCIM.py.
+
+The snapshot holds the template and the metadata the document was
+built from, so the metadata store (and the dao package used to read
+it) isn't needed. Use it to write a document in another format, or to
+build it again after changing the elements, without running any
+queries. As with formatCIM.py, the document is validated and written
+even if it has validation errors, and then the program exits with an
+error.
+
+If the template uses a persistent id store, the document's new ids
+are saved in output_dir, as formatCIM.py would.
+"""
+
+import sys
+
+from cli import PyesdocCli
+import formatCIM
+from lazy_import import lazy_module
+
+snapshot = lazy_module("snapshot")
+template = lazy_module("template")
+
+
+def main():
+    option = check_usage()
+    try:
+        recorded = snapshot.load(option["-i"])
+        doc_builder = recorded.replay_builder(option["-o"])
+    except IOError as e:
+        formatCIM.error_exit("Can't open snapshot: %s" % e)
+    except (snapshot.SnapshotError, template.TemplateError) as e:
+        formatCIM.error_exit(str(e))
+    doc = formatCIM.build_doc(doc_builder)
+    formatCIM.save_ids(doc_builder)
+    formatCIM.save_doc(
+        doc, doc_builder.node, option["-o"], option["-f"],
+        "--parallel" in option)
+    return
+
+
+def check_usage():
+    cli = _cli()
+    option = cli.check_usage(sys.argv)
+    formatCIM.check_formats(cli, option)
+    return option
+
+
+def _cli():
+    return PyesdocCli(
+        "f:i:o:", ["-f", "-i", "-o"],
+        "-f xml|json|html[,...] -i snapshot_file -o output_dir "
+        "[--parallel]", ["parallel"])
+
+
+if __name__ == "__main__":
+    main()
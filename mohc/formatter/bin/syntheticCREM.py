@@ -0,0 +1,351 @@
+#!/usr/local/sci/bin/python2.7
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3 see
+# <http://www.gnu.org/licenses/>
+
+""" CLI that makes a larger, synthetic CSV dump of the CREM database
+from the bundled one, for benchmarks and scaling tests.
+
+USAGE: syntheticCREM.py [-b breadth] [-d depth] [-i input_dir]
+    -o output_dir -x scale
+
+-b breadth
+    Number of top-level components in each model, and of children
+    for each component above the deepest level. Setting -b or -d
+    replaces each model's component tree with a synthetic one. The
+    default breadth is 8.
+
+-d depth
+    Number of levels in each synthetic component tree. The default is
+    the depth of the input trees.
+
+-i input_dir
+    Directory holding the tbl*.csv files to scale up. The default is
+    the csv directory of this package.
+
+-o output_dir
+    Directory to write the synthetic tbl*.csv files to. It is created
+    if it doesn't exist.
+
+-x scale
+    Number of copies of the input models, with their components,
+    attributes, references, experiments, simulations, runs,
+    conformances and grids, to write. For example 10, 100 or 1000.
+
+Copies are referentially consistent: every id is offset by a
+multiple of the largest id in its table, and every column that refers
+to a copied table is offset in the same way. Tables that are shared
+between models (activities, ancillaries, code lists, people,
+organisations and requirements) are written once.
+
+The first copy keeps the input's model names, so the usual model,
+experiment and submodel documents (for example HadGEM2-ES, rcp85 and
+Aerosols) can still be built from the output. Other copies name each
+model SYN_<model id>_<copy>, and the model's experiments refer to it
+by that name.
+
+A synthetic component tree takes the name, description, type and
+contact of each component from an input component at the same level
+(or the deepest input level), together with that component's
+attributes and references. Names repeated within a model get a
+number on the end, so sub-models can still be found by name.
+"""
+
+import csv
+import glob
+import os
+import sys
+
+from cli import PyesdocCli
+
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# The primary key of each table that is copied.
+PRIMARY_KEY = {
+    "tblattribute": "idattribute",
+    "tblconformance": "id",
+    "tblexperiment": "idexperiment",
+    "tblgrid": "idgrid",
+    "tblgridset": "idgridset",
+    "tblgridsystem": "idgridsystem",
+    "tblmodel": "idtblmodel",
+    "tblmodelcomponent": "idtModelComponent",
+    "tblmodelrun": "idrun",
+    "tblreference": "idtblCitation",
+    "tblsimulation": "idtblsimulation"}
+
+# Columns that refer to the primary key of a copied table.
+FOREIGN_KEY = {
+    "tblattribute": {"componentid": "tblmodelcomponent"},
+    "tblconformance": {"experimentid": "tblexperiment"},
+    "tblconformancill": {
+        "conformanceid": "tblconformance", "experimentid": "tblexperiment"},
+    "tblgrid": {"idgridset": "tblgridset"},
+    "tblgridset": {"idgridsystem": "tblgridsystem"},
+    "tblmodel": {"gridsystemid": "tblgridsystem"},
+    "tblmodelcomponent": {
+        "parentComponentID": "tblmodelcomponent", "modelID": "tblmodel"},
+    "tblmodelrun": {"simulation": "tblsimulation"},
+    "tblreferencelist": {"referenceID": "tblreference"},
+    "tblsimulation": {
+        "experimentid": "tblexperiment", "modelid": "tblmodel"}}
+
+# tblreferencelist.objectID refers to a different table for each
+# objectType.
+OBJECT_TYPE = {"MODEL": "tblmodel", "COMPONENT": "tblmodelcomponent"}
+
+DEFAULT_BREADTH = 8
+
+
+def main():
+    cli = _cli()
+    option = cli.check_usage(sys.argv)
+    input_dir = option.get("-i", os.path.join(PACKAGE_DIR, "csv"))
+    try:
+        scale = _int_option(option, "-x")
+        depth = _int_option(option, "-d")
+        breadth = _int_option(option, "-b")
+    except ValueError:
+        cli.usage_exit()
+    tables = read_tables(input_dir)
+    if depth is not None or breadth is not None:
+        tables = synthetic_trees(tables, depth, breadth)
+    tables = scale_tables(tables, scale)
+    write_tables(tables, option["-o"])
+    return
+
+
+def read_tables(input_dir):
+    """ Returns {table name: Table} for the tbl*.csv files in
+    input_dir.
+    """
+    tables = {}
+    for path in sorted(glob.glob(os.path.join(input_dir, "tbl*.csv"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        with open(path) as csv_file:
+            reader = csv.reader(csv_file)
+            header = reader.next()
+            rows = [dict(zip(header, row)) for row in reader]
+        tables[name] = Table(header, rows)
+    return tables
+
+
+def write_tables(tables, output_dir):
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    for name in sorted(tables):
+        table = tables[name]
+        path = os.path.join(output_dir, "%s.csv" % name)
+        with open(path, "w") as csv_file:
+            writer = csv.writer(
+                csv_file, quoting=csv.QUOTE_ALL, lineterminator="\n")
+            writer.writerow(table.header)
+            for row in table.rows:
+                writer.writerow([row[column] for column in table.header])
+    return
+
+
+def scale_tables(tables, scale):
+    """ Returns tables with scale copies of the rows of each copied
+    table, and the rows of each shared table.
+    """
+    stride = {}
+    for name in PRIMARY_KEY:
+        if name in tables:
+            stride[name] = _max_id(tables, name)
+    scaled = {}
+    for name in tables:
+        scaled[name] = Table(tables[name].header, [])
+    for copy in range(scale):
+        renamed = _model_names(tables, copy)
+        for name in sorted(tables):
+            if copy > 0 and not _is_copied(name):
+                continue
+            for row in tables[name].rows:
+                scaled[name].rows.append(
+                    _copy_row(name, row, copy, stride, renamed))
+    return scaled
+
+
+def synthetic_trees(tables, depth=None, breadth=None):
+    """ Returns tables with each model's component tree replaced by
+    one that is depth levels deep, with breadth components at the top
+    level and breadth children for each component above the bottom
+    level.
+    """
+    components = tables["tblmodelcomponent"]
+    attributes = tables["tblattribute"]
+    references = tables["tblreferencelist"]
+    if breadth is None:
+        breadth = DEFAULT_BREADTH
+    if depth is None:
+        depth = max([int(row["level"]) for row in components.rows] or [1])
+    tree = _SyntheticTree(tables, depth, breadth)
+    for model in tables["tblmodel"].rows:
+        tree.add_model(model["idtblmodel"])
+    result = dict(tables)
+    result["tblmodelcomponent"] = Table(components.header, tree.components)
+    result["tblattribute"] = Table(attributes.header, tree.attributes)
+    result["tblreferencelist"] = Table(references.header, [
+        row for row in references.rows if row["objectType"] != "COMPONENT"
+        ] + tree.references)
+    return result
+
+
+class Table(object):
+    """ The header and rows of one CSV file. """
+
+    __slots__ = ("header", "rows")
+
+    def __init__(self, header, rows):
+        self.header = header
+        self.rows = rows
+
+
+class _SyntheticTree(object):
+    # Builds synthetic component trees, with the attribute and
+    # reference rows for their components.
+
+    def __init__(self, tables, depth, breadth):
+        self.depth = depth
+        self.breadth = breadth
+        self.components = []
+        self.attributes = []
+        self.references = []
+        self.next_id = {
+            "tblmodelcomponent": _max_id(tables, "tblmodelcomponent"),
+            "tblattribute": _max_id(tables, "tblattribute")}
+        self.source = {}
+        for row in tables["tblmodelcomponent"].rows:
+            self.source.setdefault(row["modelID"], {}).setdefault(
+                int(row["level"]), []).append(row)
+        self.source_attributes = {}
+        for row in tables["tblattribute"].rows:
+            self.source_attributes.setdefault(
+                row["componentid"], []).append(row)
+        self.source_references = {}
+        for row in tables["tblreferencelist"].rows:
+            if row["objectType"] == "COMPONENT":
+                self.source_references.setdefault(
+                    row["objectID"], []).append(row)
+
+    def add_model(self, model_id):
+        levels = self.source.get(model_id)
+        if not levels:
+            return
+        self.used = {}
+        self.names = set()
+        parents = ["NULL"]
+        for level in range(1, self.depth + 1):
+            children = []
+            for parent in parents:
+                for child in range(self.breadth):
+                    children.append(self._add_component(
+                        model_id, parent, level, levels))
+            parents = children
+        return
+
+    def _add_component(self, model_id, parent, level, levels):
+        candidates = levels[min(level, max(levels))]
+        used = self.used.get(level, 0)
+        self.used[level] = used + 1
+        source = candidates[used % len(candidates)]
+        comp_id = self._new_id("tblmodelcomponent")
+        component = dict(source)
+        component.update({
+            "idtModelComponent": comp_id, "parentComponentID": parent,
+            "level": str(level), "name": self._unique(source["name"])})
+        self.components.append(component)
+        for row in self.source_attributes.get(source["idtModelComponent"], []):
+            attribute = dict(row)
+            attribute["idattribute"] = self._new_id("tblattribute")
+            attribute["componentid"] = comp_id
+            self.attributes.append(attribute)
+        for row in self.source_references.get(
+                source["idtModelComponent"], []):
+            reference = dict(row)
+            reference["objectID"] = comp_id
+            self.references.append(reference)
+        return comp_id
+
+    def _new_id(self, name):
+        self.next_id[name] += 1
+        return str(self.next_id[name])
+
+    def _unique(self, name):
+        unique = name
+        count = 1
+        while unique in self.names:
+            count += 1
+            unique = "%s %d" % (name, count)
+        self.names.add(unique)
+        return unique
+
+
+def _copy_row(name, row, copy, stride, renamed):
+    if copy == 0:
+        return dict(row)
+    row = dict(row)
+    if name in PRIMARY_KEY:
+        key = PRIMARY_KEY[name]
+        row[key] = _offset(row[key], stride[name], copy)
+    for column, target in FOREIGN_KEY.get(name, {}).items():
+        row[column] = _offset(row[column], stride[target], copy)
+    if name == "tblreferencelist":
+        target = OBJECT_TYPE[row["objectType"]]
+        row["objectID"] = _offset(row["objectID"], stride[target], copy)
+    if name == "tblmodel":
+        row["shortname"] = renamed[row["shortname"]]
+    if name == "tblexperiment":
+        # Experiments are matched to models by the model name in the
+        # experiment's name.
+        for old in sorted(renamed, key=len, reverse=True):
+            row["name"] = row["name"].replace(old, renamed[old])
+    return row
+
+
+def _model_names(tables, copy):
+    renamed = {}
+    for row in tables.get("tblmodel", Table([], [])).rows:
+        if copy == 0:
+            renamed[row["shortname"]] = row["shortname"]
+        else:
+            renamed[row["shortname"]] = "SYN_%s_%04d" % (
+                row["idtblmodel"], copy)
+    return renamed
+
+
+def _offset(id, stride, copy):
+    if id == "NULL" or id == "":
+        return id
+    return str(int(id) + stride * copy)
+
+
+def _is_copied(name):
+    return name in PRIMARY_KEY or name in FOREIGN_KEY
+
+
+def _max_id(tables, name):
+    key = PRIMARY_KEY[name]
+    return max([int(row[key]) for row in tables[name].rows] or [0])
+
+
+def _int_option(option, flag):
+    if flag not in option:
+        return None
+    value = int(option[flag])
+    if value < 1:
+        raise ValueError("%s must be positive" % flag)
+    return value
+
+
+def _cli():
+    usage = (
+        "[-b breadth] [-d depth] [-i input_dir] -o output_dir -x scale")
+    return PyesdocCli("b:d:i:o:x:", ["-o", "-x"], usage)
+
+
+if __name__ == "__main__":
+    main()
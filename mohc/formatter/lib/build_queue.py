@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+""" Building the documents for a tree of build nodes from a queue of
+tasks.
+
+Each node of a template's tree fans out to a list of rows (one per
+sub-model, citation, responsible party and so on), each row becomes a
+pyesdoc element, and each element is filled in from the node's
+contents before it's added to the document above it. Rather than
+doing this with a Python call for each level of the tree, which can
+run into the recursion limit for deep component hierarchies, a
+BuildQueue keeps a stack of BuildTasks. A task either fans a node out
+into rows (NODE), makes the element for one row (ROW), adds a finished
+element to its document (ADD) or puts a node's template dao back once
+all its rows are done (DONE).
+
+Tasks are taken from the top of the stack and the tasks they give
+are pushed in reverse, so everything happens in the same order as a
+depth-first walk of the tree: a row's element is made, then its
+contents are built, then it's added to its document, and the next row
+is started. Elements that refer to other elements rely on this order,
+as the ids they refer to are added to the id store as the elements
+are made.
+
+A node's work is spread over many tasks, so there's no one call that
+a span (see build_trace) could wrap. Instead start_node is called as
+each node's NODE task starts and finish_node once it and everything
+below it are built. They do nothing themselves.
+"""
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3 see
+# <http://www.gnu.org/licenses/>
+
+NODE = "node"
+ROW = "row"
+ADD = "add"
+DONE = "done"
+
+
+class BuildTask(object):
+    """ A step in building a document (see the module docstring):
+    for node, with doc the element it's added to and parent the
+    element above it, if its container metadata needs setting. dao is
+    the row's dao for ROW tasks and the template's dao for DONE tasks.
+    element is the row's element, and pending its subtree_cache entry
+    if it's being kept, for ADD tasks.
+    """
+
+    __slots__ = (
+        "kind", "node", "doc", "constraint", "parent", "dao", "element",
+        "pending")
+
+    def __init__(self, kind, node, doc=None, constraint=None, parent=None,
+                 dao=None, element=None, pending=None):
+        self.kind = kind
+        self.node = node
+        self.doc = doc
+        self.constraint = constraint
+        self.parent = parent
+        self.dao = dao
+        self.element = element
+        self.pending = pending
+
+
+class BuildQueue(object):
+    """ Builds trees of build nodes for the document with constraint.
+    cache is a subtree_cache.SubtreeCache to reuse rows from, or None.
+    """
+
+    def __init__(self, constraint, cache=None):
+        self.constraint = constraint
+        self.cache = cache
+        self.tasks = []
+        self.pending = []
+        self.started = []
+        self.done = 0
+
+    def build(self, node, doc):
+        """ Builds node, and everything below it, and adds it to doc.
+        """
+        self.tasks.append(BuildTask(NODE, node, doc, self.constraint))
+        try:
+            while self.tasks:
+                self.run(self.tasks.pop())
+        finally:
+            # If a task failed, the rows still being kept in the cache
+            # are given up on, the nodes still being built are finished
+            # with and the rest of the tasks are dropped.
+            while self.pending:
+                self.cache.abandon(self.pending.pop())
+            while self.started:
+                self.finish_node(self.started.pop())
+            self.tasks = []
+        return doc
+
+    def run(self, task):
+        """ Does task, pushing the tasks that follow from it. """
+        getattr(self, "_" + task.kind)(task)
+        self.done += 1
+        return
+
+    def start_node(self, task):
+        """ Called as task, a NODE task, starts. """
+        return
+
+    def finish_node(self, task):
+        """ Called once task's node, and everything below it, are
+        built.
+        """
+        return
+
+    def _node(self, task):
+        element = task.node.node
+        if task.parent is not None:
+            element.container_metadata(task.parent)
+        self.started.append(task)
+        self.start_node(task)
+        if is_leaf(task.node) and (
+                self.cache is None or not self.cache.cacheable(task.node)):
+            element.add_to_doc_from_metadata(task.constraint, task.doc)
+            self.finish_node(self.started.pop())
+            return
+        # If we get to here, node is a container (or a leaf whose rows
+        # we may be able to reuse). It may also be a node type that can
+        # be expanded out to a list of nodes (such as sub-model), so we
+        # need a row task for each instance.
+        template_dao = element.dao
+        tasks = [
+            BuildTask(ROW, task.node, task.doc, task.constraint, dao=dao)
+            for dao in element.daos_for_node(task.constraint)]
+        # Put the template's dao back afterwards, so the next fan-out
+        # for this node starts from it rather than from the last row's
+        # dao.
+        tasks.append(BuildTask(DONE, task.node, dao=template_dao))
+        self._push(tasks)
+        return
+
+    def _row(self, task):
+        element = task.node.node
+        element.dao = task.dao
+        constraint = task.constraint
+        pending = None
+        if self.cache is not None:
+            row_element, pending = self.cache.lookup(
+                task.node, task.dao, constraint)
+            if row_element is not None:
+                element.add_to_doc(task.doc, row_element)
+                return
+            if pending is not None:
+                constraint = pending.constraint
+                self.pending.append(pending)
+        row_element = element.make_doc_from_metadata(
+            constraint, leaf_types(task.node))
+        # Add node's contents to the row's element, then add it to the
+        # document above.
+        tasks = [
+            BuildTask(NODE, leaf, row_element, constraint, parent=element)
+            for leaf in task.node.contents]
+        tasks.append(BuildTask(
+            ADD, task.node, task.doc, element=row_element, pending=pending))
+        self._push(tasks)
+        return
+
+    def _add(self, task):
+        if task.pending is not None:
+            self.cache.finish(self.pending.pop(), task.element)
+        task.node.node.add_to_doc(task.doc, task.element)
+        return
+
+    def _done(self, task):
+        task.node.node.dao = task.dao
+        self.finish_node(self.started.pop())
+        return
+
+    def _push(self, tasks):
+        self.tasks.extend(reversed(tasks))
+        return
+
+
+def is_leaf(node):
+    return len(node.contents) == 0
+
+
+def leaf_types(node):
+    #  Metadata for some nodes depends on their contents. For example,
+    #  GridMosaic needs attribute is_leaf set to true if it contains
+    #  GridTiles, and it is set to false if it contains GridMosaic
+    #  children.
+    return [leaf.node for leaf in node.contents]
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+""" Per-node tracing of the document build, written in the Chrome
+trace-event format so that it can be viewed in Perfetto or
+chrome://tracing.
+
+Nothing in the build code knows about tracing. A Tracer replaces the
+functions and methods it traces with wrappers when it is installed
+and puts the originals back when it is uninstalled, so a run that
+isn't traced pays nothing for it.
+
+Work that isn't a single call, such as building each node of the
+tree from build_queue's tasks, is traced between a call that starts
+it and one that finishes it (see trace_between).
+
+Each span is a complete ("X") event. Its args give the element type,
+the DAO class and, for the span of each row of a fan-out, the row's
+key. daos_for_node spans give the number of rows found. Every span
+gives the time its DAO queries took, in query_time_ms.
+"""
+
+import functools
+import inspect
+import json
+import os
+import thread
+import time
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3 see
+# <http://www.gnu.org/licenses/>
+
+QUERY_METHODS = ["single_row_query", "multi_row_query"]
+
+
+class Tracer(object):
+    """ Records nested spans and writes them as trace events. """
+
+    def __init__(self):
+        self.events = []
+        self.open_spans = []
+        self.patched = []
+        self.pid = os.getpid()
+
+    def trace(self, owner, name, label):
+        """ Replaces owner.name (a function in a module or a method
+        of a class) with a wrapper that records a span for each call.
+        label is called with the call's arguments and returns the
+        span's name, category and args.
+        """
+        original = owner.__dict__[name]
+        if isinstance(original, staticmethod):
+            raise TypeError("Can't trace static method %s" % name)
+        tracer = self
+
+        @functools.wraps(original)
+        def traced(*args, **kwargs):
+            span_name, category, span_args = label(*args, **kwargs)
+            return tracer._call(
+                span_name, category, span_args, original, args, kwargs)
+        self.patched.append((owner, name, original))
+        setattr(owner, name, traced)
+        return
+
+    def trace_between(self, owner, start, finish, label):
+        """ Like trace, but each span is opened by a call to
+        owner.start, labelled by label, and closed by the next call to
+        owner.finish. Spans must be closed in the reverse of the order
+        they were opened.
+        """
+        original_start = owner.__dict__[start]
+        original_finish = owner.__dict__[finish]
+        tracer = self
+
+        @functools.wraps(original_start)
+        def traced_start(*args, **kwargs):
+            tracer._open(*label(*args, **kwargs))
+            return original_start(*args, **kwargs)
+
+        @functools.wraps(original_finish)
+        def traced_finish(*args, **kwargs):
+            try:
+                return original_finish(*args, **kwargs)
+            finally:
+                tracer._close()
+        self.patched.append((owner, start, original_start))
+        setattr(owner, start, traced_start)
+        self.patched.append((owner, finish, original_finish))
+        setattr(owner, finish, traced_finish)
+        return
+
+    def trace_queries(self, dao_module):
+        """ Traces the query methods of the DAO classes defined in
+        dao_module.
+        """
+        for cls in _classes(dao_module):
+            for name in QUERY_METHODS:
+                if name in cls.__dict__:
+                    self.trace(cls, name, _query_label)
+        return
+
+    def trace_elements(self, element_class):
+        """ Traces building each node, and each row of each node, for
+        element_class and its subclasses.
+        """
+        self.trace(
+            element_class, "add_to_doc_from_metadata", _element_label)
+        self.trace(element_class, "make_doc_from_metadata", _row_label)
+        for cls in set([element_class] + _subclasses(element_class)):
+            if "daos_for_node" in cls.__dict__:
+                self.trace(cls, "daos_for_node", _expand_label)
+        return
+
+    def uninstall(self):
+        while self.patched:
+            owner, name, original = self.patched.pop()
+            setattr(owner, name, original)
+        return
+
+    def save(self, path):
+        with open(path, "w") as trace_file:
+            json.dump({
+                "traceEvents": self.events, "displayTimeUnit": "ms"},
+                trace_file)
+        return
+
+    def _call(self, name, category, args, function, call_args, kwargs):
+        self._open(name, category, args)
+        try:
+            result = function(*call_args, **kwargs)
+        finally:
+            duration = self._close()
+        if category == "query":
+            for open_span in self.open_spans:
+                open_span["args"]["query_time_ms"] += duration * 1e3
+            args["query_time_ms"] = duration * 1e3
+        if "rows" in args:
+            args["rows"] = _row_count(result)
+        return result
+
+    def _open(self, name, category, args):
+        args["query_time_ms"] = 0.0
+        self.open_spans.append({
+            "name": name, "cat": category, "ph": "X", "pid": self.pid,
+            "tid": thread.get_ident(), "args": args,
+            "ts": time.time() * 1e6})
+        return
+
+    def _close(self):
+        # Returns the span's duration in seconds.
+        span = self.open_spans.pop()
+        span["dur"] = time.time() * 1e6 - span["ts"]
+        self.events.append(span)
+        return span["dur"] / 1e6
+
+
+def build_label(doc_builder):
+    node = doc_builder.node
+    return "build_doc", "build", _node_args(node)
+
+
+def container_label(queue, task):
+    element = task.node.node
+    return type(element).__name__, "container", _node_args(element)
+
+
+def _element_label(element, constraint, doc):
+    return type(element).__name__, "element", _node_args(element)
+
+
+def _expand_label(element, constraint):
+    args = _node_args(element)
+    args["rows"] = None
+    return "%s daos_for_node" % args["element"], "dao", args
+
+
+def _row_label(element, constraint, leaves):
+    args = _node_args(element)
+    args["key"] = _row_key(element.dao)
+    return "%s row" % args["element"], "row", args
+
+
+def _query_label(dao, query, *args):
+    # CsvDao queries are (retrieve, table, constraint), and CremDao
+    # queries are (sql, parameters).
+    if len(args) == 2:
+        table, constraint = args
+        name = table
+        query_args = {"table": table, "constraint": _text(constraint)}
+    else:
+        name = "sql"
+        query_args = {"query": query, "parameters": _text(args[0])}
+    query_args.update({"dao": _dao_class(dao), "rows": None})
+    return name, "query", query_args
+
+
+def _node_args(element):
+    return {
+        "element": type(element).__name__, "dao": _dao_class(element.dao)}
+
+
+def _dao_class(dao):
+    return getattr(type(dao), "dao_class", type(dao)).__name__
+
+
+def _row_key(dao):
+    # Only the per-row handles made by daos_for_node have a key.
+    key = {}
+    for attr in getattr(type(dao), "__slots__", ()):
+        if attr != "parent":
+            key[attr] = _text(getattr(dao, attr))
+    return key or None
+
+
+def _row_count(result):
+    if isinstance(result, dict):
+        return int(len(result) > 0)
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+
+def _text(value):
+    if isinstance(value, basestring):
+        return value
+    return repr(value)
+
+
+def _classes(module):
+    return [cls for name, cls in inspect.getmembers(module, inspect.isclass)
+            if cls.__module__ == module.__name__]
+
+
+def _subclasses(cls):
+    found = []
+    for subclass in cls.__subclasses__():
+        found.append(subclass)
+        found.extend(_subclasses(subclass))
+    return found
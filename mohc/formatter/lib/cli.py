@@ -4,7 +4,9 @@ import getopt
 import os.path
 import sys
 
-import pyesdoc
+from lazy_import import lazy_module
+
+pyesdoc = lazy_module("pyesdoc")
 
 # Copyright: (C) Crown copyright 2015, the Met Office
 # License: GNU General Public License version 3 see
@@ -13,19 +15,23 @@ import pyesdoc
 class PyesdocCli(object):
     """ Utility class for command-line interface programs. """
 
-    def __init__(self, getopt_spec, required, usage):
+    def __init__(self, getopt_spec, required, usage, long_options=()):
         self.getopt = getopt_spec
+        self.long_options = list(long_options)
         self.required = required
         self.usage_msg = usage
+        # The names of the pyesdoc encodings, so that pyesdoc isn't
+        # imported just to check the options.
         self.format = {
-            "xml": pyesdoc.ENCODING_XML,
-            "json": pyesdoc.ENCODING_JSON,
-            "html": pyesdoc.ENCODING_HTML}
+            "xml": "ENCODING_XML",
+            "json": "ENCODING_JSON",
+            "html": "ENCODING_HTML"}
 
     def check_usage(self, argv):
         self.script_name = os.path.basename(argv[0])
         try:
-            opt_pair, arg = getopt.getopt(argv[1:], self.getopt)
+            opt_pair, arg = getopt.getopt(
+                argv[1:], self.getopt, self.long_options)
         except getopt.GetoptError as err:
             self.usage_exit()
         option = dict(opt_pair)
@@ -43,8 +49,18 @@ class PyesdocCli(object):
     def is_format_valid(self, format):
         return format in self.format
 
+    def formats(self, format_list):
+        """ Splits a comma-separated list of formats, leaving out any
+        repeats.
+        """
+        formats = []
+        for format in format_list.split(","):
+            if format not in formats:
+                formats.append(format)
+        return formats
+
     def encoding(self, format):
-        return self.format[format]
+        return getattr(pyesdoc, self.format[format])
 
     def _check_all_required_options_defined(self, option):
         for required in self.required:
@@ -1,2 +1,2 @@
-from id_dao import DocIdDao
+from id_dao import DocIdDao, PersistentDocIdDao
 from null_dao import NullDao
@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
 
-import copy
 from datetime import datetime
-import HTMLParser
 import re
 
-import MySQLdb
-
 from dao_exception import DaoConnectionException, DaoMetadataException
+from dao_handle import row_handle
+import query_hook
+from lazy_import import lazy_module
+
+# Not imported until the first connection, so that loading the daos
+# doesn't need the MySQL driver.
+MySQLdb = lazy_module("MySQLdb")
+HTMLParser = lazy_module("HTMLParser")
 
 
 # Copyright: (C) Crown copyright 2015, the Met Office
@@ -43,8 +47,11 @@ class CremDao(object):
 
     def single_row_query(self, query, query_param):
         self.connect()
+        start = query_hook.query_started()
         cursor = self.query(query, query_param)
         record = cursor.fetchone()
+        query_hook.query_finished(
+            self, query, query_param, start, int(bool(record)))
         self.disconnect()
         if not record:
             record = {}
@@ -52,8 +59,11 @@ class CremDao(object):
 
     def multi_row_query(self, query, query_param):
         self.connect()
+        start = query_hook.query_started()
         cursor = self.query(query, query_param)
         records = cursor.fetchall()
+        query_hook.query_finished(
+            self, query, query_param, start, len(records))
         self.disconnect()
         clean = []
         for record in records:
@@ -205,9 +215,7 @@ class ResponsiblePartyDao(CremDao):
 
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            dao.rp_id = record["contactid"]
-            daos.append(dao)
+            daos.append(row_handle(self, rp_id=record["contactid"]))
         return daos
 
     def container_metadata(self, container_dao):
@@ -257,9 +265,7 @@ class CitationDao(CremDao):
 
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            dao.cite_id = record["referenceID"]
-            daos.append(dao)
+            daos.append(row_handle(self, cite_id=record["referenceID"]))
         return daos
 
     def container_metadata(self, container_dao):
@@ -303,9 +309,7 @@ class ComponentPropertyDao(CremDao):
 
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            dao.prop_id = record["property_id"]
-            daos.append(dao)
+            daos.append(row_handle(self, prop_id=record["property_id"]))
         return daos
 
     def container_metadata(self, container_dao):
@@ -360,9 +364,7 @@ class ModelComponentRefDao(CremDao):
 
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            dao.model_id = record["id"]
-            daos.append(dao)
+            daos.append(row_handle(self, model_id=record["id"]))
         return daos
 
     def metadata(self, constraint):
@@ -415,9 +417,7 @@ class SubModelDao(CremDao):
 
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            dao.comp_id = record["compid"]
-            daos.append(dao)
+            daos.append(row_handle(self, comp_id=record["compid"]))
         return daos
 
     def container_metadata(self, container_dao):
@@ -553,9 +553,7 @@ class NumericalRequirementDao(CremDao):
 
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            dao.id = record["id"]
-            daos.append(dao)
+            daos.append(row_handle(self, id=record["id"]))
         return daos
 
     def metadata(self, constraint):
@@ -593,9 +591,7 @@ class NumericalRequirementRefDao(CremDao):
 
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            dao.reqt_id = record["id"]
-            daos.append(dao)
+            daos.append(row_handle(self, reqt_id=record["id"]))
         return daos
 
     def metadata(self, constraint):
@@ -630,9 +626,7 @@ class DataObjectDao(CremDao):
         records = self.multi_row_query(query, (constraint["id"], ))
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            dao.id = record["ancillaryid"]
-            daos.append(dao)
+            daos.append(row_handle(self, id=record["ancillaryid"]))
         return daos
 
     def metadata(self, constraint):
@@ -785,10 +779,8 @@ class EnsembleMemberDao(CremDao):
         for record in records:
             if record["start_date"] != start_date:
                 continue
-            dao = copy.copy(self)
-            dao.sim_id = record["sim_id"]
-            dao.expt_id = constraint["id"]
-            daos.append(dao)
+            daos.append(row_handle(
+                self, sim_id=record["sim_id"], expt_id=constraint["id"]))
         return daos
 
     def metadata(self, constraint):
@@ -871,11 +863,9 @@ class ConformanceDao(CremDao):
         # Finally, we can built the list of DAOs.
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            for id in ["conf_id", "reqt_id"]:
-                setattr(dao, id, record[id])
-            dao.expt_id = constraint["id"]
-            daos.append(dao)
+            daos.append(row_handle(
+                self, conf_id=record["conf_id"], reqt_id=record["reqt_id"],
+                expt_id=constraint["id"]))
         return daos
 
     def metadata(self, constraint):
@@ -980,9 +970,7 @@ class GridMosaicDao(CremDao):
         records = self.multi_row_query(query, (self.grid_sys_id, ))
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            dao.mosaic_id = record["mosaic_id"]
-            daos.append(dao)
+            daos.append(row_handle(self, mosaic_id=record["mosaic_id"]))
         return daos
 
     def metadata(self, constraint):
@@ -1016,9 +1004,7 @@ class GridTileDao(CremDao):
         records = self.multi_row_query(query, (self.mosaic_id, ))
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            dao.grid_id = record["grid_id"]
-            daos.append(dao)
+            daos.append(row_handle(self, grid_id=record["grid_id"]))
         return daos
 
     def metadata(self, constraint):
@@ -1057,6 +1043,8 @@ class DbTable(object):
     access to metadata about its parent node.
     """
 
+    __slots__ = ("id", "node_type")
+
     def __init__(self, id, node_type):
         self.id = id
         self.node_type = node_type
@@ -2,14 +2,18 @@
 
 """ Data access objects to pull metadata in from CSV files. """
 
-import copy
 import csv
 from datetime import datetime
-import HTMLParser
 import os.path
 import re
 
 from dao_exception import DaoConnectionException, DaoMetadataException
+from dao_handle import row_handle
+import query_hook
+import table_store
+from lazy_import import lazy_module
+
+HTMLParser = lazy_module("HTMLParser")
 
 
 # Copyright: (C) Crown copyright 2015, the Met Office
@@ -17,6 +21,44 @@ from dao_exception import DaoConnectionException, DaoMetadataException
 # see <http://www.gnu.org/licenses/>
 
 
+class TableCache(object):
+    """ Keeps the rows of each CSV file in memory, so that queries
+    don't re-read and re-parse the file. A file is read again if its
+    modification time or size has changed since it was cached.
+    """
+
+    def __init__(self):
+        self.tables = {}
+
+    def rows(self, csv_path):
+        """ Returns the rows of csv_path, including the header, as a
+        list of lists.
+        """
+        stat = os.stat(csv_path)
+        version = (stat.st_mtime, stat.st_size)
+        try:
+            cached_version, rows = self.tables[csv_path]
+            if cached_version == version:
+                return rows
+        except KeyError:
+            pass
+        with open(csv_path) as csv_file:
+            rows = list(csv.reader(csv_file))
+        self.tables[csv_path] = (version, rows)
+        return rows
+
+    def clear(self):
+        self.tables = {}
+        return
+
+
+# Set to a TableCache to keep tables in memory between queries. By
+# default each query reads its table from disk. A dao whose
+# shared_tables is set to a directory (see table_store) reads its tables
+# from segments there instead.
+table_cache = None
+
+
 class CsvDao(object):
     """ Parent class for handling access to the csv dumps of the CREM
     database. Child classes handle element-specific queries and
@@ -26,48 +68,72 @@ class CsvDao(object):
     def __init__(self, connect_env):
         self.connect_env = connect_env
         self.db_dir = ""
+        self.shared_tables = ""
 
     def connect(self, table):
         self.table = table
         csv_path = os.path.join(self.db_dir, self.table)
+        self.csv_file = None
+        if self.shared_tables:
+            return iter(self.shared_table(table))
         try:
+            if table_cache is not None:
+                return iter(table_cache.rows(csv_path))
             self.csv_file = open(csv_path)
             reader = csv.reader(self.csv_file)
-        except IOError as e:
+        except (IOError, OSError) as e:
             raise DaoConnectionException(
                 "Couldn't connect to %s: %s" % (table, e))
         return reader
 
+    def shared_table(self, table):
+        """ Returns table's table_store.SharedTable, from the segments
+        in the shared_tables directory.
+        """
+        self.table = table
+        csv_path = os.path.join(self.db_dir, self.table)
+        try:
+            return table_store.store(self.shared_tables).rows(csv_path)
+        except (IOError, OSError) as e:
+            raise DaoConnectionException(
+                "Couldn't connect to %s: %s" % (table, e))
+
     def disconnect(self):
-        self.csv_file.close()
+        if self.csv_file is not None:
+            self.csv_file.close()
         return
 
     def single_row_query(self, retrieve, table, constraint):
-        reader = self.connect(table)
-        header = reader.next()
-        self._cross_check(header, retrieve, constraint)
-        result = {}
-        for row in reader:
-            record = dict(zip(header, row))
-            matched_all = True
-            for key in constraint:
-                if record[key] != constraint[key]:
-                    matched_all = False
-                    break
-            if matched_all:
-                for key in retrieve:
-                    result[key] = record[key]
-                result = self.clean(result)
-                break
-        self.disconnect()
+        start = query_hook.query_started()
+        records, scanned = self._query(retrieve, table, constraint, 1)
+        result = self.clean(records[0]) if records else {}
+        query_hook.query_finished(
+            self, table, constraint, start, int(len(result) > 0), scanned)
         return result
 
     def multi_row_query(self, retrieve, table, constraint):
+        start = query_hook.query_started()
+        records, scanned = self._query(retrieve, table, constraint)
+        clean = [self.clean(record) for record in records]
+        query_hook.query_finished(
+            self, table, constraint, start, len(clean), scanned)
+        return clean
+
+    def _query(self, retrieve, table, constraint, limit=None):
+        # Returns the retrieve columns of the rows of table (up to
+        # limit of them) that match constraint, and the number of rows
+        # scanned. Shared tables are queried in their segments.
+        if self.shared_tables:
+            shared = self.shared_table(table)
+            self._cross_check(shared.header, retrieve, constraint)
+            return shared.query(retrieve, constraint, limit)
         reader = self.connect(table)
         header = reader.next()
         self._cross_check(header, retrieve, constraint)
-        clean = []
+        records = []
+        scanned = 0
         for row in reader:
+            scanned += 1
             record = dict(zip(header, row))
             matched_all = True
             for key in constraint:
@@ -78,8 +144,11 @@ class CsvDao(object):
                 result = {}
                 for key in retrieve:
                     result[key] = record[key]
-                clean.append(self.clean(result))
-        return clean
+                records.append(result)
+                if len(records) == limit:
+                    break
+        self.disconnect()
+        return records, scanned
 
     def rename_keys(self, record, rename):
         for key in rename:
@@ -245,9 +314,7 @@ class ResponsiblePartyDao(CsvDao):
 
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            dao.rp_id = record["contactid"]
-            daos.append(dao)
+            daos.append(row_handle(self, rp_id=record["contactid"]))
         return daos
 
     def container_metadata(self, container_dao):
@@ -302,9 +369,7 @@ class CitationDao(CsvDao):
 
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            dao.cite_id = record["referenceID"]
-            daos.append(dao)
+            daos.append(row_handle(self, cite_id=record["referenceID"]))
         return daos
 
     def container_metadata(self, container_dao):
@@ -345,9 +410,7 @@ class ComponentPropertyDao(CsvDao):
         daos = []
         for record in records:
             if record["value"]:
-                dao = copy.copy(self)
-                dao.prop_id = record["idattribute"]
-                daos.append(dao)
+                daos.append(row_handle(self, prop_id=record["idattribute"]))
         return daos
 
     def container_metadata(self, container_dao):
@@ -449,9 +512,7 @@ class SubModelDao(CsvDao):
 
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            dao.comp_id = record["idtModelComponent"]
-            daos.append(dao)
+            daos.append(row_handle(self, comp_id=record["idtModelComponent"]))
         return daos
 
     def container_metadata(self, container_dao):
@@ -582,9 +643,7 @@ class NumericalRequirementDao(CsvDao):
         daos = []
         for record in records:
             if re.search(self.parent_expt_name, record["includes"]):
-                dao = copy.copy(self)
-                dao.id = record["id"]
-                daos.append(dao)
+                daos.append(row_handle(self, id=record["id"]))
         return daos
 
     def metadata(self, constraint):
@@ -618,9 +677,7 @@ class NumericalRequirementRefDao(CsvDao):
             ["requirementid"], "tblconformance.csv", {"id": self.conf_id})
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            dao.reqt_id = record["requirementid"]
-            daos.append(dao)
+            daos.append(row_handle(self, reqt_id=record["requirementid"]))
         return daos
 
     def metadata(self, constraint):
@@ -653,9 +710,7 @@ class DataObjectDao(CsvDao):
             {"experimentid": constraint["id"]})
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            dao.id = record["ancillaryid"]
-            daos.append(dao)
+            daos.append(row_handle(self, id=record["ancillaryid"]))
         return daos
 
     def metadata(self, constraint):
@@ -812,10 +867,9 @@ class EnsembleMemberDao(CsvDao):
         for record in records:
             if record["simulationStartDate"] != start_date:
                 continue
-            dao = copy.copy(self)
-            dao.sim_id = record["idtblsimulation"]
-            dao.expt_id = constraint["id"]
-            daos.append(dao)
+            daos.append(row_handle(
+                self, sim_id=record["idtblsimulation"],
+                expt_id=constraint["id"]))
         return daos
 
     def metadata(self, constraint):
@@ -896,11 +950,9 @@ class ConformanceDao(CsvDao):
         # Finally, we can built the list of DAOs.
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            for id in ["conf_id", "reqt_id"]:
-                setattr(dao, id, record[id])
-            dao.expt_id = constraint["id"]
-            daos.append(dao)
+            daos.append(row_handle(
+                self, conf_id=record["conf_id"], reqt_id=record["reqt_id"],
+                expt_id=constraint["id"]))
         return daos
 
     def metadata(self, constraint):
@@ -1008,9 +1060,7 @@ class GridMosaicDao(CsvDao):
             {"idgridsystem": self.grid_sys_id})
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            dao.mosaic_id = record["idgridset"]
-            daos.append(dao)
+            daos.append(row_handle(self, mosaic_id=record["idgridset"]))
         return daos
 
     def metadata(self, constraint):
@@ -1046,9 +1096,7 @@ class GridTileDao(CsvDao):
             ["idgrid"], "tblgrid.csv", {"idgridset": self.mosaic_id})
         daos = []
         for record in records:
-            dao = copy.copy(self)
-            dao.grid_id = record["idgrid"]
-            daos.append(dao)
+            daos.append(row_handle(self, grid_id=record["idgrid"]))
         return daos
 
     def metadata(self, constraint):
@@ -1084,6 +1132,8 @@ class DeploymentDao(CsvDao):
 
 class DbTable(object):
 
+    __slots__ = ("id", "node_type")
+
     def __init__(self, id, node_type):
         self.id = id
         self.node_type = node_type
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3
+# see <http://www.gnu.org/licenses/>
+
+
+class DaoHandle(object):
+    """ Mixin for the per-row daos returned by daos_for_node.
+
+    A handle only holds the row key (such as comp_id or cite_id) and a
+    reference to the dao that found the row. Any other attribute is
+    read from that parent dao, so fanning out to thousands of rows
+    doesn't copy the parent's connection environment, parent table,
+    etc. for each row. Attributes a handle sets while it is being used
+    (for example a db_table, or an open connection) are kept on the
+    handle and never written back to the parent.
+    """
+
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        # Only called for attributes the handle doesn't hold itself.
+        if name == "parent":
+            raise AttributeError(name)
+        return getattr(self.parent, name)
+
+
+def row_handle(parent, **key):
+    """ Returns a handle for one row of parent's fan-out, with the
+    row's key attributes set.
+    """
+    cls = _handle_class(type(parent), tuple(sorted(key)))
+    dao = cls.__new__(cls)
+    dao.parent = parent
+    for attr in key:
+        setattr(dao, attr, key[attr])
+    return dao
+
+
+_handle_classes = {}
+
+
+def _handle_class(dao_class, key):
+    # Handle classes are made once for each dao class and set of key
+    # attributes. Handles subclass the parent's dao class so they keep
+    # all of its methods.
+    dao_class = getattr(dao_class, "dao_class", dao_class)
+    try:
+        return _handle_classes[(dao_class, key)]
+    except KeyError:
+        pass
+    cls = type(
+        "%sHandle" % dao_class.__name__, (DaoHandle, dao_class), {
+            "__slots__": ("parent",) + key, "dao_class": dao_class})
+    _handle_classes[(dao_class, key)] = cls
+    return cls
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 
-import copy
+import bisect
+import os.path
+import sqlite3
 
 from dao_exception import DaoConnectionException, DaoMetadataException
+from dao_handle import row_handle
 
 
 # Copyright: (C) Crown copyright 2015, the Met Office
@@ -15,15 +18,27 @@ class DocIdDao(object):
 
     This class stores the ids of document components as a document is
     being constructed so that internal references can be used.
+
+    Ids are indexed by type, and within a type by the name split into
+    its ":"-separated parts. For example, the SubModel
+    "HadGEM2-ES:Atmosphere" is stored under ("HadGEM2-ES",
+    "Atmosphere") in the "ModelComponent" index. This lets us find
+    every id under a model component path (see ids_under) and resolve
+    lists of names in one go (see resolve).
     """
 
     def __init__(self):
-        self.id = {}
+        self.index = {}
+        self.sorted_keys = {}
+        self.parts = {}
         self.type = ""
         self.name = ""
+        self.record = None
 
     def metadata(self, constraint):
         """ Finds the identifier for the specified element. """
+        if self.record is not None:
+            return self.record
         if self.type and self.name:
             return self._find_id(self.type, self.name)
         else:
@@ -31,47 +46,301 @@ class DocIdDao(object):
 
     def add_id(self, type, name, id):
         """ Adds identifier to our in-memory store. """
-        self.id[self._key(type, name)] = id
+        self._type_index(type)[self._key(name)] = id
+        return
+
+    def add_ids(self, records):
+        """ Adds a list of (type, name, id) records to our store. """
+        for type, name, id in records:
+            self.add_id(type, name, id)
+        return
+
+    def replace_ids(self, ids):
+        """ Changes each id that's a key of the dictionary ids to its
+        value, for documents kept from an earlier build (see
+        output.OutputManifest).
+        """
+        for type, type_index in self.index.items():
+            for key, id in type_index.items():
+                if id in ids:
+                    self.add_id(type, ":".join(key), ids[id])
         return
 
+    def flush(self):
+        """ Saves ids that haven't been saved yet. Our ids only live
+        in memory, so there's nothing to do.
+        """
+        pass
+
+    def resolve(self, type, names):
+        """ Returns id records for a list of names of the same type,
+        in the same order. Raises DaoMetadataException listing every
+        name we couldn't find.
+        """
+        if type == "" or "" in names:
+            raise DaoMetadataException("Need type and name to find id")
+        found = self._lookup_many(type, names)
+        missing = [
+            "%s:%s" % (type, name) for name in names if name not in found]
+        if missing:
+            raise DaoMetadataException(
+                "No id %s found in store" % ", ".join(missing))
+        return [self._make_record(found[name], type, name) for name in names]
+
+    def ids_under(self, type, prefix):
+        """ Returns id records for the element called prefix and every
+        element below it. For example, ids_under("ModelComponent",
+        "HadGEM2-ES:Atmosphere") finds the Atmosphere sub-model and all
+        of its sub-models.
+        """
+        if type == "" or prefix == "":
+            raise DaoMetadataException("Need type and name prefix to find ids")
+        return [
+            self._make_record(id, type, ":".join(key))
+            for key, id in self._prefix_ids(type, prefix)]
+
     def daos_for_node(self, constraint):
         """ Given a type and a container dao, find all the matching id
         entries. We may find ourself called with a name, in which case
-        we short-cut and bail out.
+        we short-cut and bail out. The ids are all found at once and
+        handed out with the daos.
         """
         if "name" not in constraint:
             raise DaoMetadataException('Link needs a name (which can be "")')
         if constraint["name"]:
             # We can return a single dao without having to run queries.
-            self.type = constraint["type"]
-            self.name = constraint["name"]
-            return [self]
-        if "type" not in constraint or "container_dao" not in constraint:
-            raise DaoMetadataException("Link needs a type and a container")
-        names = constraint["container_dao"].name_for_reference(
-            {"type": constraint["type"]})
+            names = [constraint["name"]]
+        else:
+            if "type" not in constraint or "container_dao" not in constraint:
+                raise DaoMetadataException(
+                    "Link needs a type and a container")
+            names = constraint["container_dao"].name_for_reference(
+                {"type": constraint["type"]})
+        records = self.resolve(constraint["type"], names)
         daos = []
-        for name in names:
-            dao = copy.copy(self)
-            dao.type = constraint["type"]
-            dao.name = name
-            daos.append(dao)
+        for record in records:
+            daos.append(row_handle(
+                self, type=record.type, name=record.name, record=record))
         return daos
 
-    def _key(self, type, name):
-        return "%s:%s" % (type, name)
+    def _type_index(self, type):
+        # We're about to change the index, which invalidates its
+        # sorted keys.
+        self.sorted_keys.pop(type, None)
+        return self.index.setdefault(type, {})
+
+    def _key(self, name):
+        # Name parts are shared between keys, so the many sub-models
+        # under "HadGEM2-ES" only store that string once.
+        return tuple(
+            self.parts.setdefault(part, part) for part in name.split(":"))
 
     def _find_id(self, type, name):
         """ Find an id. """
-        if type == "" or name == "":
-            raise DaoMetadataException("Need type and name to find id")
-        id_name = "%s:%s" % (type, name)
-        if id_name in self.id:
-            return self._make_record(self.id[id_name], type, name)
-        raise DaoMetadataException("No id %s found in store" % id_name)
+        return self.resolve(type, [name])[0]
+
+    def _lookup_many(self, type, names):
+        # Returns a dictionary of name: id for the names we know.
+        type_index = self.index.get(type, {})
+        found = {}
+        for name in names:
+            id = type_index.get(self._key(name))
+            if id is not None:
+                found[name] = id
+        return found
+
+    def _prefix_ids(self, type, prefix_name):
+        # Returns (key, id) pairs for every key starting with the key
+        # for prefix_name, using a sorted copy of the type's keys so we
+        # only look at the matching run of keys.
+        prefix = self._key(prefix_name)
+        type_index = self.index.get(type, {})
+        if type not in self.sorted_keys:
+            self.sorted_keys[type] = sorted(type_index)
+        keys = self.sorted_keys[type]
+        matches = []
+        for idx in range(bisect.bisect_left(keys, prefix), len(keys)):
+            if keys[idx][:len(prefix)] != prefix:
+                break
+            matches.append((keys[idx], type_index[keys[idx]]))
+        return matches
 
     def _make_record(self, id, type, name):
-        return {"id": id, "type": type, "name": name}
+        return DocIdRecord(id, type, name)
+
+
+class PersistentDocIdDao(DocIdDao):
+    """ Document id store that keeps ids in an SQLite database as well
+    as in memory, so documents can refer to elements built by earlier
+    runs (for example, an experiment document referring to the model
+    without rebuilding the model document).
+
+    The database is db_path if set (e.g. from the template's id_dao
+    options), otherwise "doc_ids.sqlite" in output_dir. New ids are
+    buffered and written in one transaction when flush is called (or
+    when the buffer fills up). Lookups that miss the in-memory store
+    read through to the database. Several processes can share a
+    database: writers wait for each other's transactions to finish.
+    """
+
+    db_file = "doc_ids.sqlite"
+    flush_size = 500
+
+    def __init__(self):
+        super(PersistentDocIdDao, self).__init__()
+        self.db_path = ""
+        self.output_dir = ""
+        self.timeout = 60
+        self.db = None
+        self.pending = []
+
+    def add_id(self, type, name, id):
+        """ Adds identifier to our in-memory store and queues it to be
+        saved.
+        """
+        super(PersistentDocIdDao, self).add_id(type, name, id)
+        self.pending.append((type, name, id))
+        if len(self.pending) >= self.flush_size:
+            self.flush()
+        return
+
+    def add_ids(self, records):
+        """ Adds a list of (type, name, id) records and saves them in
+        a single transaction.
+        """
+        for type, name, id in records:
+            super(PersistentDocIdDao, self).add_id(type, name, id)
+            self.pending.append((type, name, id))
+        self.flush()
+        return
+
+    def flush(self):
+        """ Saves queued ids to the database. """
+        if not self.pending:
+            return
+        db = self.connect()
+        try:
+            # Take the write lock up front so concurrent writers queue
+            # rather than failing part way through.
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany(
+                "INSERT OR REPLACE INTO doc_id (type, name, id) "
+                "VALUES (?, ?, ?)", self.pending)
+            db.execute("COMMIT")
+        except sqlite3.Error as e:
+            self._rollback()
+            raise DaoConnectionException(
+                "Couldn't save ids to %s: %s" % (self.path(), e))
+        self.pending = []
+        return
+
+    def connect(self):
+        """ Opens (and if necessary creates) the id database. """
+        if self.db is not None:
+            return self.db
+        try:
+            self.db = sqlite3.connect(
+                self.path(), timeout=self.timeout, isolation_level=None)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS doc_id ("
+                "type TEXT NOT NULL, name TEXT NOT NULL, id TEXT NOT NULL, "
+                "PRIMARY KEY (type, name))")
+        except sqlite3.Error as e:
+            raise DaoConnectionException(
+                "Couldn't connect to %s: %s" % (self.path(), e))
+        return self.db
+
+    def disconnect(self):
+        """ Saves any queued ids and closes the database. """
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+        return
+
+    def path(self):
+        if self.db_path:
+            return self.db_path
+        if self.output_dir:
+            return os.path.join(self.output_dir, self.db_file)
+        raise DaoConnectionException(
+            "Persistent id store needs a db_path or an output_dir")
+
+    def _rollback(self):
+        try:
+            self.db.execute("ROLLBACK")
+        except sqlite3.Error:
+            # We didn't get as far as starting the transaction.
+            pass
+        return
+
+    def _lookup_many(self, type, names):
+        found = super(PersistentDocIdDao, self)._lookup_many(type, names)
+        missing = [name for name in names if name not in found]
+        # Keep well inside SQLite's limit on query parameters.
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            rows = self._query(
+                "SELECT name, id FROM doc_id WHERE type = ? AND name IN "
+                "(%s)" % ",".join("?" * len(chunk)), [type] + chunk)
+            for name, id in rows:
+                super(PersistentDocIdDao, self).add_id(type, name, id)
+                found[name] = id
+        return found
+
+    def _prefix_ids(self, type, prefix_name):
+        # Pull in saved ids under the prefix that we don't already
+        # have in memory. Names below prefix_name start with
+        # "prefix_name:", and ";" is the character after ":".
+        type_index = self.index.get(type, {})
+        rows = self._query(
+            "SELECT name, id FROM doc_id WHERE type = ? AND "
+            "(name = ? OR (name >= ? AND name < ?))",
+            [type, prefix_name, prefix_name + ":", prefix_name + ";"])
+        for name, id in rows:
+            if self._key(name) not in type_index:
+                super(PersistentDocIdDao, self).add_id(type, name, id)
+        return super(PersistentDocIdDao, self)._prefix_ids(type, prefix_name)
+
+    def _query(self, query, query_param):
+        try:
+            return self.connect().execute(query, query_param).fetchall()
+        except sqlite3.Error as e:
+            raise DaoConnectionException(
+                "Couldn't read ids from %s: %s" % (self.path(), e))
+
+
+class DocIdRecord(object):
+    """ Metadata for a document id found by DocIdDao. Elements read
+    it like the metadata dictionaries other daos return.
+    """
+
+    __slots__ = ("id", "type", "name")
+
+    def __init__(self, id, type, name):
+        self.id = id
+        self.type = type
+        self.name = name
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __eq__(self, other):
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.__slots__]
 
 
 class Null(object):
@@ -82,5 +351,14 @@ class Null(object):
     def add_id(self, type, name, id):
         pass
 
+    def add_ids(self, records):
+        pass
+
+    def replace_ids(self, ids):
+        pass
+
+    def flush(self):
+        pass
+
     def metadata(self, constraint):
         return {"null": True}
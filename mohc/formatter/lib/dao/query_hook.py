@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+""" Hooks for instrumenting DAO queries.
+
+CremDao and CsvDao report each query they run to every hook that has
+been added with add_hook. A hook is any callable that takes a
+QueryEvent. When no hooks have been added the daos don't time their
+queries at all.
+
+QueryStats is a hook that keeps totals for each kind of query, and
+logs queries that take longer than a threshold.
+"""
+
+import time
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3
+# see <http://www.gnu.org/licenses/>
+
+hooks = []
+
+
+def add_hook(hook):
+    hooks.append(hook)
+    return
+
+
+def remove_hook(hook):
+    hooks.remove(hook)
+    return
+
+
+def query_started():
+    """ Returns the start time for a query, or None if there are no
+    hooks to report it to.
+    """
+    if not hooks:
+        return None
+    return time.time()
+
+
+def query_finished(dao, query, parameters, start, rows, rows_scanned=None):
+    """ Reports a query to the hooks. query is the SQL text, or the
+    table for CSV files, and parameters are the SQL parameters or the
+    CSV constraint.
+    """
+    if start is None:
+        return
+    event = QueryEvent(
+        _dao_class(dao), query, parameters, time.time() - start, rows,
+        rows_scanned)
+    for hook in list(hooks):
+        hook(event)
+    return
+
+
+class QueryEvent(object):
+    """ A query run by a dao. duration is in seconds. rows_scanned is
+    only known for CSV files.
+    """
+
+    __slots__ = (
+        "dao_class", "query", "parameters", "duration", "rows",
+        "rows_scanned")
+
+    def __init__(self, dao_class, query, parameters, duration, rows,
+                 rows_scanned=None):
+        self.dao_class = dao_class
+        self.query = query
+        self.parameters = parameters
+        self.duration = duration
+        self.rows = rows
+        self.rows_scanned = rows_scanned
+
+    def shape(self):
+        """ Returns the query without its parameter values, so that
+        the same query with different values can be counted together.
+        """
+        if self.rows_scanned is not None:
+            # A CSV query, with a constraint dictionary.
+            return "%s where %s" % (
+                self.query, ", ".join(sorted(self.parameters)) or "(all)")
+        return " ".join(self.query.split())
+
+
+class QueryStats(object):
+    """ Query hook that totals the count, time, rows returned and
+    rows scanned for each dao class and query shape. Queries that take
+    at least slow_ms milliseconds are written to log as they happen.
+    """
+
+    def __init__(self, slow_ms=None, log=None):
+        self.slow_ms = slow_ms
+        self.log = log
+        self.stats = {}
+        self.slow = 0
+
+    def __call__(self, event):
+        key = (event.dao_class, event.shape())
+        try:
+            stats = self.stats[key]
+        except KeyError:
+            stats = {
+                "count": 0, "time": 0.0, "max_time": 0.0, "rows": 0,
+                "rows_scanned": 0}
+            self.stats[key] = stats
+        stats["count"] += 1
+        stats["time"] += event.duration
+        stats["max_time"] = max(stats["max_time"], event.duration)
+        stats["rows"] += event.rows
+        stats["rows_scanned"] += event.rows_scanned or 0
+        if self.slow_ms is not None and event.duration * 1e3 >= self.slow_ms:
+            self.slow += 1
+            if self.log is not None:
+                self.log.write("slow query %.1fms %s %s %r rows=%d\n" % (
+                    event.duration * 1e3, event.dao_class, event.query,
+                    event.parameters, event.rows))
+        return
+
+    def report(self):
+        """ Returns a table of the totals, slowest first. """
+        lines = ["%8s %10s %10s %8s %10s  %s" % (
+            "count", "total (ms)", "max (ms)", "rows", "scanned", "query")]
+        for key, stats in sorted(
+                self.stats.items(), key=lambda item: -item[1]["time"]):
+            lines.append("%8d %10.1f %10.1f %8d %10d  %s: %s" % (
+                stats["count"], stats["time"] * 1e3,
+                stats["max_time"] * 1e3, stats["rows"],
+                stats["rows_scanned"], key[0], key[1]))
+        if self.slow_ms is not None:
+            lines.append("%d queries took %gms or more" % (
+                self.slow, self.slow_ms))
+        return "\n".join(lines)
+
+    def dump(self, stream):
+        stream.write("%s\n" % self.report())
+        stream.flush()
+        return
+
+
+def _dao_class(dao):
+    # Per-row handles report the class of the dao they were made from.
+    return getattr(type(dao), "dao_class", type(dao)).__name__
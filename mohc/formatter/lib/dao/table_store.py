@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+
+""" CSV tables kept in memory shared between processes.
+
+A TableCache keeps each process's own copy of every table, as lists
+of Python strings. Forked processes start off sharing the pages that
+copy is in, but Python's reference counting writes to every object
+it touches, so each process soon has a private copy of every table.
+A SharedTableStore instead keeps each table in a segment file in a
+directory, best on a memory file system such as /dev/shm, which every
+process maps read-only. However many processes read a table, there's
+one copy of it in memory.
+
+A segment holds a table by column. Columns of integers (such as ids)
+are arrays of 8-byte integers and other columns are an array of
+offsets into a blob of the column's strings, so nothing in a segment
+is a Python object. A query (see SharedTable.query) compares its
+constraint with the arrays in the segment, and only makes strings of
+the columns it retrieves from the rows that match.
+
+Segments are named from their table's path, modification time and
+size, so a table that changes gets a new segment, and are written to
+a temporary file that's renamed into place, so no process sees part of
+a segment. A segment that can't be read (say, one left empty by a full
+disk) is written again. When a store writes a new version of a table's
+segment it removes the table's older segments, unless it was made with
+keep_old set. Processes that have already mapped an old segment keep
+it until they've finished with it, as removing a file doesn't unmap
+it.
+"""
+
+import csv
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3 see
+# <http://www.gnu.org/licenses/>
+
+MAGIC = "CSVSEG1\0"
+
+# Column kinds.
+INTEGERS = 0
+STRINGS = 1
+
+# Magic, then the length of the JSON layout that follows it.
+_HEADER = struct.Struct("<8sI")
+_INTEGER = struct.Struct("<q")
+_OFFSET = struct.Struct("<Q")
+_OFFSETS = struct.Struct("<QQ")
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class SharedTableStore(object):
+    """ Tables read from segments in directory, which is made if it
+    doesn't exist. Has the same rows method as a TableCache. If
+    keep_old is true, older segments of the tables aren't removed.
+    """
+
+    def __init__(self, directory, keep_old=False):
+        self.directory = directory
+        self.keep_old = keep_old
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def rows(self, csv_path):
+        """ Returns the SharedTable for csv_path, making its segment if
+        no process has yet.
+        """
+        stat = os.stat(csv_path)
+        version = (stat.st_mtime, stat.st_size)
+        with self.lock:
+            try:
+                cached_version, table = self.tables.pop(csv_path)
+                if cached_version == version:
+                    self.tables[csv_path] = (version, table)
+                    return table
+            except KeyError:
+                pass
+            # Any old version was dropped above, so its segment is
+            # unmapped once no query is using it.
+            segment_path = os.path.join(
+                self.directory, segment_name(csv_path, version))
+            written = False
+            if not os.path.exists(segment_path):
+                write_segment(csv_path, segment_path)
+                written = True
+            try:
+                table = SharedTable(segment_path)
+            except IOError:
+                if written:
+                    raise
+                # Damaged, so write it again.
+                write_segment(csv_path, segment_path)
+                written = True
+                table = SharedTable(segment_path)
+            if written and not self.keep_old:
+                self.remove_old(csv_path, segment_path)
+            self.tables[csv_path] = (version, table)
+            return table
+
+    def remove_old(self, csv_path, current=None):
+        """ Removes the segments of the table at csv_path other than
+        current (by default, the one for its present version). Returns
+        the paths removed.
+        """
+        if current is None:
+            stat = os.stat(csv_path)
+            current = os.path.join(self.directory, segment_name(
+                csv_path, (stat.st_mtime, stat.st_size)))
+        prefix = segment_name(csv_path, None).rsplit("-", 1)[0] + "-"
+        removed = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(prefix) and name.endswith(".seg") and \
+                    path != current:
+                try:
+                    os.remove(path)
+                    removed.append(path)
+                except OSError:
+                    # Another process may have removed it first.
+                    pass
+        return removed
+
+    def clear(self):
+        with self.lock:
+            self.tables = {}
+        return
+
+
+class SharedTable(object):
+    """ A table mapped from the segment at segment_path. Iterating
+    over it gives the header and then each row as a list of strings,
+    as a csv.reader would. Raises IOError if the segment can't be
+    read.
+    """
+
+    def __init__(self, segment_path):
+        try:
+            with open(segment_path, "rb") as segment_file:
+                self.segment = mmap.mmap(
+                    segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, layout_size = _HEADER.unpack_from(self.segment)
+            if magic != MAGIC:
+                raise ValueError("bad magic")
+            layout = json.loads(
+                self.segment[_HEADER.size:_HEADER.size + layout_size])
+            self.header = [str(name) for name in layout["header"]]
+            self.row_count = layout["rows"]
+            self.columns = layout["columns"]
+            self._check()
+        except (ValueError, KeyError, TypeError, struct.error) as e:
+            raise IOError("%s isn't a table segment (%s)" % (
+                segment_path, e))
+
+    def __len__(self):
+        return self.row_count + 1
+
+    def __iter__(self):
+        yield list(self.header)
+        for index in xrange(self.row_count):
+            yield self.row(index)
+
+    def row(self, index):
+        """ Returns the row at index (not counting the header). """
+        return [self._value(column, index) for column in self.columns]
+
+    def query(self, retrieve, constraint, limit=None):
+        """ Returns the retrieve columns of the rows (up to limit of
+        them) whose values are equal to constraint's, as dictionaries,
+        and the number of rows looked at, as CsvDao's queries would.
+        Rows are matched on the segment's arrays, without making
+        strings of their values.
+        """
+        # As with dict(zip(header, row)), the last of any columns with
+        # the same name is the one used.
+        columns = dict(zip(self.header, self.columns))
+        tests = []
+        for key in constraint:
+            test = _test(columns[key], constraint[key])
+            if test is None:
+                # Nothing can match.
+                return [], self.row_count
+            tests.append(test)
+        # Rows are found with the first test that can search a column,
+        # and checked against the rest.
+        tests.sort(key=lambda test: test[2] is None)
+        if tests and tests[0][2] is not None:
+            candidates = self._find(*tests[0])
+            tests = tests[1:]
+        else:
+            candidates = xrange(self.row_count)
+        wanted = [(key, columns[key]) for key in retrieve]
+        records = []
+        for index in candidates:
+            if all(self._matches(test, index) for test in tests):
+                records.append(dict(
+                    (key, self._value(column, index))
+                    for key, column in wanted))
+                if len(records) == limit:
+                    return records, index + 1
+        return records, self.row_count
+
+    def _check(self):
+        # Makes sure every column's arrays are within the segment.
+        size = len(self.segment)
+        for kind, offset, blob in self.columns:
+            if kind == INTEGERS:
+                end = offset + 8 * self.row_count
+            else:
+                end = offset + 8 * (self.row_count + 1)
+                if end > size:
+                    raise ValueError("truncated")
+                end = blob + self._offset(offset, self.row_count)
+            if end > size:
+                raise ValueError("truncated")
+        return
+
+    def _value(self, column, index):
+        kind, offset, blob = column
+        if kind == INTEGERS:
+            return str(
+                _INTEGER.unpack_from(self.segment, offset + 8 * index)[0])
+        start, end = _OFFSETS.unpack_from(self.segment, offset + 8 * index)
+        return self.segment[blob + start:blob + end]
+
+    def _offset(self, offset, index):
+        return _OFFSET.unpack_from(self.segment, offset + 8 * index)[0]
+
+    def _matches(self, test, index):
+        (kind, offset, blob), value, packed = test
+        if kind == INTEGERS:
+            return _INTEGER.unpack_from(
+                self.segment, offset + 8 * index)[0] == value
+        start, end = _OFFSETS.unpack_from(self.segment, offset + 8 * index)
+        return end - start == len(value) and \
+            self.segment[blob + start:blob + end] == value
+
+    def _find(self, column, value, packed):
+        # Yields, in order, the index of each row whose value in column
+        # is packed (an integer packed as in the segment, or a string),
+        # searching the column's array or blob rather than each row.
+        kind, offset, blob = column
+        segment = self.segment
+        if kind == INTEGERS:
+            end = offset + 8 * self.row_count
+            position = segment.find(packed, offset, end)
+            while position != -1:
+                if (position - offset) % 8 == 0:
+                    yield (position - offset) // 8
+                    position = segment.find(packed, position + 8, end)
+                else:
+                    position = segment.find(packed, position + 1, end)
+            return
+        end = blob + self._offset(offset, self.row_count)
+        position = segment.find(packed, blob, end)
+        while position != -1:
+            index = self._row_starting(offset, position - blob)
+            if index is not None and \
+                    self._offset(offset, index + 1) == \
+                    position - blob + len(packed):
+                yield index
+            position = segment.find(packed, position + 1, end)
+        return
+
+    def _row_starting(self, offset, start):
+        # Returns the index of the last row whose string starts at
+        # start in a column's blob (rows before it may be empty
+        # strings starting at the same place), or None.
+        low, high = 0, self.row_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._offset(offset, middle) <= start:
+                low = middle + 1
+            else:
+                high = middle
+        if low > 0 and self._offset(offset, low - 1) == start:
+            return low - 1
+        return None
+
+
+def store(directory):
+    """ Returns the SharedTableStore for directory, so each process
+    maps each segment once.
+    """
+    with _stores_lock:
+        if directory not in _stores:
+            _stores[directory] = SharedTableStore(directory)
+        return _stores[directory]
+
+
+def segment_name(csv_path, version):
+    """ Returns the name of the segment for version of the table at
+    csv_path. The names of a table's segments differ only after their
+    last "-".
+    """
+    path = os.path.abspath(csv_path)
+    key = "%s %r" % (path, version)
+    return "%s-%s-%s.seg" % (
+        os.path.basename(csv_path), hashlib.sha1(path).hexdigest()[:8],
+        hashlib.sha1(key).hexdigest()[:16])
+
+
+def write_segment(csv_path, segment_path):
+    """ Writes the table at csv_path to a segment at segment_path. """
+    with open(csv_path) as csv_file:
+        rows = list(csv.reader(csv_file))
+    header, rows = (rows[0], rows[1:]) if rows else ([], [])
+    # Short rows are padded, as a query would see them through zip.
+    columns = [
+        [row[column] if column < len(row) else "" for row in rows]
+        for column in range(len(header))]
+    kinds = [_kind(values) for values in columns]
+    # Work out where each column goes, after the header and layout.
+    # The layout's size depends on the offsets in it, so we lay the
+    # columns out after a generous guess at it and pad to that.
+    parts = []
+    layout_columns = []
+    reserve = 1024 + 64 * len(header) + len(json.dumps(header))
+    position = _HEADER.size + reserve
+    for values, kind in zip(columns, kinds):
+        if kind == INTEGERS:
+            data = struct.pack("<%dq" % len(values), *map(int, values))
+            layout_columns.append([kind, position, 0])
+        else:
+            offsets = [0]
+            for value in values:
+                offsets.append(offsets[-1] + len(value))
+            data = struct.pack("<%dQ" % len(offsets), *offsets)
+            layout_columns.append([kind, position, position + len(data)])
+            data += "".join(values)
+        parts.append(data)
+        position += len(data)
+        # Keep each column's arrays 8-byte aligned.
+        padding = -position % 8
+        parts.append("\0" * padding)
+        position += padding
+    layout = json.dumps({
+        "header": header, "rows": len(rows), "columns": layout_columns})
+    if len(layout) > reserve:
+        raise IOError("Too many columns in %s for a segment" % csv_path)
+    directory = os.path.dirname(segment_path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another process may have made it first.
+            if not os.path.isdir(directory):
+                raise
+    handle, temp_path = tempfile.mkstemp(
+        prefix=".%s." % os.path.basename(segment_path), dir=directory)
+    with os.fdopen(handle, "wb") as segment_file:
+        segment_file.write(_HEADER.pack(MAGIC, len(layout)))
+        segment_file.write(layout.ljust(reserve, " "))
+        for part in parts:
+            segment_file.write(part)
+    os.chmod(temp_path, 0644)
+    os.rename(temp_path, segment_path)
+    return
+
+
+def _test(column, value):
+    # Returns (column, value, packed) for matching column against a
+    # constraint's value, where packed is what to search the column's
+    # array or blob for, or None if the column has to be checked row
+    # by row. Returns None if no row can match, as CsvDao compares the
+    # strings it reads with the constraint's values.
+    if isinstance(value, unicode):
+        try:
+            value = value.encode("ascii")
+        except UnicodeError:
+            return None
+    if not isinstance(value, str):
+        return None
+    if column[0] == INTEGERS:
+        try:
+            number = int(value)
+        except ValueError:
+            return None
+        if str(number) != value or not -2 ** 63 <= number < 2 ** 63:
+            return None
+        return column, number, _INTEGER.pack(number)
+    return column, value, value or None
+
+
+def _kind(values):
+    # Integers are only kept as integers if they'd be written back the
+    # same way ("007" and "" stay strings).
+    if not values:
+        return STRINGS
+    for value in values:
+        try:
+            number = int(value)
+        except ValueError:
+            return STRINGS
+        if str(number) != value or not -2 ** 63 <= number < 2 ** 63:
+            return STRINGS
+    return INTEGERS
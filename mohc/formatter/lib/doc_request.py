@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+""" Requests for documents given as JSON objects, as batchCIM.py's
+jobs and formatDaemon.py's build requests are.
+
+A request gives the document type ("doc"), the names that pick out
+the document (as formatCIM.py's -m, -e and -s options do), the
+"project", the "template" to build it from, the "format" and the
+"output" path. check makes sure a request has everything its document
+type needs, and doc_builder makes the tree to build its document from.
+"""
+
+import copy
+
+from lazy_import import lazy_module
+
+template = lazy_module("template")
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3 see
+# <http://www.gnu.org/licenses/>
+
+# The information each document type needs, as for formatCIM.py's
+# -m, -e and -s options, in the order it's used in document names.
+DOC_NAMES = {
+    "model": ["model"], "experiment": ["model", "experiment"],
+    "submodel": ["model", "submodel"]}
+
+REQUIRED = ["doc", "format", "output", "project", "template"]
+
+# The parts of a request that are passed on to the daos.
+DAO_ENV = ["experiment", "model", "project", "submodel"]
+
+
+class RequestError(Exception):
+    """ Raised for requests that can't be handled. """
+    pass
+
+
+def check(request, error=RequestError):
+    """ Raises error (a RequestError by default) if request is missing
+    anything its document type needs.
+    """
+    if not isinstance(request, dict):
+        raise error("Request must be a JSON object")
+    for key in REQUIRED:
+        if key not in request:
+            raise error("Request needs %s" % key)
+    if request["doc"] not in DOC_NAMES:
+        raise error("Unknown document type %s" % request["doc"])
+    for key in DOC_NAMES[request["doc"]]:
+        if key not in request:
+            raise error("Require %s to make %s doc" % (key, request["doc"]))
+    return
+
+
+def doc_builder(request, parsed_template, cfg):
+    """ Returns the doc builder for request, from a parsed template and
+    the configuration. Neither of them is changed, so they can be kept
+    for other requests.
+    """
+    cfg = copy.deepcopy(cfg)
+    cfg["global"]["project"] = request["project"]
+    dao_env = {"output_dir": request["output"]}
+    for key in DAO_ENV:
+        if key in request:
+            dao_env[key] = request[key]
+    # template.doc_builder fills in the template it's given.
+    return template.doc_builder(
+        copy.deepcopy(parsed_template), dao_env, cfg)
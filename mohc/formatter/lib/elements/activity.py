@@ -14,6 +14,9 @@ from shared import StandardName
 
 class NumericalExperiment(Element):
 
+    required_attr = ["short_name", "long_name", "calendar"]
+    optional_attr = ["description"]
+
     def __init__(self, dao, id_dao, attribute):
         super(NumericalExperiment, self).__init__(dao, id_dao, attribute)
 
@@ -22,9 +25,7 @@ class NumericalExperiment(Element):
 
     def cim_element(self, metadata, leaves):
         element = self.create_element(cim.NumericalExperiment)
-        required = ["short_name", "long_name", "calendar"]
-        optional = ["description"]
-        self.populate_attr(element, metadata, required, optional)
+        self.populate(element, metadata)
         self.id_name = element.short_name
         self.id_dao.add_id(
             "NumericalExperiment", self.id_name, element.meta.id)
@@ -37,6 +38,9 @@ class NumericalExperiment(Element):
 
 class NumericalRequirement(Element):
 
+    required_attr = ["name"]
+    optional_attr = ["description"]
+
     def __init__(self, dao, id_dao, attribute):
         super(NumericalRequirement, self).__init__(dao, id_dao, attribute)
 
@@ -56,9 +60,7 @@ class NumericalRequirement(Element):
             raise DaoContractException(
                 "Unknown numerical requirement type %s" % metadata["type"])
         element = self.create_element(element_type[metadata["type"]])
-        required = ["name"]
-        optional = ["description"]
-        self.populate_attr(element, metadata, required, optional)
+        self.populate(element, metadata)
         return element
 
     def add_to_doc(self, doc, model_element):
@@ -68,14 +70,15 @@ class NumericalRequirement(Element):
 
 class SimulationRun(Element):
 
+    required_attr = ["long_name", "short_name"]
+    optional_attr = ["description"]
+
     def __init__(self, dao, id_dao, attribute):
         super(SimulationRun, self).__init__(dao, id_dao, attribute)
 
     def cim_element(self, metadata, leaves):
         element = self.create_element(cim.SimulationRun)
-        required = ["long_name", "short_name"]
-        optional = ["description"]
-        self.populate_attr(element, metadata, required, optional)
+        self.populate(element, metadata)
         try:
             element.date_range = self._date_range(
                 metadata["start_date"], metadata["end_date"])
@@ -99,14 +102,14 @@ class SimulationRun(Element):
 
 class Ensemble(Element):
 
+    required_attr = ["long_name", "short_name"]
+
     def __init__(self, dao, id_dao, attribute):
         super(Ensemble, self).__init__(dao, id_dao, attribute)
 
     def cim_element(self, metadata, leaves):
         element = self.create_element(cim.Ensemble)
-        required = ["long_name", "short_name"]
-        optional = []
-        self.populate_attr(element, metadata, required, optional)
+        self.populate(element, metadata)
         try:
             element.types.append(metadata["type"])
         except KeyError:
@@ -122,14 +125,15 @@ class Ensemble(Element):
 
 class EnsembleMember(Element):
 
+    required_attr = ["short_name", "long_name"]
+    optional_attr = ["description"]
+
     def __init__(self, dao, id_dao, attribute):
         super(EnsembleMember, self).__init__(dao, id_dao, attribute)
 
     def cim_element(self, metadata, leaves):
         element = self.create_element(cim.EnsembleMember)
-        required = ["short_name", "long_name"]
-        optional = ["description"]
-        self.populate_attr(element, metadata, required, optional)
+        self.populate(element, metadata)
         try:
             standard_name = StandardName(
                 None, None,
@@ -149,14 +153,15 @@ class EnsembleMember(Element):
 
 class Conformance(Element):
 
+    required_attr = ["is_conformant"]
+    optional_attr = ["description", "type"]
+
     def __init__(self, dao, id_dao, attribute):
         super(Conformance, self).__init__(dao, id_dao, attribute)
 
     def cim_element(self, metadata, leaves):
         element = self.create_element(cim.Conformance)
-        required = ["is_conformant"]
-        optional = ["description", "type"]
-        self.populate_attr(element, metadata, required, optional)
+        self.populate(element, metadata)
         return element
 
     def add_to_doc(self, doc, model_element):
@@ -12,14 +12,15 @@ from element import Element
 
 class DataObject(Element):
 
+    required_attr = ["acronym"]
+    optional_attr = ["description"]
+
     def __init__(self, dao, id_dao, attribute):
         super(DataObject, self).__init__(dao, id_dao, attribute)
 
     def cim_element(self, metadata, leaves):
         element = self.create_element(cim.DataObject)
-        required = ["acronym"]
-        optional = ["description"]
-        self.populate_attr(element, metadata, required, optional)
+        self.populate(element, metadata)
         self.id_name = element.acronym
         self.id_dao.add_id("DataObject", self.id_name, element.meta.id)
         return element
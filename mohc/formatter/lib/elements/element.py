@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
 import abc
+import datetime
+import re
+import uuid
 
 import pyesdoc
 import pyesdoc.ontologies.cim.v1 as cim
@@ -13,15 +16,69 @@ from dao.dao_exception import DaoContractException
 # see <http://www.gnu.org/licenses/>
 
 
+def attr_mapper(required, optional):
+    """ Returns a function that copies the required and optional
+    attributes from a metadata dictionary to a pyesdoc element in one
+    pass. A missing required attribute raises DaoContractException and
+    missing optional attributes are skipped.
+    """
+    lines = ["def populate(element, metadata):"]
+    if required:
+        lines.append("    try:")
+        for attr in required:
+            lines.append(
+                "        element.%s = metadata[%r]" % (_attr_name(attr), attr))
+        lines.append("    except KeyError as err:")
+        lines.append("        raise DaoContractException(")
+        lines.append("            \"Required attr %s missing\" % err.args[0])")
+    for attr in optional:
+        lines.append("    if %r in metadata:" % attr)
+        lines.append(
+            "        element.%s = metadata[%r]" % (_attr_name(attr), attr))
+    lines.append("    return")
+    namespace = {"DaoContractException": DaoContractException}
+    exec "\n".join(lines) in namespace
+    return namespace["populate"]
+
+
+def _attr_name(attr):
+    # Attribute names end up in generated code, so only accept plain
+    # identifiers.
+    if not re.match(r"^[A-Za-z_][A-Za-z0-9_]*$", attr):
+        raise TypeError("Invalid attribute name %r" % attr)
+    return attr
+
+
+class ElementType(abc.ABCMeta):
+    """ Metaclass for Element. Compiles each class's required_attr and
+    optional_attr declarations into a populate method when the class
+    is created, so we don't walk the attribute lists for every CIM
+    element we build.
+    """
+
+    def __init__(cls, name, bases, namespace):
+        super(ElementType, cls).__init__(name, bases, namespace)
+        cls.populate = staticmethod(
+            attr_mapper(cls.required_attr, cls.optional_attr))
+
+
 class Element(object):
     """ Abstract base class for representing CIM elements. Child
     classes must implement the cim_element method (which creates an
     appropriate pyesdoc object and populates its attributes using
     provided metadata) and add_to_doc (which adds a CIM element to a
     another containing CIM element).
+
+    Child classes can declare the metadata attributes they copy
+    straight into their CIM element in required_attr and
+    optional_attr, and then call populate(element, metadata) from
+    cim_element.
     """
 
-    __metaclass__ = abc.ABCMeta
+    __metaclass__ = ElementType
+
+    required_attr = ()
+    optional_attr = ()
 
     def __init__(self, dao, id_dao, attribute):
         """ Standard initialisation code for all Element-type objects. """
@@ -36,11 +93,13 @@ class Element(object):
         expand to lists of nodes of the same type (e.g. Citation,
         SubModel).
         """
+        template_dao = self.dao
         daos = self.daos_for_node(constraint)
         for dao in daos:
             self.dao = dao
             cim_element = self.make_doc_from_metadata(constraint, [])
             self.add_to_doc(doc, cim_element)
+        self.dao = template_dao
         return
 
     def make_doc_from_metadata(self, constraint, leaves):
@@ -68,24 +127,7 @@ class Element(object):
 
     def create_element(self, element_type):
         """ Wrap pyesdoc create call. """
-        return pyesdoc.create(
-            element_type, project=self.project,
-            institute=self.institute, version=0)
-
-    def populate_attr(self, element, metadata, required, optional):
-        """ Sets required and optional elements from metadata. """
-        for req_attr in required:
-            try:
-                setattr(element, req_attr, metadata[req_attr])
-            except KeyError:
-                raise DaoContractException(
-                    "Required attr %s missing" % req_attr)
-        for opt_attr in optional:
-            try:
-                setattr(element, opt_attr, metadata[opt_attr])
-            except KeyError:
-                pass
-        return
+        return _factory.create(element_type, self.project, self.institute)
 
     def calendar(self, calendar):
         """ Map text calendar strings to appropriate CIM types. """
@@ -126,3 +168,55 @@ class Element(object):
     def add_to_doc(self, doc, cim_element):
         """ Inserts cim_element into doc in the appropriate location. """
         return
+
+
+class ElementFactory(object):
+    """ Creates pyesdoc objects by cloning a prototype.
+
+    pyesdoc.create checks the type against every known ontology type
+    and rebuilds the document meta information on every call. We only
+    ever ask for a handful of (type, project, institute) combinations,
+    so we call pyesdoc.create once for each combination, keep the meta
+    attributes it sets as a prototype, and give each clone a fresh id
+    and creation date.
+    """
+
+    def __init__(self):
+        self.prototype = {}
+        self.created = 0
+
+    def create(self, element_type, project, institute):
+        """ Returns a new pyesdoc object equivalent to one made by
+        pyesdoc.create with the same arguments.
+        """
+        key = (element_type, project, institute)
+        try:
+            meta = self.prototype[key]
+        except KeyError:
+            meta = self._prototype_meta(element_type, project, institute)
+            self.prototype[key] = meta
+        element = element_type()
+        self.created += 1
+        if meta is not None:
+            element.meta.__dict__.update(meta)
+            element.meta.id = unicode(uuid.uuid4())
+            element.meta.create_date = datetime.datetime.now()
+        return element
+
+    def _prototype_meta(self, element_type, project, institute):
+        # Only document types have meta information. Lists are left
+        # out so that each clone keeps the fresh (empty) lists made by
+        # its own constructor.
+        prototype = pyesdoc.create(
+            element_type, project=project, institute=institute, version=0)
+        if not hasattr(prototype, "meta"):
+            return None
+        meta = {}
+        for attr, value in prototype.meta.__dict__.items():
+            if attr in ["id", "create_date"] or isinstance(value, list):
+                continue
+            meta[attr] = value
+        return meta
+
+
+_factory = ElementFactory()
@@ -14,6 +14,9 @@ from element import Element
 
 class GridSpec(Element):
 
+    required_attr = ["short_name"]
+    optional_attr = ["long_name", "description"]
+
     def __init__(self, dao, id_dao, attribute):
         super(GridSpec, self).__init__(dao, id_dao, attribute)
 
@@ -21,9 +24,7 @@ class GridSpec(Element):
         element = self.create_element(cim.GridSpec)
         # Note: short_name isn't mandatory according to the CIM, but
         # we need some metadata we can use for a reference name.
-        required = ["short_name"]
-        optional = ["long_name", "description"]
-        self.populate_attr(element, metadata, required, optional)
+        self.populate(element, metadata)
         self.id_dao.add_id(
             "GridSpec", metadata["short_name"], element.meta.id)
         return element
@@ -35,6 +36,9 @@ class GridSpec(Element):
 
 class GridMosaic(Element):
 
+    required_attr = ["type"]
+    optional_attr = ["short_name", "long_name", "description"]
+
     def __init__(self, dao, id_dao, attribute):
         super(GridMosaic, self).__init__(dao, id_dao, attribute)
         self.esm_type = str(attribute["esm_type"])
@@ -47,9 +51,7 @@ class GridMosaic(Element):
         element = self.create_element(cim.GridMosaic)
         # Note: is_leaf is also required, but we deduce it from
         # our leaf nodes.
-        required = ["type"]
-        optional = ["short_name", "long_name", "description"]
-        self.populate_attr(element, metadata, required, optional)
+        self.populate(element, metadata)
         element.id = str(uuid.uuid4())
         element.is_leaf = True
         for leaf in leaves:
@@ -83,6 +85,11 @@ class GridMosaic(Element):
 
 class GridTile(Element):
 
+    required_attr = ["discretization_type"]
+    optional_attr = [
+        "short_name", "long_name", "description", "is_uniform",
+        "is_regular"]
+
     def __init__(self, dao, id_dao, attribute):
         super(GridTile, self).__init__(dao, id_dao, attribute)
 
@@ -92,11 +99,7 @@ class GridTile(Element):
 
     def cim_element(self, metadata, leaves):
         element = self.create_element(cim.GridTile)
-        required = ["discretization_type"]
-        optional = [
-            "short_name", "long_name", "description",
-            "is_uniform", "is_regular"]
-        self.populate_attr(element, metadata, required, optional)
+        self.populate(element, metadata)
         return element
 
     def add_to_doc(self, doc, model_element):
@@ -15,6 +15,9 @@ from dao.dao_exception import DaoContractException
 
 class Citation(Element):
 
+    required_attr = ["title", "date"]
+    optional_attr = ["location", "collective_title"]
+
     def __init__(self, dao, id_dao, attribute):
         super(Citation, self).__init__(dao, id_dao, attribute)
 
@@ -24,9 +27,7 @@ class Citation(Element):
 
     def cim_element(self, metadata, leaves):
         element = self.create_element(cim.Citation)
-        required = ["title", "date"]
-        optional = ["location", "collective_title"]
-        self.populate_attr(element, metadata, required, optional)
+        self.populate(element, metadata)
         return element
 
     def add_to_doc(self, doc, model_element):
@@ -92,6 +93,8 @@ class ReferenceByName(Element):
 
     """ Handles references by name. """
 
+    optional_attr = ["name", "description", "type", "version"]
+
     def __init__(self, dao, id_dao, attribute):
         super(ReferenceByName, self).__init__(dao, id_dao, attribute)
         self.link_to = attribute["link_to"]
@@ -102,14 +105,12 @@ class ReferenceByName(Element):
 
     def cim_element(self, metadata, leaves):
         element = self.create_element(cim.DocReference)
-        required = []
-        optional = ["name", "description", "type", "version"]
-        possible = set(optional)
+        possible = set(self.optional_attr)
         supplied = set(metadata.keys())
         if len(possible.intersection(supplied)) == 0:
             raise DaoContractException(
                 "Need at least one of the optional attributes")
-        self.populate_attr(element, metadata, required, optional)
+        self.populate(element, metadata)
         return element
 
     def add_to_doc(self, doc, model_element):
@@ -125,6 +126,9 @@ class ReferenceByName(Element):
 
 class Platform(Element):
 
+    required_attr = ["short_name"]
+    optional_attr = ["long_name"]
+
     def __init__(self, dao, id_dao, attribute):
         super(Platform, self).__init__(dao, id_dao, attribute)
 
@@ -139,9 +143,7 @@ class Platform(Element):
         mcu.compilers.append(compiler)
 
         element = self.create_element(cim.Platform)
-        required = ["short_name"]
-        optional = ["long_name"]
-        self.populate_attr(element, metadata, required, optional)
+        self.populate(element, metadata)
         element.units.append(mcu)
 
         self.id_name = element.short_name
@@ -175,6 +177,9 @@ class Platform(Element):
 
 class ResponsibleParty(Element):
 
+    optional_attr = [
+        "email", "address", "url", "individual_name", "organisation_name"]
+
     def __init__(self, dao, id_dao, attribute):
         super(ResponsibleParty, self).__init__(dao, id_dao, attribute)
 
@@ -184,9 +189,7 @@ class ResponsibleParty(Element):
 
     def cim_element(self, metadata, leaves):
         element = self.create_element(cim.ResponsibleParty)
-        optional = [
-            "email", "address", "url", "individual_name", "organisation_name"]
-        self.populate_attr(element, metadata, [], optional)
+        self.populate(element, metadata)
         return element
 
     def add_to_doc(self, doc, model_element):
@@ -196,13 +199,14 @@ class ResponsibleParty(Element):
 
 class StandardName(Element):
 
+    required_attr = ["value"]
+
     def __init__(self, dao, id_dao, attribute):
         super(StandardName, self).__init__(dao, id_dao, attribute)
 
     def cim_element(self, metadata, leaves):
         element = self.create_element(cim.StandardName)
-        required = ["value"]
-        self.populate_attr(element, metadata, required, [])
+        self.populate(element, metadata)
         setattr(element, "is_open", True)
         return element
 
@@ -32,14 +32,15 @@ class Model(Element):
     # the CIM (they are both ModelComponents), but typically they
     # contain different metadata in documents, so I've split them up.
 
+    required_attr = ["short_name"]
+    optional_attr = ["long_name", "description", "release_date"]
+
     def __init__(self, dao, id_dao, attribute):
         super(Model, self).__init__(dao, id_dao, attribute)
 
     def cim_element(self, metadata, leaves):
         element = self.create_element(cim.ModelComponent)
-        required = ["short_name"]
-        optional = ["long_name", "description", "release_date"]
-        self.populate_attr(element, metadata, required, optional)
+        self.populate(element, metadata)
         self.id_name = element.short_name
         self.id_dao.add_id("ModelComponent", self.id_name, element.meta.id)
         element.meta.type = unicode(element.meta.type)
@@ -57,6 +58,9 @@ class SubModel(Element):
     could represent "Atmosphere" or "Aerosols".
     """
 
+    required_attr = ["short_name", "type"]
+    optional_attr = ["long_name", "description"]
+
     def __init__(self, dao, id_dao, attribute):
         super(SubModel, self).__init__(dao, id_dao, attribute)
         self.container_id_name = ""
@@ -69,9 +73,7 @@ class SubModel(Element):
 
     def cim_element(self, metadata, leaves):
         element = self.create_element(cim.ModelComponent)
-        required = ["short_name", "type"]
-        optional = ["long_name", "description"]
-        self.populate_attr(element, metadata, required, optional)
+        self.populate(element, metadata)
         if not self.container_id_name:
             self.container_id_name = self.model
         self.id_name = "%s:%s" % (self.container_id_name, element.short_name)
@@ -87,6 +89,9 @@ class SubModel(Element):
 
 class ComponentProperty(Element):
 
+    required_attr = ["short_name"]
+    optional_attr = ["description", "units", "values"]
+
     def __init__(self, dao, id_dao, attribute):
         super(ComponentProperty, self).__init__(dao, id_dao, attribute)
 
@@ -96,9 +101,7 @@ class ComponentProperty(Element):
 
     def cim_element(self, metadata, leaves):
         element = self.create_element(cim.ComponentProperty)
-        required = ["short_name"]
-        optional = ["description", "units", "values"]
-        self.populate_attr(element, metadata, required, optional)
+        self.populate(element, metadata)
         element.is_represented = True
         return element
 
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+""" Modules that are only imported when they are first used.
+
+Importing pyesdoc, the elements package or a database driver takes
+much longer than anything formatCIM.py does before it reads the
+metadata, so printing usage or rejecting a bad option shouldn't wait
+for them. Instead of
+
+    import pyesdoc
+
+a module can use
+
+    pyesdoc = lazy_module("pyesdoc")
+
+and pyesdoc is imported the first time one of its attributes is used.
+"""
+
+import importlib
+import types
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3 see
+# <http://www.gnu.org/licenses/>
+
+
+def lazy_module(name):
+    return LazyModule(name)
+
+
+class LazyModule(types.ModuleType):
+    """ Stands in for the module name, importing it when one of its
+    attributes is first looked up.
+    """
+
+    def __init__(self, name):
+        super(LazyModule, self).__init__(name)
+        self._module = None
+
+    def __getattr__(self, attr):
+        # Only called for attributes the stand-in doesn't have itself.
+        if self._module is None:
+            self._module = importlib.import_module(self.__name__)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = "imported" if self._module is not None else "not imported"
+        return "<lazy module %r (%s)>" % (self.__name__, state)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+""" Memory snapshots for the phases of a formatter run.
+
+A MemoryProfiler takes a snapshot at the end of each phase it is
+told about. Each snapshot records the process's RSS, the objects the
+garbage collector tracks (counted and sized by type), the dao
+objects by class (row handles show up as <Dao>Handle), the pyesdoc
+objects by type and the retained size of any objects being watched,
+such as the template's build tree and the document.
+
+tracemalloc isn't part of Python 2.7. If the pytracemalloc backport
+is installed, snapshots also list the top allocation sites.
+Otherwise sizes come from sys.getsizeof, which doesn't include the
+strings and numbers an object refers to unless the size is a
+retained size.
+"""
+
+import gc
+import os
+import resource
+import sys
+import types
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3 see
+# <http://www.gnu.org/licenses/>
+
+# Objects shared by everything, which we don't count in the retained
+# size of a watched object.
+_SHARED_TYPES = (
+    type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType,
+    types.MethodType, types.CodeType, types.FrameType)
+
+
+class MemoryProfiler(object):
+    """ Takes and reports memory snapshots. top is the number of
+    types and allocation sites to list in each snapshot.
+    """
+
+    def __init__(self, top=15):
+        self.top = top
+        self.snapshots = []
+        self.watched = []
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def watch(self, name, obj):
+        """ Reports the retained size of obj in later snapshots. """
+        self.watched.append((name, obj))
+        return
+
+    def snapshot(self, label):
+        gc.collect()
+        by_type = {}
+        daos = {}
+        pyesdoc_objects = {}
+        for obj in gc.get_objects():
+            cls = type(obj)
+            name = "%s.%s" % (cls.__module__, cls.__name__)
+            count, size = by_type.get(name, (0, 0))
+            by_type[name] = (count + 1, size + sys.getsizeof(obj))
+            if _is_dao(cls):
+                daos[cls.__name__] = daos.get(cls.__name__, 0) + 1
+            elif cls.__module__.startswith("pyesdoc.ontologies"):
+                pyesdoc_objects[cls.__name__] = (
+                    pyesdoc_objects.get(cls.__name__, 0) + 1)
+        snapshot = {
+            "label": label, "rss_kb": _rss_kb(),
+            "peak_rss_kb": resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss,
+            "types": by_type, "daos": daos, "pyesdoc": pyesdoc_objects,
+            "retained": dict(
+                (name, retained_size(obj)) for name, obj in self.watched),
+            "sites": []}
+        if tracemalloc is not None:
+            statistics = tracemalloc.take_snapshot().statistics("lineno")
+            for stat in statistics[:self.top]:
+                frame = stat.traceback[0]
+                snapshot["sites"].append((
+                    "%s:%d" % (frame.filename, frame.lineno), stat.size,
+                    stat.count))
+        self.snapshots.append(snapshot)
+        return snapshot
+
+    def report(self):
+        """ Returns the snapshots as text. Type counts are followed by
+        the change since the previous snapshot.
+        """
+        lines = []
+        previous = {}
+        for snapshot in self.snapshots:
+            lines.append("== after %s: rss %d kB, peak rss %d kB" % (
+                snapshot["label"], snapshot["rss_kb"],
+                snapshot["peak_rss_kb"]))
+            for name in sorted(snapshot["retained"]):
+                lines.append("retained size of %s: %d kB" % (
+                    name, snapshot["retained"][name] / 1024))
+            lines.append("top types by size:")
+            ranked = sorted(
+                snapshot["types"].items(), key=lambda item: -item[1][1])
+            for name, (count, size) in ranked[:self.top]:
+                before = previous.get(name, (0, 0))[0]
+                lines.append("  %10d B %8d objects (%+d)  %s" % (
+                    size, count, count - before, name))
+            lines.extend(_counts("daos", snapshot["daos"]))
+            lines.extend(_counts("pyesdoc objects", snapshot["pyesdoc"]))
+            if snapshot["sites"]:
+                lines.append("top allocation sites:")
+                for site, size, count in snapshot["sites"]:
+                    lines.append("  %10d B %8d blocks  %s" % (
+                        size, count, site))
+            previous = snapshot["types"]
+        return "\n".join(lines)
+
+    def save(self, path):
+        with open(path, "w") as report_file:
+            report_file.write("%s\n" % self.report())
+        return
+
+
+def retained_size(obj):
+    """ Returns the total size of obj and every object it refers to,
+    directly or indirectly, leaving out classes, modules and
+    functions.
+    """
+    seen = set()
+    size = 0
+    to_visit = [obj]
+    while to_visit:
+        current = to_visit.pop()
+        if id(current) in seen or isinstance(current, _SHARED_TYPES):
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+        to_visit.extend(gc.get_referents(current))
+    return size
+
+
+def _is_dao(cls):
+    return cls.__module__.startswith("dao.") and hasattr(cls, "metadata")
+
+
+def _counts(title, counts):
+    lines = ["%s: %d" % (title, sum(counts.values()))]
+    for name, count in sorted(counts.items(), key=lambda item: -item[1]):
+        lines.append("  %8d  %s" % (count, name))
+    return lines
+
+
+def _rss_kb():
+    # Current RSS from /proc where we have it, otherwise the peak.
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize() / 1024
+    except (IOError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+
+""" Writing documents to an output directory, and only when they've
+changed.
+
+Every build of a document gives its elements new ids (uuids) and
+creation dates, so two builds from the same metadata never give the
+same file. To tell whether a document has changed, we encode it with
+its creation dates set to a fixed date and its own ids replaced by
+their order of appearance, and hash the result. An OutputManifest
+keeps, for each document written to an output directory, that hash,
+the ids the document was written with and a hash of each file written.
+
+If a new build has the same hash and its files haven't been touched
+since, it's the same document: the files are kept, and the new
+build's ids are changed back to the old ones in the id store (see
+DocIdDao.replace_ids) so references to the document stay valid. This
+has to happen before the ids are saved. References to other documents
+aren't masked, so a document is rewritten if something it refers to
+was.
+
+Documents that have changed are written by an OutputLayout, to a
+temporary file in the output directory that is renamed into place
+once it's complete, so nothing ever sees a partly written document.
+A layout can also spread files over sub-directories, so no directory
+gets too big, and gzip them. INDEX_FILE, in the output directory,
+lists the id, type, encoding and path of every file it writes.
+"""
+
+import datetime
+import errno
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+
+from lazy_import import lazy_module
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3 see
+# <http://www.gnu.org/licenses/>
+
+pyesdoc = lazy_module("pyesdoc")
+
+MANIFEST_FILE = "doc_hashes.json"
+
+INDEX_FILE = "doc_index.jsonl"
+
+LAYOUTS = ["flat", "tree", "hashed"]
+
+# Stands in for creation dates while a document is hashed.
+_FIXED_DATE = datetime.datetime(2000, 1, 1)
+
+_UUID = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+class OutputManifest(object):
+    """ The documents written to output_dir, kept in MANIFEST_FILE.
+    Documents are identified by a key (see doc_key) that stays the
+    same from one build to the next.
+    """
+
+    def __init__(self, output_dir):
+        self.dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_FILE)
+        self.entries = _load(self.path)
+        self.changed = set()
+        self.lock = threading.Lock()
+
+    def compare(self, key, doc, encodings):
+        """ Returns a DocVersion for doc, to be written in each of
+        encodings. It's unchanged if the files written last time can
+        be kept.
+        """
+        text, ids = masked(doc, encodings[0])
+        version = DocVersion(self, key, encodings[0], _hash(text), ids)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and self._same(entry, version, encodings):
+            version.old_ids = entry["ids"]
+            version.paths = [
+                self._path(entry["files"][encoding][0])
+                for encoding in encodings]
+        return version
+
+    def record(self, version, encodings, paths):
+        """ Records that version has been written to paths, one for
+        each of encodings.
+        """
+        files = {}
+        for encoding, path in zip(encodings, paths):
+            files[encoding] = [
+                os.path.relpath(path, self.dir), file_hash(path)]
+        with self.lock:
+            self.entries[version.key] = {
+                "encoding": version.encoding, "hash": version.hash,
+                "ids": version.ids, "files": files}
+            self.changed.add(version.key)
+        return
+
+    def save(self):
+        """ Saves the entries we've changed. Entries saved by other
+        runs since we read the manifest are kept.
+        """
+        with self.lock:
+            if not self.changed:
+                return
+            entries = _load(self.path)
+            for key in self.changed:
+                entries[key] = self.entries[key]
+            handle, temp_path = tempfile.mkstemp(
+                prefix=".%s." % MANIFEST_FILE, dir=self.dir)
+            with os.fdopen(handle, "w") as manifest_file:
+                json.dump(entries, manifest_file, indent=1, sort_keys=True)
+                manifest_file.write("\n")
+            os.chmod(temp_path, 0644)
+            os.rename(temp_path, self.path)
+            self.changed = set()
+        return
+
+    def _same(self, entry, version, encodings):
+        if (entry.get("encoding"), entry.get("hash")) != \
+                (version.encoding, version.hash) or \
+                len(entry.get("ids", [])) != len(version.ids):
+            return False
+        files = entry.get("files", {})
+        for encoding in encodings:
+            if encoding not in files:
+                return False
+            path, saved_hash = files[encoding]
+            try:
+                if file_hash(self._path(path)) != saved_hash:
+                    return False
+            except (IOError, OSError):
+                return False
+        return True
+
+    def _path(self, path):
+        return os.path.join(self.dir, path)
+
+
+class DocVersion(object):
+    """ A build of the document called key, compared with manifest.
+    hash is the hash of its masked encoding and ids are its own ids in
+    the order they appear. If the document is unchanged, old_ids are
+    the ids it was written with and paths are its files.
+    """
+
+    __slots__ = (
+        "manifest", "key", "encoding", "hash", "ids", "old_ids", "paths")
+
+    def __init__(self, manifest, key, encoding, hash, ids):
+        self.manifest = manifest
+        self.key = key
+        self.encoding = encoding
+        self.hash = hash
+        self.ids = ids
+        self.old_ids = None
+        self.paths = None
+
+    def unchanged(self):
+        return self.paths is not None
+
+    def id_map(self):
+        """ Returns a dictionary of new id: old id. """
+        return dict(zip(self.ids, self.old_ids or []))
+
+
+def doc_key(project, doc_type, names):
+    """ Returns the key for a document, such as "CMIP5 submodel
+    HadGEM2-ES:Aerosols". names are the names of the metadata it's
+    built from, model first.
+    """
+    return "%s %s %s" % (project, doc_type, ":".join(names))
+
+
+def manifest_dir(output_path):
+    """ Returns the directory whose manifest covers output_path, which
+    is a directory or a file, as for pyesdoc.write.
+    """
+    if os.path.isdir(output_path):
+        return output_path
+    return os.path.dirname(output_path) or os.curdir
+
+
+def masked(doc, encoding):
+    """ Returns doc encoded with encoding, with its creation dates set
+    to a fixed date and its own ids replaced by "ID0", "ID1" and so
+    on, and a list of the ids in the order they were replaced.
+    """
+    own_ids = set()
+    metas = []
+    for obj in objects(doc):
+        if type(obj).__name__ == "DocReference":
+            continue
+        if isinstance(getattr(obj, "id", None), basestring):
+            own_ids.add(obj.id)
+        if hasattr(obj, "create_date"):
+            metas.append(obj)
+    dates = [meta.create_date for meta in metas]
+    try:
+        for meta in metas:
+            meta.create_date = _FIXED_DATE
+        text = pyesdoc.encode(doc, encoding)
+    finally:
+        for meta, date in zip(metas, dates):
+            meta.create_date = date
+    ids = []
+    numbers = {}
+
+    def number(match):
+        id = match.group(0)
+        if id not in own_ids:
+            return id
+        if id not in numbers:
+            numbers[id] = len(ids)
+            ids.append(id)
+        return "ID%d" % numbers[id]
+    return _UUID.sub(number, text), ids
+
+
+class OutputLayout(object):
+    """ Writes documents to an output directory. layout is one of
+    LAYOUTS:
+
+    flat: every file in the output directory, as pyesdoc.write does.
+    tree: in <institute>/<project>/<document type> below it.
+    hashed: in one of 256 sub-directories named from the document's
+        id, which spreads files evenly however they're named.
+
+    If compress is true, files are gzipped and ".gz" is added to their
+    names. Every file written is listed in INDEX_FILE.
+    """
+
+    def __init__(self, layout="flat", compress=False):
+        if layout not in LAYOUTS:
+            raise ValueError("Unknown output layout %s" % layout)
+        self.layout = layout
+        self.compress = compress
+        self.lock = threading.Lock()
+
+    def write(self, doc, output_path, encoding):
+        """ Writes doc like pyesdoc.write, but to a temporary file
+        that's renamed into place once it's complete. Returns the path
+        written.
+        """
+        root = manifest_dir(output_path)
+        if os.path.isdir(output_path):
+            directory = os.path.join(root, *self.sub_dirs(doc))
+            _make_dirs(directory)
+            name = pyesdoc.get_filename(doc, encoding)
+        else:
+            directory = root
+            name = os.path.basename(output_path)
+        path = os.path.join(directory, name)
+        if self.compress and not path.endswith(".gz"):
+            path += ".gz"
+        text = pyesdoc.encode(doc, encoding)
+        if isinstance(text, unicode):
+            text = text.encode("utf-8")
+        handle, temp_path = tempfile.mkstemp(
+            prefix=".writing.", dir=directory)
+        try:
+            with os.fdopen(handle, "wb") as doc_file:
+                if self.compress:
+                    # Compressed as it's written. The header gets the
+                    # document's name rather than the temporary one.
+                    with gzip.GzipFile(path, "wb", fileobj=doc_file) as packed:
+                        packed.write(text)
+                else:
+                    doc_file.write(text)
+            os.chmod(temp_path, 0644)
+            os.rename(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._add_to_index(root, doc, encoding, path)
+        return path
+
+    def sub_dirs(self, doc):
+        """ Returns the sub-directories doc's files go in. """
+        if self.layout == "tree":
+            return [
+                doc.meta.institute or "unknown",
+                doc.meta.project or "unknown",
+                type(doc).__name__]
+        if self.layout == "hashed":
+            return [hashlib.sha1(doc.meta.id).hexdigest()[:2]]
+        return []
+
+    def _add_to_index(self, root, doc, encoding, path):
+        line = json.dumps({
+            "id": doc.meta.id, "version": doc.meta.version,
+            "type": doc.meta.type,
+            "name": getattr(doc, "short_name", None),
+            "encoding": encoding, "path": os.path.relpath(path, root)},
+            sort_keys=True)
+        # Each line is appended with a single write, so processes
+        # writing to the same directory don't mix up their lines.
+        with self.lock:
+            with open(os.path.join(root, INDEX_FILE), "a") as index:
+                index.write(line + "\n")
+        return
+
+
+def read_index(output_dir):
+    """ Returns the entries in output_dir's INDEX_FILE, keeping the
+    last one written for each document and encoding.
+    """
+    entries = {}
+    try:
+        with open(os.path.join(output_dir, INDEX_FILE)) as index:
+            for line in index:
+                entry = json.loads(line)
+                entries[(entry["id"], entry["encoding"])] = entry
+    except IOError:
+        return []
+    return sorted(
+        entries.values(),
+        key=lambda entry: (entry["path"], entry["encoding"]))
+
+
+def objects(doc):
+    """ Yields every pyesdoc object in doc, including doc. Documents
+    can be deeply nested, so this doesn't recurse.
+    """
+    seen = set()
+    stack = [doc]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+            continue
+        if not hasattr(obj, "__dict__") or id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        yield obj
+        stack.extend(obj.__dict__.values())
+    return
+
+
+def file_hash(path):
+    """ Returns the SHA-1 hash of the file at path. """
+    digest = hashlib.sha1()
+    with open(path, "rb") as doc_file:
+        for block in iter(lambda: doc_file.read(65536), ""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _make_dirs(directory):
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        # Another writer may have made it first.
+        if e.errno != errno.EEXIST:
+            raise
+    return
+
+
+def _hash(text):
+    if isinstance(text, unicode):
+        text = text.encode("utf-8")
+    return hashlib.sha1(text).hexdigest()
+
+
+def _load(path):
+    try:
+        with open(path) as manifest_file:
+            entries = json.load(manifest_file)
+    except (IOError, ValueError):
+        # No manifest yet, or one we can't read: everything will be
+        # written again.
+        return {}
+    if not isinstance(entries, dict):
+        return {}
+    return entries
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+""" A pipeline of stages connected by bounded queues.
+
+Each stage has its own pool of worker threads, which take items from
+the stage's input queue, call the stage's function on them and put
+the results on the next stage's queue. The queues are bounded, so a
+fast stage waits for a slow one rather than holding every item in
+memory. Because the stages run at the same time, one document's
+metadata can be extracted while another is being validated or
+written.
+
+The workers are threads, so Python code in one stage only runs
+while the others are waiting: on queries to the metadata store, or
+on reading and writing files. Stages whose functions raise an
+exception for an item pass the item straight to the end of the
+pipeline with the error, skipping the stages after them.
+"""
+
+import Queue
+import threading
+import time
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3 see
+# <http://www.gnu.org/licenses/>
+
+# Put on a queue once for each worker when there are no more items.
+_DONE = object()
+
+
+class Stage(object):
+    """ A step in a pipeline. function is called with each item and
+    returns the item to pass to the next stage.
+    """
+
+    def __init__(self, name, function, workers=1):
+        if workers < 1:
+            raise ValueError("Stage %s needs at least one worker" % name)
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.items = 0
+        self.failed = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    def stats(self):
+        return {
+            "workers": self.workers, "items": self.items,
+            "failed": self.failed, "seconds": self.seconds}
+
+
+class Result(object):
+    """ An item that has been through the pipeline. index is its
+    position in the input. error is None if every stage succeeded, or
+    "<stage>: <message>" for the stage that failed. seconds is the time
+    the stages spent on the item.
+    """
+
+    __slots__ = ("index", "item", "error", "seconds")
+
+    def __init__(self, index, item, error=None):
+        self.index = index
+        self.item = item
+        self.error = error
+        self.seconds = 0.0
+
+
+class Pipeline(object):
+    """ Runs items through stages. At most queue_size items wait
+    between any two stages.
+    """
+
+    def __init__(self, stages, queue_size=4):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = stages
+        self.queue_size = queue_size
+
+    def run(self, items):
+        """ Passes each of items through the stages and returns a
+        Result for each one, in the same order as items.
+        """
+        queues = [Queue.Queue(self.queue_size) for stage in self.stages]
+        # Results aren't bounded, so the last stage never waits for us.
+        queues.append(Queue.Queue())
+        threads = [threading.Thread(
+            target=self._feed, args=(items, queues[0]))]
+        for position, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work, args=(
+                        stage, queues[position], queues[position + 1],
+                        queues[-1], remaining)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        results = []
+        while True:
+            # A timeout keeps the wait interruptible.
+            try:
+                result = queues[-1].get(timeout=1)
+            except Queue.Empty:
+                continue
+            if result is _DONE:
+                break
+            results.append(result)
+        for thread in threads:
+            thread.join()
+        return sorted(results, key=lambda result: result.index)
+
+    def _feed(self, items, queue):
+        for index, item in enumerate(items):
+            queue.put(Result(index, item))
+        for _ in range(self.stages[0].workers):
+            queue.put(_DONE)
+        return
+
+    def _work(self, stage, in_queue, out_queue, results, remaining):
+        next_workers = self._next_workers(stage)
+        while True:
+            result = in_queue.get()
+            if result is _DONE:
+                break
+            start = time.time()
+            try:
+                result.item = stage.function(result.item)
+                to_queue = out_queue
+            except Exception as e:
+                result.error = "%s: %s" % (stage.name, e)
+                to_queue = results
+            seconds = time.time() - start
+            result.seconds += seconds
+            with stage.lock:
+                stage.items += 1
+                stage.seconds += seconds
+                if result.error is not None:
+                    stage.failed += 1
+            to_queue.put(result)
+        with stage.lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            # Every worker in this stage has finished, so the next
+            # stage won't get any more items.
+            for _ in range(next_workers):
+                out_queue.put(_DONE)
+        return
+
+    def _next_workers(self, stage):
+        position = self.stages.index(stage)
+        if position + 1 < len(self.stages):
+            return self.stages[position + 1].workers
+        return 1
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+""" Snapshots of the metadata a document build reads from its daos.
+
+Building a document does two things: it extracts metadata from the
+metadata store (the dao queries) and renders it as a pyesdoc document.
+A Snapshot records everything the template's daos return while a
+document is built: each dao's metadata dictionaries and ids, the rows
+each node fans out to (daos_for_node) and the names used to find
+references. It also keeps the template and global configuration, so a
+snapshot file is all we need to render the document again, in any
+format, without the metadata store or the dao package. Snapshots are
+JSON (gzipped if the file name ends in ".gz"), so they can be kept,
+compared and copied between hosts.
+
+The id dao isn't recorded. Internal references are to ids made while
+the document is rendered, so the id dao is used as normal when the
+snapshot is replayed. Extracting a snapshot therefore still makes the
+pyesdoc elements (which register their ids), but doesn't validate or
+write the document.
+
+Record a build with record_builder, which returns the doc_builder tree
+to build, and replay it with load and replay_builder.
+"""
+
+import copy
+import datetime
+import decimal
+import gzip
+import itertools
+import json
+
+from dao.dao_exception import DaoMetadataException
+import template
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3 see
+# <http://www.gnu.org/licenses/>
+
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotError(Exception):
+    """ Raised for snapshots that can't be saved, read or replayed. """
+    pass
+
+
+class Snapshot(object):
+    """ The metadata returned by each dao in a document build. daos is
+    a list with, for each dao, a dictionary of the results returned by
+    each recorded method in the order they were returned. The
+    template's own daos come first, in the order doc_builder makes
+    them, and the rows they fan out to follow.
+    """
+
+    def __init__(self, template=None, global_config=None, names=None,
+                 daos=None):
+        self.template = template
+        self.global_config = global_config or {}
+        self.names = names or {}
+        self.daos = daos if daos is not None else []
+        self.recorders = {}
+        self.replayers = {}
+
+    def record_builder(self, parsed_template, dao_env, cfg):
+        """ Returns the doc_builder tree for parsed_template, with
+        daos that record what they return in this snapshot.
+        """
+        self.template = copy.deepcopy(parsed_template)
+        self.global_config = dict(cfg.get("global", {}))
+        # Taken before doc_builder adds the [database] configuration,
+        # which may include passwords.
+        self.names = dict(dao_env)
+
+        def make_dao(dao_attr, global_env, env):
+            return self.record(
+                template.dao_for_node(dao_attr, global_env, env))
+        return template.doc_builder(parsed_template, dao_env, cfg, make_dao)
+
+    def replay_builder(self, output_dir):
+        """ Returns the doc_builder tree for the snapshot's template,
+        with daos that replay the snapshot. Ids are kept in output_dir
+        if the template uses a persistent id store.
+        """
+        if self.template is None:
+            raise SnapshotError("Snapshot has no template")
+        dao_env = dict(self.names, output_dir=output_dir)
+        cfg = {"global": dict(self.global_config)}
+        indexes = itertools.count()
+
+        def make_dao(dao_attr, global_env, env):
+            index = next(indexes)
+            if index >= len(self.daos):
+                raise SnapshotError("Snapshot doesn't match its template")
+            return self.replay(index)
+        return template.doc_builder(
+            copy.deepcopy(self.template), dao_env, cfg, make_dao)
+
+    def record(self, dao):
+        """ Returns the RecordingDao for dao, making it if need be. """
+        try:
+            return self.recorders[id(dao)]
+        except KeyError:
+            pass
+        recorder = RecordingDao(self, dao, len(self.daos))
+        self.daos.append({})
+        self.recorders[id(dao)] = recorder
+        return recorder
+
+    def replay(self, index):
+        """ Returns the ReplayDao for the index'th dao. """
+        try:
+            return self.replayers[index]
+        except KeyError:
+            pass
+        replayer = ReplayDao(self, index)
+        self.replayers[index] = replayer
+        return replayer
+
+    def as_dict(self):
+        return {
+            "version": SNAPSHOT_VERSION, "template": self.template,
+            "global": self.global_config, "names": self.names,
+            "daos": self.daos}
+
+    def save(self, path):
+        with _open(path, "w") as snapshot_file:
+            json.dump(
+                self.as_dict(), snapshot_file, indent=1, sort_keys=True)
+            snapshot_file.write("\n")
+        return
+
+
+def load(path):
+    """ Reads a snapshot saved by Snapshot.save. """
+    try:
+        with _open(path, "r") as snapshot_file:
+            saved = json.load(snapshot_file)
+    except ValueError as e:
+        raise SnapshotError("Can't read snapshot %s: %s" % (path, e))
+    if not isinstance(saved, dict) or \
+            saved.get("version") != SNAPSHOT_VERSION:
+        raise SnapshotError(
+            "%s isn't a version %d snapshot" % (path, SNAPSHOT_VERSION))
+    try:
+        return Snapshot(
+            saved["template"], saved["global"], saved["names"],
+            saved["daos"])
+    except KeyError as e:
+        raise SnapshotError("Snapshot %s has no %s" % (path, e.args[0]))
+
+
+class RecordingDao(object):
+    """ Wraps a dao, recording the results of its daos_for_node, id,
+    metadata and name_for_reference methods. Anything else is passed
+    straight to the dao.
+    """
+
+    def __init__(self, snapshot, dao, index):
+        self.snapshot = snapshot
+        self.dao = dao
+        self.index = index
+
+    def daos_for_node(self, constraint):
+        daos = self.dao.daos_for_node(constraint)
+        if daos is None:
+            self._save("daos_for_node", None)
+            return None
+        recorders = [self.snapshot.record(dao) for dao in daos]
+        self._save("daos_for_node", [recorder.index for recorder in recorders])
+        return recorders
+
+    def id(self):
+        return self._save("id", self.dao.id())
+
+    def metadata(self, constraint):
+        return self._save("metadata", self.dao.metadata(constraint))
+
+    def name_for_reference(self, constraint):
+        return self._save(
+            "name_for_reference", self.dao.name_for_reference(constraint))
+
+    def container_metadata(self, container_dao):
+        # Daos look at their container's attributes, so they need the
+        # container itself rather than its recorder.
+        if isinstance(container_dao, RecordingDao):
+            container_dao = container_dao.dao
+        return self.dao.container_metadata(container_dao)
+
+    def __getattr__(self, attr):
+        return getattr(self.dao, attr)
+
+    def _save(self, method, result):
+        # Encoded straight away, in case the element changes the
+        # result once it has it.
+        self.snapshot.daos[self.index].setdefault(method, []).append(
+            encode(result))
+        return result
+
+
+class ReplayDao(object):
+    """ Stands in for the index'th dao of a snapshot, returning what
+    it returned when the snapshot was recorded.
+    """
+
+    def __init__(self, snapshot, index):
+        self.snapshot = snapshot
+        self.index = index
+        self.position = {}
+
+    def daos_for_node(self, constraint):
+        indexes = self._next("daos_for_node")
+        if indexes is None:
+            return None
+        return [self.snapshot.replay(index) for index in indexes]
+
+    def id(self):
+        return decode(self._next("id"))
+
+    def metadata(self, constraint):
+        return decode(self._next("metadata"))
+
+    def name_for_reference(self, constraint):
+        return decode(self._next("name_for_reference"))
+
+    def container_metadata(self, container_dao):
+        # The effect of the container on our results is already in
+        # the snapshot.
+        return
+
+    def _next(self, method):
+        position = self.position.get(method, 0)
+        try:
+            result = self.snapshot.daos[self.index][method][position]
+        except (KeyError, IndexError):
+            raise DaoMetadataException(
+                "Snapshot has no more %s results for dao %d" % (
+                    method, self.index))
+        self.position[method] = position + 1
+        return result
+
+
+def encode(value):
+    """ Returns value in a form that can be saved as JSON. Dates,
+    times and decimals are saved as tagged dictionaries.
+    """
+    if value is None or isinstance(value, (basestring, bool, int, long,
+                                           float)):
+        return value
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": [
+            value.year, value.month, value.day, value.hour, value.minute,
+            value.second, value.microsecond]}
+    if isinstance(value, datetime.date):
+        return {"__date__": [value.year, value.month, value.day]}
+    if isinstance(value, decimal.Decimal):
+        return {"__decimal__": str(value)}
+    if isinstance(value, dict):
+        return dict((key, encode(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    raise SnapshotError(
+        "Can't save a %s in a snapshot" % type(value).__name__)
+
+
+def decode(value):
+    """ Reverses encode. """
+    if isinstance(value, dict):
+        if "__datetime__" in value:
+            return datetime.datetime(*value["__datetime__"])
+        if "__date__" in value:
+            return datetime.date(*value["__date__"])
+        if "__decimal__" in value:
+            return decimal.Decimal(value["__decimal__"])
+        return dict((key, decode(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    return value
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "b")
+    return open(path, mode)
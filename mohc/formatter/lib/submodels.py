@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+""" Sub-model documents taken from a model document.
+
+A sub-model document holds the same ModelComponent, with the same
+responsible parties, citations, properties and sub-models, as the
+model document has for that component. So rather than building each
+sub-model document from its own template, which repeats the queries
+already made for the model, we can build the model document once and
+write each of its components as a document of its own.
+
+A component's document has what the model template puts under that
+component, so the model template needs to go at least as deep as the
+sub-model template would. Components are written as they are in the
+model document, except that, as with a separate build, each one is
+given new ids and creation dates (see standalone).
+"""
+
+import contextlib
+import datetime
+import uuid
+
+import output
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3 see
+# <http://www.gnu.org/licenses/>
+
+
+class SubModelError(Exception):
+    """ Raised for sub-models that aren't in the model document. """
+    pass
+
+
+def find(model_doc, names=None):
+    """ Returns model_doc's components called names, or all of them
+    if names is None, in the order they appear in the document (each
+    component before its sub-components).
+    """
+    found = []
+    stack = list(reversed(model_doc.sub_components))
+    while stack:
+        component = stack.pop()
+        if names is None or component.short_name in names:
+            found.append(component)
+        stack.extend(reversed(component.sub_components))
+    if names is not None:
+        missing = set(names) - set(
+            component.short_name for component in found)
+        if missing:
+            raise SubModelError("No sub-model %s in model %s" % (
+                ", ".join(sorted(missing)), model_doc.short_name))
+    return found
+
+
+@contextlib.contextmanager
+def standalone(component):
+    """ Context manager that gives component, and the documents in it,
+    new ids and creation dates while it's written as a document of its
+    own. References within it follow the new ids. The old ids and
+    dates are put back afterwards, so the model document isn't
+    changed.
+    """
+    metas = []
+    references = []
+    for obj in output.objects(component):
+        if type(obj).__name__ == "DocReference":
+            references.append((obj, obj.id))
+        elif hasattr(obj, "meta") and getattr(obj.meta, "id", None):
+            metas.append((obj.meta, obj.meta.id, obj.meta.create_date))
+    new_ids = {}
+    now = datetime.datetime.now()
+    try:
+        for meta, id, create_date in metas:
+            meta.id = new_ids[id] = unicode(uuid.uuid4())
+            meta.create_date = now
+        for reference, id in references:
+            reference.id = new_ids.get(id, id)
+        yield component
+    finally:
+        for meta, id, create_date in metas:
+            meta.id = id
+            meta.create_date = create_date
+        for reference, id in references:
+            reference.id = id
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+""" Reuse of the parts of documents that are built again and again.
+
+Documents built in the same batch share a lot: experiments for the
+same model have the same grid mosaics and tiles, and the same people
+turn up as responsible parties all over a model document. When cache
+is a SubtreeCache, the builder keeps what it builds for each row of a
+node (see build) and, the next time it gets to the same row of the
+same part of a template, uses a copy rather than running the queries
+and making the elements again.
+
+A row is the same if its dao is a row handle (see dao.dao_handle)
+with the same class and key attributes (comp_id, rp_id, mosaic_id and
+so on), and the template node has the same fragment hash, institute
+and project. Nodes that contain references aren't reused, as the ids
+they refer to belong to the document they were built for, and rows
+whose build looked at the constraint (the id of the document being
+built) are only reused for the same constraint. Copies are
+given new ids and creation dates, as they would be if they were built
+again, and the ids the elements registered in the id store are
+registered again under the new ids.
+"""
+
+import copy
+import datetime
+import threading
+import uuid
+
+from dao.dao_handle import DaoHandle
+from elements.element import Element
+import output
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3 see
+# <http://www.gnu.org/licenses/>
+
+# The SubtreeCache used by formatCIM's builder, or None to build
+# everything. batchCIM.py sets this for the length of a batch.
+cache = None
+
+
+class SubtreeCache(object):
+    """ The elements built for each row of each cacheable node. hits
+    and misses count the rows that were reused and built.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def cacheable(self, node):
+        """ Returns true if node's rows can be reused. """
+        if node.refers_to or node.fragment is None:
+            return False
+        # Elements with their own way of adding to documents are left
+        # to it.
+        method = getattr(type(node.node), "add_to_doc_from_metadata")
+        return method.im_func is Element.add_to_doc_from_metadata.im_func
+
+    def build(self, node, dao, constraint, build_row):
+        """ Returns the element for node's row dao: a copy of the one
+        built last time, or the one returned by build_row(constraint).
+        """
+        element, pending = self.lookup(node, dao, constraint)
+        if element is not None:
+            return element
+        if pending is None:
+            return build_row(constraint)
+        try:
+            element = build_row(pending.constraint)
+        except Exception:
+            self.abandon(pending)
+            raise
+        self.finish(pending, element)
+        return element
+
+    def lookup(self, node, dao, constraint):
+        """ Looks up node's row dao. Returns (element, None), where
+        element is a copy of the one built last time, or (None,
+        pending) if the row has to be built. The row should then be
+        built with pending.constraint and passed to finish, or to
+        abandon if the build fails. Rows that can't be reused give
+        (None, None).
+        """
+        key = self._key(node, dao)
+        if key is None:
+            return None, None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.constraint not in (
+                    None, constraint):
+                entry = None
+            if entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is not None:
+            if entry.constraint is not None and \
+                    isinstance(constraint, _Watched):
+                constraint.use()
+            return entry.reuse(node), None
+        return None, PendingEntry(key, node, constraint)
+
+    def finish(self, pending, element):
+        """ Keeps element, built for pending's row. Rows started
+        inside it must have been finished first.
+        """
+        pending.recorder.uninstall()
+        entry = CacheEntry(
+            element, getattr(pending.node.node, "id_name", None),
+            pending.recorder.records,
+            dict(pending.constraint) if pending.constraint.used else None)
+        with self.lock:
+            self.entries[pending.key] = entry
+        return
+
+    def abandon(self, pending):
+        """ Gives up on a row that couldn't be built. """
+        pending.recorder.uninstall()
+        return
+
+    def _key(self, node, dao):
+        if not isinstance(dao, DaoHandle) or not self.cacheable(node):
+            return None
+        fields = tuple(
+            (attr, getattr(dao, attr)) for attr in type(dao).__slots__
+            if attr != "parent")
+        key = (node.fragment, node.node.institute, node.node.project,
+               type(dao).__name__, fields)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+
+class CacheEntry(object):
+    """ An element built for a row, with the id_name its node had
+    afterwards, the (type, name, id) records it added to the id store
+    and the constraint it was built for, or None if it didn't matter.
+    """
+
+    __slots__ = ("element", "id_name", "ids", "constraint")
+
+    def __init__(self, element, id_name, ids, constraint=None):
+        self.element = element
+        self.id_name = id_name
+        self.ids = ids
+        self.constraint = constraint
+
+    def reuse(self, node):
+        """ Returns a copy of the element with new ids, registering
+        them as node's id store would have.
+        """
+        element = copy.deepcopy(self.element)
+        new_ids = renumber(element)
+        for type, name, id in self.ids:
+            node.node.id_dao.add_id(type, name, new_ids.get(id, id))
+        if self.id_name is not None:
+            node.node.id_name = self.id_name
+        return element
+
+
+class PendingEntry(object):
+    """ A row that's being built: its key, node, the constraint to
+    build it with and the IdRecorder noting the ids it adds.
+    """
+
+    __slots__ = ("key", "node", "constraint", "recorder")
+
+    def __init__(self, key, node, constraint):
+        self.key = key
+        self.node = node
+        self.constraint = _Watched(constraint)
+        self.recorder = IdRecorder(node)
+
+
+class IdRecorder(object):
+    """ Stands in for the id store of each element under node while
+    it's built, recording the ids they add.
+    """
+
+    def __init__(self, node):
+        self.records = []
+        self.id_daos = []
+        stack = [node]
+        while stack:
+            build_node = stack.pop()
+            element = build_node.node
+            self.id_daos.append((element, element.id_dao))
+            element.id_dao = _Recording(element.id_dao, self.records)
+            stack.extend(build_node.contents)
+
+    def uninstall(self):
+        for element, id_dao in self.id_daos:
+            element.id_dao = id_dao
+        return
+
+
+class _Recording(object):
+
+    def __init__(self, id_dao, records):
+        self.id_dao = id_dao
+        self.records = records
+
+    def add_id(self, type, name, id):
+        self.records.append((type, name, id))
+        return self.id_dao.add_id(type, name, id)
+
+    def add_ids(self, records):
+        for type, name, id in records:
+            self.add_id(type, name, id)
+        return
+
+    def __getattr__(self, attr):
+        return getattr(self.id_dao, attr)
+
+
+class _Watched(dict):
+    # A constraint that notes whether anything was read from it. Rows
+    # built inside another row's build pass reads on to the outer one.
+
+    def __init__(self, constraint):
+        super(_Watched, self).__init__(constraint)
+        self.used = False
+        self.outer = constraint if isinstance(constraint, _Watched) \
+            else None
+
+    def use(self):
+        watched = self
+        while watched is not None:
+            watched.used = True
+            watched = watched.outer
+        return
+
+    def __getitem__(self, key):
+        self.use()
+        return super(_Watched, self).__getitem__(key)
+
+    def get(self, key, default=None):
+        self.use()
+        return super(_Watched, self).get(key, default)
+
+
+def renumber(element):
+    """ Gives each document in element a new id and creation date, and
+    each other object with an id (such as a grid mosaic) a new id.
+    Returns a dictionary of old id: new id.
+    """
+    new_ids = {}
+    now = datetime.datetime.now()
+    for obj in output.objects(element):
+        if type(obj).__name__ == "DocReference":
+            continue
+        meta = getattr(obj, "meta", None)
+        if meta is not None and getattr(meta, "id", None):
+            new_ids[meta.id] = unicode(uuid.uuid4())
+            meta.id = new_ids[meta.id]
+            meta.create_date = now
+        elif isinstance(getattr(obj, "id", None), basestring) and \
+                not hasattr(obj, "create_date"):
+            new_ids[obj.id] = type(obj.id)(uuid.uuid4())
+            obj.id = new_ids[obj.id]
+    return new_ids
@@ -78,9 +78,19 @@ provide the name of the element. You also need to provide a "link_to"
 attribute which specifies which pyesdoc attribute should be used to
 store the reference. This is necessary there isn't a one-to-one
 mapping between attribute names and reference types.
+
+DocIdDao only knows about elements built in the current run. To refer
+to elements in documents built by earlier runs (for example, to refer
+to a model from an experiment document without rebuilding the model
+document) use PersistentDocIdDao in the templates for both documents.
+It keeps ids in an SQLite database, by default "doc_ids.sqlite" in the
+output directory. You can give a different location in the template:
+
+"id_dao": {"PersistentDocIdDao": {"db_path": "/path/to/ids.sqlite"}}
 """
 
 
+import hashlib
 import importlib
 import inspect
 import json
@@ -89,6 +99,50 @@ import dao
 import elements
 
 
+class BuildNode(object):
+    """ A node in the tree returned by doc_builder. Holds the element
+    to build ("node"), its child nodes ("contents") and the names of
+    the element types below it and referred to by it and its children
+    ("below" and "refers_to"), which are used to arrange the tree into
+    a buildable order. "fragment" is a hash of the part of the
+    template the node was made from, which is the same for the same
+    part of any template.
+
+    Build nodes used to be dictionaries, so they still support item
+    access with the keys they had then, which don't include
+    "fragment".
+    """
+
+    __slots__ = ("node", "contents", "below", "refers_to", "fragment")
+    _keys = ("node", "contents", "below", "refers_to")
+
+    def __init__(self, node, contents, below, refers_to, fragment=None):
+        self.node = node
+        self.contents = contents
+        self.below = below
+        self.refers_to = refers_to
+        self.fragment = fragment
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._keys:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        return list(self._keys)
+
+
 class TemplateError(Exception):
     """ Exception raised if there is an error with the template
     (either a JSON syntax problem, or a template-specific error).
@@ -112,12 +166,18 @@ def parse_template(template_stream):
     return template
 
 
-def doc_builder(template, dao_env, cfg):
+def doc_builder(template, dao_env, cfg, make_dao=None):
     """ Returns a tree of objects. Attributes can be picked up from
     your configuration file (such as "institute"), from command-line
     options or provided in the template. The resulting tree of objects
     can be be walked to build up the CIM document.
+
+    make_dao, if given, is called instead of dao_for_node to make each
+    node's dao (for example, to record or replay the metadata the
+    daos return).
     """
+    if make_dao is None:
+        make_dao = dao_for_node
     working_template = dict(template)
     global_config = _global_env(working_template, cfg)
     top_node = working_template.keys()
@@ -125,34 +185,75 @@ def doc_builder(template, dao_env, cfg):
         raise TemplateError("Too many top-level nodes in template")
     # Template can contain an id_dao for accessing or saving doc ids.
     # It is optional unless the template contains links.
-    id_dao = _id_dao(working_template)
+    id_dao = _id_dao(working_template, dao_env)
     # Pull in database configuration.
     if "database" in cfg:
         dao_env.update(cfg["database"])
     # Build the tree.
-    tree = _element(working_template, id_dao, global_config, dao_env)
+    tree = _element(
+        working_template, id_dao, global_config, dao_env, make_dao)
     # Rearrange the tree so referred-to elements appear to the left of
     # or above the elements that refer to them, so that they will have
     # been built and contain an id we can use to code the reference.
-    tree["contents"] = _arrange(tree, set([]))
+    tree.contents = _arrange(tree, set([]))
     return tree
 
 
-def _id_dao(template):
+def _id_dao(template, dao_env):
     try:
         id_type = template["id_dao"].keys()[0]
         id_cls = _find_class(dao, id_type)
         id_dao = id_cls()
+        id_attribute = template["id_dao"][id_type]
         del template["id_dao"]
     except KeyError:
-        id_dao = dao.id_dao.Null()
+        return dao.id_dao.Null()
+    # Persistent id stores need to know where to keep their ids. They
+    # default to the output directory, but the template can say
+    # otherwise.
+    if "output_dir" in dao_env and hasattr(id_dao, "output_dir"):
+        id_dao.output_dir = dao_env["output_dir"]
+    for attr in id_attribute:
+        setattr(id_dao, attr, id_attribute[attr])
     return id_dao
 
 
-def _element(template, id_dao, global_config, dao_env):
-    """ Called recursively to walk down the template, creating
-    elements using the supplied attributes.
+def _element(template, id_dao, global_config, dao_env, make_dao):
+    """ Walks down the template, creating elements using the supplied
+    attributes, and returns the build node at the top of the tree.
+
+    Templates can nest deeply, so we walk them with a stack rather
+    than by recursion. Elements are still made parent first and left
+    to right.
     """
+    made = []
+    # Each entry is a part of the template still to be made, the
+    # build node it goes in and its name there.
+    stack = [(template, None, None)]
+    while stack:
+        part, parent, name = stack.pop()
+        node, leaves = _node(part, id_dao, global_config, dao_env, make_dao)
+        if parent is not None:
+            parent.contents.append(node)
+        made.append((node, parent, name))
+        stack.extend(
+            (leaf, node, leaf_name)
+            for leaf, leaf_name in reversed(leaves))
+    # Build up the sets of elements below and referred to by each
+    # node's children, children first, so we can rearrange the tree
+    # into a buildable order later.
+    for node, parent, name in reversed(made):
+        if parent is not None:
+            parent.below.add(name)
+            parent.below.update(node.below)
+            parent.refers_to.update(node.refers_to)
+    return made[0][0]
+
+
+def _node(template, id_dao, global_config, dao_env, make_dao):
+    # Makes the element for the top of template, and returns its build
+    # node (without contents yet) and a list of (template, name) for
+    # each of its children.
     working_template = dict(template)
     element_type, element_attribute = _find_element_type(working_template)
     _check_for_required_attr(element_type, element_attribute, global_config)
@@ -160,7 +261,7 @@ def _element(template, id_dao, global_config, dao_env):
     # We need some source of metadata - either a DAO, or an id DAO
     # (which can be used to link to another element).
     if "dao" in element_attribute:
-        my_dao = _dao(element_attribute["dao"], global_config, dao_env)
+        my_dao = make_dao(element_attribute["dao"], global_config, dao_env)
     else:
         if not id_dao:
             raise TemplateError("We have a link, but no id_dao")
@@ -173,16 +274,13 @@ def _element(template, id_dao, global_config, dao_env):
         raise TemplateError(
             "Problem making element of type %s: %s" % (element_type, exc))
 
-    # Build up a set of elements referred to by me and my children so
-    # we can rearrange the tree into a buildable order later.
     refers_to = set([])
     if "link" in element_attribute:
         refers_to.add(element_attribute["link"]["type"])
 
-    # If this element contains children, we need to create them and
-    # add them to our contents.
+    # If this element contains children, they'll need to be made and
+    # added to our contents.
     leaves = []
-    below = set([])
     if "contents" in element_attribute:
         for leaf in element_attribute["contents"]:
             # leaf can be a dictionary, or it can be a list of dicts.
@@ -192,49 +290,79 @@ def _element(template, id_dao, global_config, dao_env):
             else:
                 leaf_name = leaf
                 leaf_attr = element_attribute["contents"][leaf]
-            below.add(leaf_name)
-            leaf_element = _element(
-                {leaf_name: leaf_attr}, id_dao, global_config, dao_env)
-            below.update(leaf_element["below"])
-            refers_to.update(leaf_element["refers_to"])
-            leaves.append(leaf_element)
-    return {
-        "node": my_element, "contents": leaves,
-        "below": below, "refers_to": refers_to}
+            leaves.append(({leaf_name: leaf_attr}, leaf_name))
+    node = BuildNode(
+        my_element, [], set([]), refers_to, _fragment_hash(template))
+    return node, leaves
+
+
+def _fragment_hash(template):
+    return hashlib.sha1(json.dumps(template, sort_keys=True)).hexdigest()
 
 
 def _arrange(node, to_my_left):
     """ Rearranges a template so that any referred-to elements are to
-    the left of elements that refer to them.
+    the left of elements that refer to them, and returns node's
+    rearranged contents.
 
-    We walk the tree top down, left to right to do the rearranging.
+    We walk the tree top down, left to right to do the rearranging,
+    keeping a stack of the levels we're part way through rather than
+    recursing. to_my_left is the set of elements to the left of, or
+    above, the level being arranged.
     """
+    sorted_contents = _arrange_level(node, to_my_left)
+    # Each entry is a level's sorted contents and the index of the
+    # next leaf to walk down through.
+    stack = [[sorted_contents, 0]]
+    while stack:
+        level = stack[-1]
+        level_contents, idx = level
+        if idx == len(level_contents):
+            stack.pop()
+            continue
+        level[1] += 1
+        # We need to build up the set of elements to our left as we
+        # go along.
+        for to_left in level_contents[0:idx]:
+            # We have seen the node at the top of the branch, and all
+            # the nodes below it.
+            to_my_left.update([_element_from_type(to_left.node)])
+            to_my_left.update(to_left.below)
+        leaf = level_contents[idx]
+        leaf.contents = _arrange_level(leaf, to_my_left)
+        stack.append([leaf.contents, 0])
+    return sorted_contents
+
+
+def _arrange_level(node, to_my_left):
+    # Returns node's contents sorted so that any referred-to elements
+    # are to the left of elements that refer to them.
     sorted_contents = []
     seen_at_my_level = []
-    for leaf in node["contents"]:
+    for leaf in node.contents:
         if leaf in sorted_contents:
             # This leaf has already been referred to, so we've
             # already inserted it.
             continue
-        if len(leaf["refers_to"]) == 0:
+        if len(leaf.refers_to) == 0:
             # We don't refer to anything, so we can go ahead and add
             # ourself now.
             _add_leaf(sorted_contents, seen_at_my_level, leaf)
             continue
         # We refer to at least one element. Check to see if the
         # element(s) we refer to will have been made.
-        for referred_to in leaf["refers_to"]:
+        for referred_to in leaf.refers_to:
             if referred_to in seen_at_my_level or \
-                    referred_to in to_my_left or referred_to in leaf["below"]:
+                    referred_to in to_my_left or referred_to in leaf.below:
                 # referred_to will be made before us, so we can just
                 # add current element to the contents list.
                 _add_leaf(sorted_contents, seen_at_my_level, leaf)
             else:
                 # We need to find referred_to to the right of us
                 # in the tree and add it to our left.
-                my_idx = node["contents"].index(leaf)
+                my_idx = node.contents.index(leaf)
                 found = False
-                for right_branch in node["contents"][my_idx+1:]:
+                for right_branch in node.contents[my_idx+1:]:
                     if _branch_contains_node(right_branch, referred_to):
                         _insert_before_leaf(
                             sorted_contents, seen_at_my_level,
@@ -248,25 +376,14 @@ def _arrange(node, to_my_left):
                     # template error it will be picked up later when
                     # the document is built.
                     _add_leaf(sorted_contents, seen_at_my_level, leaf)
-
-    # Now walk down through the tree. We need to build up the set of
-    # elements to our left as we go along.
-    for idx, leaf in enumerate(sorted_contents):
-        if idx > 0:
-            for to_left in sorted_contents[0:idx]:
-                # We have seen the node at the top of the branch, and
-                # all the nodes below it.
-                to_my_left.update([_element_from_type(to_left["node"])])
-                to_my_left.update(to_left["below"])
-        leaf["contents"] = _arrange(leaf, to_my_left)
     return sorted_contents
 
 
 def _branch_contains_node(branch, node_name):
     # Looks for an element of specified name in branch.
-    if _element_from_type(branch["node"]) == node_name:
+    if _element_from_type(branch.node) == node_name:
         return True
-    if node_name in branch["below"]:
+    if node_name in branch.below:
         return True
     return False
 
@@ -296,7 +413,7 @@ def _add_leaf(sorted_contents, seen, leaf):
 
 
 def _seen_leaf(seen, leaf):
-    seen.append(_element_from_type(leaf["node"]))
+    seen.append(_element_from_type(leaf.node))
     return
 
 
@@ -322,8 +439,10 @@ def _check_for_required_attr(type, attr, global_config):
     return
 
 
-def _dao(dao_attr, global_env, dao_env):
-    # Builds specified dao type and returns it.
+def dao_for_node(dao_attr, global_env, dao_env):
+    """ Builds the dao type named in a node's "dao" attribute and
+    returns it.
+    """
     dao_type, dao_attribute = _find_dao_type(global_env, dao_attr)
     my_dao = dao_type(dao_attribute)
     for attr in dao_env:
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+""" Timings for the phases of a formatter run. """
+
+import contextlib
+import json
+import os
+import time
+
+# Copyright: (C) Crown copyright 2015, the Met Office
+# License: GNU General Public License version 3 see
+# <http://www.gnu.org/licenses/>
+
+
+class PhaseTimer(object):
+    """ Records the wall and CPU time taken by each phase of a run,
+    such as parsing the template or building the document, in the
+    order the phases finish. Each of listeners is called with the
+    phase's name when a phase finishes.
+    """
+
+    def __init__(self):
+        self.phases = []
+        self.listeners = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """ Context manager that times the code inside it as phase
+        name. The phase is recorded even if the code raises an
+        exception (or exits).
+        """
+        wall = time.time()
+        cpu = _cpu_time()
+        try:
+            yield
+        finally:
+            self.phases.append({
+                "name": name, "wall": time.time() - wall,
+                "cpu": _cpu_time() - cpu})
+            for listener in self.listeners:
+                listener(name)
+
+    def total(self):
+        return {
+            "wall": sum(phase["wall"] for phase in self.phases),
+            "cpu": sum(phase["cpu"] for phase in self.phases)}
+
+    def as_dict(self):
+        return {"phases": self.phases, "total": self.total()}
+
+    def save(self, path):
+        with open(path, "w") as timings_file:
+            json.dump(self.as_dict(), timings_file, indent=2, sort_keys=True)
+            timings_file.write("\n")
+        return
+
+    def summary(self):
+        """ Returns a table of the phase timings, one line per phase
+        and a line for the total.
+        """
+        total = self.total()
+        lines = ["%-16s %9s %9s %6s" % ("phase", "wall (s)", "cpu (s)", "%")]
+        for phase in self.phases + [dict(total, name="total")]:
+            share = 0.0
+            if total["wall"] > 0:
+                share = 100.0 * phase["wall"] / total["wall"]
+            lines.append("%-16s %9.3f %9.3f %6.1f" % (
+                phase["name"], phase["wall"], phase["cpu"], share))
+        return "\n".join(lines)
+
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1]
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+import batchCIM
+from batchCIM import Batch, Job, JobError
+from dao import crem_csv
+import subtree_cache
+
+FORMATTER_DIR = os.path.join(os.path.dirname(__file__), "..", "..")
+
+
+class TestJobs(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _jobs_file(self, text):
+        path = os.path.join(self.dir, "jobs")
+        with open(path, "w") as jobs_file:
+            jobs_file.write(text)
+        return path
+
+    def test_read_jobs(self):
+        path = self._jobs_file(
+            '# comment\n\n'
+            '{"doc": "model", "model": "HadGEM2-ES", "format": "json"}\n')
+        jobs = batchCIM.read_jobs(
+            path, {"format": "xml", "output": "out", "project": "CMIP5"})
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0].spec, {
+            "doc": "model", "model": "HadGEM2-ES", "format": "json",
+            "output": "out", "project": "CMIP5"})
+        self.assertEqual(jobs[0].name(), "model HadGEM2-ES")
+
+    def test_bad_line(self):
+        path = self._jobs_file('{"doc": "model"}\n[1]\n')
+        self.assertRaises(JobError, batchCIM.read_jobs, path, {})
+
+    def test_check_job(self):
+        spec = {
+            "doc": "experiment", "format": "xml", "output": "out",
+            "project": "CMIP5", "template": "experiment.fmt",
+            "model": "HadGEM2-ES"}
+        self.assertRaises(JobError, batchCIM.check_job, spec)
+        spec["experiment"] = "rcp85"
+        batchCIM.check_job(spec)
+
+    def test_longest_first(self):
+        path = os.path.join(self.dir, "jobs.times")
+        times = batchCIM.JobTimes(path)
+        jobs = [
+            Job({"doc": "submodel", "project": "CMIP5", "model": "HadGEM2-ES",
+                 "submodel": name})
+            for name in ["Aerosols", "Atmosphere", "Land"]]
+        jobs.append(Job({
+            "doc": "model", "project": "CMIP5", "model": "HadGEM2-ES"}))
+        jobs.append(Job({
+            "doc": "experiment", "project": "CMIP5", "model": "HadGEM2-ES",
+            "experiment": "rcp85"}))
+        batch = Batch({}, times=times)
+        self.assertEqual(batch.schedule(jobs), jobs)
+        times.record(jobs[0], 1.0)
+        times.record(jobs[1], 3.0)
+        times.record(jobs[3], 10.0)
+        times.save()
+        times = batchCIM.JobTimes(path)
+        self.assertEqual(times.estimate(jobs[2]), 2.0)
+        self.assertEqual(times.estimate(jobs[4]), 10.0)
+        self.assertEqual(
+            Batch({}, times=times).schedule(jobs),
+            [jobs[3], jobs[4], jobs[1], jobs[2], jobs[0]])
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        cfg = {
+            "global": {"institute": "mohc", "daopkg": "dao.crem_csv"},
+            "database": {"db_dir": os.path.join(FORMATTER_DIR, "csv")}}
+        self.batch = Batch(cfg, (2, 1, 1), 2)
+        self.patcher = mock.patch.object(
+            batchCIM.formatCIM.pyesdoc, "write", side_effect=self._write)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        crem_csv.table_cache = None
+        subtree_cache.cache = None
+        shutil.rmtree(self.dir)
+
+    def _write(self, doc, output_path, encoding):
+        path = os.path.join(output_path, "%s.%s" % (doc.short_name, encoding))
+        open(path, "w").close()
+        return path
+
+    def _job(self, **spec):
+        spec.update({
+            "template": os.path.join(
+                FORMATTER_DIR, "templates", "submodel.fmt"),
+            "format": "json", "output": self.dir, "project": "CMIP5"})
+        return Job(spec)
+
+    def test_run(self):
+        jobs = [
+            self._job(doc="submodel", model="HadGEM2-ES", submodel=name)
+            for name in ["Aerosols", "Atmosphere"]]
+        jobs.append(self._job(doc="submodel", model="HadGEM2-ES"))
+        with mock.patch.object(
+                batchCIM.pyesdoc, "validate", return_value=[]):
+            results = self.batch.run(jobs)
+        encoding = batchCIM._cli().encoding("json")
+        self.assertEqual(
+            [result.item.paths for result in results[:2]],
+            [[os.path.join(self.dir, "%s.%s" % (name, encoding))]
+             for name in ["Aerosols", "Atmosphere"]])
+        self.assertIsNone(results[0].item.doc)
+        self.assertIn("Require submodel", results[2].error)
+        self.assertEqual(
+            [stage.items for stage in self.batch.stages], [3, 2, 2])
+
+    def test_skip_unchanged(self):
+        cfg = self.batch.cfg
+        with mock.patch.object(
+                batchCIM.output.pyesdoc, "write", side_effect=self._write):
+            first = Batch(cfg, skip_unchanged=True).run(
+                [self._job(doc="submodel", model="HadGEM2-ES",
+                           submodel="Aerosols")])
+            second = Batch(cfg, skip_unchanged=True).run(
+                [self._job(doc="submodel", model="HadGEM2-ES",
+                           submodel=name)
+                 for name in ["Aerosols", "Atmosphere"]])
+        self.assertFalse(first[0].item.unchanged())
+        self.assertTrue(second[0].item.unchanged())
+        self.assertEqual(second[0].item.paths, first[0].item.paths)
+        self.assertFalse(second[1].item.unchanged())
+        self.assertTrue(os.path.exists(
+            os.path.join(self.dir, batchCIM.output.MANIFEST_FILE)))
+
+    def test_resume(self):
+        journal_path = os.path.join(self.dir, "jobs.journal")
+        jobs = [
+            self._job(doc="submodel", model="HadGEM2-ES", submodel=name)
+            for name in ["Aerosols", "Atmosphere"]]
+        jobs.append(self._job(doc="submodel", model="HadGEM2-ES"))
+        cfg = self.batch.cfg
+        with mock.patch.object(
+                batchCIM.pyesdoc, "validate", return_value=[]):
+            Batch(cfg, journal=batchCIM.Journal(journal_path)).run(jobs)
+            with open(jobs[1].paths[0], "a") as doc_file:
+                doc_file.write(" ")
+            with open(journal_path, "a") as journal_file:
+                journal_file.write('{"hash": ')
+            jobs = [Job(job.spec) for job in jobs]
+            journal = batchCIM.Journal(journal_path, resume=True)
+            batch = Batch(cfg, journal=journal)
+            results = batch.run(jobs)
+        self.assertEqual(
+            [result.item.skipped for result in results],
+            [True, False, False])
+        self.assertEqual(results[0].item.paths, [
+            os.path.join(self.dir, "Aerosols.%s" % batchCIM._cli().encoding(
+                "json"))])
+        self.assertIn("Require submodel", results[2].error)
+        self.assertEqual([stage.items for stage in batch.stages], [2, 1, 1])
+        journal = batchCIM.Journal(journal_path, resume=True)
+        self.assertEqual(len(journal.entries), 2)
+        self.assertEqual(len(batchCIM.Journal(journal_path).entries), 0)
+
+    def test_times_recorded(self):
+        times = batchCIM.JobTimes(os.path.join(self.dir, "jobs.times"))
+        jobs = [
+            self._job(doc="submodel", model="HadGEM2-ES", submodel=name)
+            for name in ["Aerosols", "Atmosphere"]]
+        jobs.append(self._job(doc="submodel", model="HadGEM2-ES"))
+        with mock.patch.object(
+                batchCIM.pyesdoc, "validate", return_value=[]):
+            results = Batch(self.batch.cfg, times=times).run(jobs)
+        self.assertEqual(
+            [result.item for result in results], jobs)
+        self.assertEqual(
+            sorted(times.times), sorted(job.key() for job in jobs[:2]))
+        self.assertGreater(times.estimate(jobs[0]), 0)
+
+    def test_job_hash(self):
+        spec = self._job(doc="model", model="HadGEM2-ES").spec
+        self.assertEqual(
+            batchCIM.job_hash(spec), batchCIM.job_hash(dict(spec)))
+        self.assertNotEqual(
+            batchCIM.job_hash(spec),
+            batchCIM.job_hash(dict(spec, template=os.path.join(
+                FORMATTER_DIR, "templates", "model.fmt"))))
+
+    def test_template_parsed_once(self):
+        path = self._job().spec["template"]
+        self.assertIs(self.batch.template(path), self.batch.template(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
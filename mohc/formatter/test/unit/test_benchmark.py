@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import os.path
+import unittest
+
+import benchmarkCIM
+import dao.crem_csv
+from dao import query_hook
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.db_dir = os.path.join(benchmarkCIM.PACKAGE_DIR, "csv")
+        self.cases = [case for case in benchmarkCIM.CASES
+                      if case[0] == "submodel"]
+
+    def test_reports_each_phase(self):
+        result = benchmarkCIM.run_benchmark(
+            self.db_dir, "json", cases=self.cases)
+        phases = result["cases"]["submodel"]["phases"]
+        self.assertEqual(sorted(phases), sorted(benchmarkCIM.PHASES))
+        self.assertGreater(phases["build"]["queries"], 0)
+        self.assertGreater(phases["build"]["rows_scanned"], 0)
+        self.assertGreater(phases["build"]["objects"], 0)
+        self.assertEqual(phases["write"]["queries"], 0)
+        self.assertGreater(phases["write"]["peak_rss_kb"], 0)
+
+    def test_counter_uninstalled(self):
+        benchmarkCIM.run_benchmark(self.db_dir, "json", cases=self.cases)
+        self.assertEqual(query_hook.hooks, [])
+
+    def test_counts_rows_scanned(self):
+        counter = benchmarkCIM.QueryCounter()
+        counter.install()
+        try:
+            csv_dao = dao.crem_csv.CsvDao({})
+            csv_dao.db_dir = self.db_dir
+            csv_dao.multi_row_query(
+                ["shortname"], "tblmodel.csv", {"shortname": "HadGEM2-ES"})
+        finally:
+            counter.uninstall()
+        with open(os.path.join(self.db_dir, "tblmodel.csv")) as table:
+            rows = len(list(csv.reader(table)))
+        self.assertEqual(counter.queries, 1)
+        self.assertEqual(counter.rows, rows - 1)
+
+
+class TestRegressions(unittest.TestCase):
+
+    def _result(self, wall):
+        phases = {}
+        for phase in benchmarkCIM.PHASES:
+            phases[phase] = {"wall": 0.1, "cpu": 0.1}
+        phases["build"]["wall"] = wall
+        return {"cases": {"model": {"phases": phases}}}
+
+    def test_no_regression(self):
+        self.assertEqual(benchmarkCIM.regressions(
+            self._result(1.05), self._result(1.0), 10), [])
+
+    def test_slowdown(self):
+        slow = benchmarkCIM.regressions(
+            self._result(1.2), self._result(1.0), 10)
+        self.assertEqual(len(slow), 1)
+        self.assertTrue(slow[0].startswith("model build wall"))
+
+    def test_short_phases_ignored(self):
+        self.assertEqual(benchmarkCIM.regressions(
+            self._result(0.04), self._result(0.01), 10), [])
+
+    def test_new_case_ignored(self):
+        baseline = {"cases": {}}
+        self.assertEqual(benchmarkCIM.regressions(
+            self._result(1.0), baseline, 10), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
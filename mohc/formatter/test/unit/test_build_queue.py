@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import unittest
+
+import build_queue
+from template import BuildNode
+
+
+class FakeElement(object):
+    """ Records what the build does to it in log. Each row of a
+    container fans out to rows copies of itself.
+    """
+
+    def __init__(self, name, log, rows=1):
+        self.name = name
+        self.log = log
+        self.rows = rows
+        self.dao = "template"
+
+    def container_metadata(self, parent):
+        self.log.append(("metadata", self.name, parent.name, parent.dao))
+
+    def daos_for_node(self, constraint):
+        return ["%s/%d" % (self.name, row) for row in range(self.rows)]
+
+    def add_to_doc_from_metadata(self, constraint, doc):
+        for dao in self.daos_for_node(constraint):
+            self.log.append(("leaf", dao))
+            doc.append(dao)
+
+    def make_doc_from_metadata(self, constraint, leaves):
+        self.log.append(("row", self.dao))
+        return [self.dao]
+
+    def add_to_doc(self, doc, element):
+        self.log.append(("add", element[0]))
+        doc.append(element)
+
+
+def _tree(log, depth, rows=2):
+    node = BuildNode(FakeElement("leaf", log, rows), [], set(), set())
+    for level in range(depth):
+        node = BuildNode(
+            FakeElement("level%d" % level, log, rows),
+            [node, BuildNode(
+                FakeElement("side%d" % level, log), [], set(), set())],
+            set(), set())
+    return node
+
+
+def _recursive_build(constraint, doc, node):
+    # The recursive build the queue replaced.
+    if not node.contents:
+        return node.node.add_to_doc_from_metadata(constraint, doc)
+    template_dao = node.node.dao
+    for dao in node.node.daos_for_node(constraint):
+        node.node.dao = dao
+        node_doc = node.node.make_doc_from_metadata(constraint, [])
+        for leaf in node.contents:
+            leaf.node.container_metadata(node.node)
+            _recursive_build(constraint, node_doc, leaf)
+        node.node.add_to_doc(doc, node_doc)
+    node.node.dao = template_dao
+
+
+class TestBuildQueue(unittest.TestCase):
+
+    def test_same_order(self):
+        expected_log, log = [], []
+        expected_doc, doc = [], []
+        _recursive_build({}, expected_doc, _tree(expected_log, 4))
+        build_queue.BuildQueue({}).build(_tree(log, 4), doc)
+        self.assertEqual(log, expected_log)
+        self.assertEqual(doc, expected_doc)
+
+    def test_deep_tree(self):
+        log = []
+        depth = sys.getrecursionlimit() * 2
+        tree = _tree(log, depth, rows=1)
+        doc = []
+        queue = build_queue.BuildQueue({})
+        queue.build(tree, doc)
+        self.assertEqual(len(doc), 1)
+        self.assertEqual(doc[0][0], "level%d/0" % (depth - 1))
+        self.assertEqual(tree.node.dao, "template")
+        self.assertEqual(queue.tasks, [])
+
+    def test_failed_task(self):
+        log = []
+        tree = _tree(log, 2)
+        tree.contents[0].node.make_doc_from_metadata = None
+        queue = build_queue.BuildQueue({})
+        self.assertRaises(TypeError, queue.build, tree, [])
+        self.assertEqual(queue.tasks, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
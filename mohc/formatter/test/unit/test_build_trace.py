@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import build_trace
+import dao.crem_csv
+import elements.element
+import formatCIM
+
+
+class Traced(object):
+
+    def outer(self, value):
+        return self.inner(value)
+
+    def inner(self, value):
+        return [value] * value
+
+
+def _label(obj, value):
+    return "call", "call", {"rows": None}
+
+
+class TestTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.tracer = build_trace.Tracer()
+
+    def tearDown(self):
+        self.tracer.uninstall()
+
+    def test_nested_spans(self):
+        self.tracer.trace(Traced, "outer", _label)
+        self.tracer.trace(Traced, "inner", _label)
+        self.assertEqual(Traced().outer(3), [3, 3, 3])
+        inner, outer = self.tracer.events
+        self.assertEqual(inner["ph"], "X")
+        self.assertEqual(inner["args"]["rows"], 3)
+        self.assertLessEqual(outer["ts"], inner["ts"])
+        self.assertGreaterEqual(
+            outer["ts"] + outer["dur"], inner["ts"] + inner["dur"])
+
+    def test_uninstall(self):
+        outer = Traced.__dict__["outer"]
+        self.tracer.trace(Traced, "outer", _label)
+        self.assertIsNot(Traced.__dict__["outer"], outer)
+        self.tracer.uninstall()
+        self.assertIs(Traced.__dict__["outer"], outer)
+        Traced().outer(1)
+        self.assertEqual(self.tracer.events, [])
+
+
+class TestBuildTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.option = {"--trace": os.path.join(self.output_dir, "trace")}
+        package_dir = os.path.join(os.path.dirname(__file__), "..", "..")
+        self.cfg = {
+            "global": {
+                "institute": "mohc", "project": "CMIP5",
+                "daopkg": "dao.crem_csv"},
+            "database": {"db_dir": os.path.join(package_dir, "csv")}}
+        self.template = os.path.join(
+            package_dir, "templates", "submodel.fmt")
+        self.dao_env = {
+            "model": "HadGEM2-ES", "submodel": "Aerosols",
+            "project": "CMIP5"}
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _build(self):
+        doc_builder = formatCIM.parse_template(
+            self.template, self.dao_env, self.cfg)
+        tracer = formatCIM._start_trace(self.option, self.cfg)
+        try:
+            formatCIM.build_doc(doc_builder)
+        finally:
+            formatCIM._save_trace(self.option, tracer)
+        with open(self.option["--trace"]) as trace_file:
+            return json.load(trace_file)["traceEvents"]
+
+    def test_spans(self):
+        events = self._build()
+        categories = set(event["cat"] for event in events)
+        self.assertEqual(categories, set(
+            ["build", "container", "dao", "element", "row", "query"]))
+        build = [event for event in events if event["cat"] == "build"][0]
+        self.assertEqual(build["args"]["element"], "SubModel")
+        self.assertEqual(build["args"]["dao"], "SubModelDao")
+        self.assertGreater(build["args"]["query_time_ms"], 0)
+        keys = [event["args"]["key"] for event in events
+                if event["name"] == "Citation row"]
+        self.assertIn({"cite_id": "5"}, keys)
+        expansions = [event for event in events
+                      if event["name"] == "SubModel daos_for_node"]
+        self.assertTrue(all(
+            isinstance(event["args"]["rows"], int) for event in expansions))
+
+    def test_nested_containers(self):
+        events = self._build()
+        containers = [event for event in events
+                      if event["cat"] == "container"]
+        self.assertEqual(len(containers), 16)
+
+        def inside(inner, outer):
+            return inner is not outer and \
+                outer["ts"] <= inner["ts"] and \
+                inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+        nested = [inner for inner in containers
+                  if any(inside(inner, outer) for outer in containers)]
+        self.assertGreater(len(nested), 0)
+        self.assertIn("Citation", [event["name"] for event in nested])
+
+    def test_untraced_after_save(self):
+        build_doc = formatCIM.build_doc
+        query = dao.crem_csv.CsvDao.__dict__["multi_row_query"]
+        add_to_doc = elements.element.Element.__dict__[
+            "add_to_doc_from_metadata"]
+        self._build()
+        self.assertIs(formatCIM.build_doc, build_doc)
+        self.assertIs(dao.crem_csv.CsvDao.__dict__["multi_row_query"], query)
+        self.assertIs(elements.element.Element.__dict__[
+            "add_to_doc_from_metadata"], add_to_doc)
+
+    def test_no_trace_option(self):
+        self.assertIsNone(formatCIM._start_trace({}, self.cfg))
+
+
+if __name__ == "__main__":
+    unittest.main()
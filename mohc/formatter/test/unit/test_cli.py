@@ -32,11 +32,26 @@ class TestCli(unittest.TestCase):
         sys.argv = ["formatCIM", "-c", "foo"]
         self.assertRaises(SystemExit, self.cli.check_usage, sys.argv)
 
+    def test_check_usage_with_long_options(self):
+        cli = PyesdocCli(
+            "d:", ["-d"], "-d doc1|doc2 [--profile file] [--timings]",
+            ["profile=", "timings"])
+        sys.argv = [
+            "formatCIM", "-d", "doc1", "--profile", "out.prof", "--timings"]
+        option = cli.check_usage(sys.argv)
+        self.assertEqual(option["--profile"], "out.prof")
+        self.assertIn("--timings", option)
+
     def test_is_format_valid(self):
         for valid in ["html", "json", "xml"]:
             self.assertTrue(self.cli.is_format_valid(valid))
         self.assertFalse(self.cli.is_format_valid("pdf"))
 
+    def test_formats(self):
+        self.assertEqual(self.cli.formats("xml"), ["xml"])
+        self.assertEqual(
+            self.cli.formats("xml,json,xml,html"), ["xml", "json", "html"])
+
     def test_encoding(self):
         self.assertEqual(
             self.cli.encoding("xml"), pyesdoc.ENCODING_XML)
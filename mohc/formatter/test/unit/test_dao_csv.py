@@ -2,10 +2,16 @@
 
 from datetime import datetime
 import os.path
+import shutil
+import tempfile
+import time
 import unittest
 
+import mock
+
 import dao.crem_csv
-from dao.dao_exception import DaoMetadataException
+import dao.table_store
+from dao.dao_exception import DaoConnectionException, DaoMetadataException
 
 
 class TestDao(unittest.TestCase):
@@ -309,5 +315,245 @@ class TestDao(unittest.TestCase):
             self.fail("Didn't find conf id %s in results" % conf_id)
         return
 
+
+class TestTableCache(unittest.TestCase):
+
+    def setUp(self):
+        self.csv_dir = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.csv_dir, "tbltest.csv")
+        self._write("id,name\n1,one\n")
+        self.cache = dao.crem_csv.TableCache()
+        dao.crem_csv.table_cache = self.cache
+        self.dao = dao.crem_csv.CsvDao({})
+        self.dao.db_dir = self.csv_dir
+
+    def tearDown(self):
+        dao.crem_csv.table_cache = None
+        shutil.rmtree(self.csv_dir)
+
+    def _write(self, text):
+        with open(self.csv_path, "w") as csv_file:
+            csv_file.write(text)
+
+    def test_query_from_cache(self):
+        record = self.dao.single_row_query(
+            ["name"], "tbltest.csv", {"id": "1"})
+        self.assertEqual(record, {"name": "one"})
+        self.assertIn(self.csv_path, self.cache.tables)
+        rows = self.cache.rows(self.csv_path)
+        self.assertIs(self.cache.rows(self.csv_path), rows)
+
+    def test_changed_file_read_again(self):
+        self.dao.single_row_query(["name"], "tbltest.csv", {"id": "1"})
+        self._write("id,name\n1,one\n2,two\n")
+        records = self.dao.multi_row_query(["name"], "tbltest.csv", {})
+        self.assertEqual(records, [{"name": "one"}, {"name": "two"}])
+
+    def test_missing_table(self):
+        self.assertRaises(
+            DaoConnectionException, self.dao.single_row_query,
+            ["name"], "tblmissing.csv", {})
+
+
+class TestSharedTables(unittest.TestCase):
+
+    def setUp(self):
+        self.csv_dir = tempfile.mkdtemp()
+        self.shared_dir = os.path.join(self.csv_dir, "shared")
+        self.csv_path = os.path.join(self.csv_dir, "tbltest.csv")
+        self._write("id,name,code\n1,one,007\n-2,two,\n")
+        self.dao = dao.crem_csv.CsvDao({})
+        self.dao.db_dir = self.csv_dir
+        self.dao.shared_tables = self.shared_dir
+
+    def tearDown(self):
+        dao.table_store._stores.clear()
+        shutil.rmtree(self.csv_dir)
+
+    def _write(self, text):
+        with open(self.csv_path, "w") as csv_file:
+            csv_file.write(text)
+
+    def test_query(self):
+        record = self.dao.single_row_query(
+            ["name", "code"], "tbltest.csv", {"id": "1"})
+        self.assertEqual(record, {"name": "one", "code": "007"})
+        records = self.dao.multi_row_query(["id"], "tbltest.csv", {})
+        self.assertEqual(records, [{"id": "1"}, {"id": "-2"}])
+
+    def test_columns(self):
+        table = dao.table_store.store(self.shared_dir).rows(self.csv_path)
+        kinds = [kind for kind, offset, blob in table.columns]
+        self.assertEqual(kinds, [dao.table_store.INTEGERS,
+                                 dao.table_store.STRINGS,
+                                 dao.table_store.STRINGS])
+        self.assertEqual(len(table), 3)
+        self.assertEqual(list(table), [
+            ["id", "name", "code"], ["1", "one", "007"], ["-2", "two", ""]])
+
+    def test_same_as_csv(self):
+        csv_dir = os.path.join(os.path.dirname(__file__), "..", "..", "csv")
+        store = dao.table_store.SharedTableStore(self.shared_dir)
+        for name in sorted(os.listdir(csv_dir)):
+            if not name.endswith(".csv"):
+                continue
+            csv_path = os.path.join(csv_dir, name)
+            rows = dao.crem_csv.TableCache().rows(csv_path)
+            header = rows[0]
+            expected = [header] + [
+                [row[i] if i < len(row) else "" for i in range(len(header))]
+                for row in rows[1:]]
+            self.assertEqual(list(store.rows(csv_path)), expected, name)
+
+    def test_segment_shared(self):
+        first = dao.table_store.SharedTableStore(self.shared_dir)
+        first.rows(self.csv_path)
+        segments = os.listdir(self.shared_dir)
+        self.assertEqual(len(segments), 1)
+        segment_path = os.path.join(self.shared_dir, segments[0])
+        mtime = os.stat(segment_path).st_mtime
+        second = dao.table_store.SharedTableStore(self.shared_dir)
+        self.assertEqual(list(second.rows(self.csv_path)),
+                         list(first.rows(self.csv_path)))
+        self.assertEqual(os.listdir(self.shared_dir), segments)
+        self.assertEqual(os.stat(segment_path).st_mtime, mtime)
+
+    def test_changed_file_read_again(self):
+        self.dao.single_row_query(["name"], "tbltest.csv", {"id": "1"})
+        self._write("id,name\n1,one\n2,two\n3,three\n")
+        records = self.dao.multi_row_query(["name"], "tbltest.csv", {})
+        self.assertEqual(
+            records, [{"name": "one"}, {"name": "two"}, {"name": "three"}])
+        # The old segment is removed and no longer mapped.
+        self.assertEqual(len(os.listdir(self.shared_dir)), 1)
+        store = dao.table_store.store(self.shared_dir)
+        self.assertEqual(len(store.tables), 1)
+
+    def test_keep_old(self):
+        store = dao.table_store.SharedTableStore(
+            self.shared_dir, keep_old=True)
+        store.rows(self.csv_path)
+        self._write("id,name\n1,one\n2,two\n3,three\n")
+        store.rows(self.csv_path)
+        self.assertEqual(len(os.listdir(self.shared_dir)), 2)
+        other = os.path.join(self.csv_dir, "tbltest.csv.old")
+        shutil.copy(self.csv_path, other)
+        store.rows(other)
+        removed = store.remove_old(self.csv_path)
+        self.assertEqual(len(removed), 1)
+        self.assertEqual(len(os.listdir(self.shared_dir)), 2)
+        self.assertEqual(len(list(store.rows(self.csv_path))), 4)
+
+    def test_missing_table(self):
+        self.assertRaises(
+            DaoConnectionException, self.dao.single_row_query,
+            ["name"], "tblmissing.csv", {})
+
+    def _damage(self, text):
+        store = dao.table_store.store(self.shared_dir)
+        store.rows(self.csv_path)
+        segment = os.listdir(self.shared_dir)[0]
+        with open(os.path.join(self.shared_dir, segment), "w") as bad:
+            bad.write(text)
+        store.clear()
+        return os.path.join(self.shared_dir, segment)
+
+    def test_not_a_segment(self):
+        self._damage("x" * 64)
+        record = self.dao.single_row_query(
+            ["name"], "tbltest.csv", {"id": "1"})
+        self.assertEqual(record, {"name": "one"})
+
+    def test_empty_segment(self):
+        self._damage("")
+        record = self.dao.single_row_query(
+            ["name"], "tbltest.csv", {"id": "1"})
+        self.assertEqual(record, {"name": "one"})
+
+    def test_truncated_segment(self):
+        path = self._damage("")
+        dao.table_store.write_segment(self.csv_path, path)
+        with open(path) as segment:
+            text = segment.read()
+        for size in [4, len(text) - 4]:
+            self._damage(text[:size])
+            record = self.dao.single_row_query(
+                ["name"], "tbltest.csv", {"id": "-2"})
+            self.assertEqual(record, {"name": "two"})
+
+    def test_damaged_segment_not_rewritten(self):
+        self._damage("")
+        with mock.patch("dao.table_store.write_segment"):
+            self.assertRaises(
+                DaoConnectionException, self.dao.single_row_query,
+                ["name"], "tbltest.csv", {})
+
+    def test_query_matches(self):
+        self._write(
+            "id,name,code,id\n1,one,7,10\n2,,07,20\n3,one,,30\n"
+            "4,oneone,7,40\n")
+        table = dao.table_store.store(self.shared_dir).rows(self.csv_path)
+        cases = [
+            ({}, None), ({"name": "one"}, None), ({"name": ""}, None),
+            ({"name": "on"}, None), ({"name": "one"}, 1),
+            ({"code": "7", "name": "one"}, None), ({"id": "20"}, None),
+            ({"id": "2"}, None), ({"id": "020"}, None), ({"id": 20}, None),
+            ({"id": u"30"}, None), ({"name": u"one"}, None),
+            ({"code": "07"}, None), ({"code": 7}, None)]
+        cache = dao.crem_csv.TableCache()
+        for constraint, limit in cases:
+            rows = cache.rows(self.csv_path)
+            expected = []
+            for row in rows[1:]:
+                record = dict(zip(rows[0], row))
+                if all(record[key] == constraint[key] for key in constraint):
+                    expected.append(
+                        {"name": record["name"], "id": record["id"]})
+            if limit is not None:
+                expected = expected[:limit]
+            records, scanned = table.query(["name", "id"], constraint, limit)
+            self.assertEqual(records, expected, constraint)
+
+    def test_same_queries_as_csv(self):
+        csv_dir = os.path.join(os.path.dirname(__file__), "..", "..", "csv")
+        csv_dao = dao.crem_csv.CsvDao({})
+        csv_dao.db_dir = csv_dir
+        self.dao.db_dir = csv_dir
+        for name in sorted(os.listdir(csv_dir)):
+            if not name.endswith(".csv"):
+                continue
+            rows = dao.crem_csv.TableCache().rows(os.path.join(csv_dir, name))
+            header = rows[0]
+            for row in rows[1:6]:
+                for column, value in zip(header, row)[:3]:
+                    args = (header[-1:], name, {column: value})
+                    self.assertEqual(self.dao.multi_row_query(*args),
+                                     csv_dao.multi_row_query(*args))
+                    self.assertEqual(self.dao.single_row_query(*args),
+                                     csv_dao.single_row_query(*args))
+
+    def test_query_time(self):
+        # Queries in segments should be no slower than in a TableCache.
+        csv_dir = os.path.join(os.path.dirname(__file__), "..", "..", "csv")
+        self.dao.db_dir = csv_dir
+        cached_dao = dao.crem_csv.CsvDao({})
+        cached_dao.db_dir = csv_dir
+        dao.crem_csv.table_cache = dao.crem_csv.TableCache()
+        try:
+            times = []
+            for query_dao in [cached_dao, self.dao]:
+                query_dao.multi_row_query(
+                    ["name"], "tblattribute.csv", {"componentid": "56"})
+                start = time.time()
+                for repeat in range(200):
+                    query_dao.multi_row_query(
+                        ["name", "value"], "tblattribute.csv",
+                        {"componentid": "56"})
+                times.append(time.time() - start)
+        finally:
+            dao.crem_csv.table_cache = None
+        cached_time, shared_time = times
+        self.assertLess(shared_time, cached_time)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import dao.crem_csv
+from dao.dao_handle import DaoHandle, row_handle
+
+
+class TestDaoHandle(unittest.TestCase):
+
+    def setUp(self):
+        self.parent = dao.crem_csv.GridTileDao({"type": "foo"})
+        self.parent.db_dir = "csv"
+        self.parent.mosaic_id = "3"
+
+    def test_handle_holds_key(self):
+        handle = row_handle(self.parent, grid_id="12")
+        self.assertEqual(handle.grid_id, "12")
+        self.assertEqual(self.parent.grid_id, "")
+        self.assertIsInstance(handle, DaoHandle)
+        self.assertIsInstance(handle, dao.crem_csv.GridTileDao)
+
+    def test_handle_reads_parent(self):
+        handle = row_handle(self.parent, grid_id="12")
+        self.assertIs(handle.connect_env, self.parent.connect_env)
+        self.assertEqual(handle.mosaic_id, "3")
+        self.parent.db_dir = "elsewhere"
+        self.assertEqual(handle.db_dir, "elsewhere")
+
+    def test_handle_is_compact(self):
+        handle = row_handle(self.parent, grid_id="12")
+        self.assertFalse(hasattr(handle, "__dict__") and handle.__dict__)
+        self.assertFalse(hasattr(handle, "no_such_attribute"))
+
+    def test_handle_state_not_shared(self):
+        first = row_handle(self.parent, grid_id="12")
+        second = row_handle(self.parent, grid_id="13")
+        first.table = "tblgrid.csv"
+        self.assertEqual(first.table, "tblgrid.csv")
+        self.assertFalse(hasattr(second, "table"))
+        self.assertFalse(hasattr(self.parent, "table"))
+
+    def test_handle_class_reused(self):
+        first = row_handle(self.parent, grid_id="12")
+        second = row_handle(self.parent, grid_id="13")
+        nested = row_handle(first, grid_id="14")
+        self.assertIs(type(first), type(second))
+        self.assertIs(type(first), type(nested))
+        self.assertEqual(nested.mosaic_id, "3")
+
+
+if __name__ == "__main__":
+    unittest.main()
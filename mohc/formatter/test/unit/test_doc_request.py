@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import copy
+import os.path
+import unittest
+
+import doc_request
+from doc_request import RequestError
+import template
+
+FORMATTER_DIR = os.path.join(os.path.dirname(__file__), "..", "..")
+
+
+class TestDocRequest(unittest.TestCase):
+
+    def setUp(self):
+        self.request = {
+            "doc": "submodel", "format": "xml", "output": "out",
+            "project": "CMIP5", "model": "HadGEM2-ES",
+            "submodel": "Aerosols",
+            "template": os.path.join(
+                FORMATTER_DIR, "templates", "submodel.fmt")}
+
+    def test_check(self):
+        doc_request.check(self.request)
+        self.assertRaises(RequestError, doc_request.check, [])
+        for key in ["template", "submodel"]:
+            request = dict(self.request)
+            del request[key]
+            self.assertRaises(RequestError, doc_request.check, request)
+        self.request["doc"] = "platform"
+        self.assertRaises(RequestError, doc_request.check, self.request)
+
+    def test_check_error(self):
+        del self.request["model"]
+        self.assertRaises(
+            KeyError, doc_request.check, self.request, KeyError)
+
+    def test_doc_builder(self):
+        cfg = {
+            "global": {
+                "institute": "mohc", "daopkg": "dao.crem_csv",
+                "project": "other"},
+            "database": {"db_dir": os.path.join(FORMATTER_DIR, "csv")}}
+        with open(self.request["template"]) as template_stream:
+            parsed = template.parse_template(template_stream)
+        kept_cfg, kept_parsed = copy.deepcopy(cfg), copy.deepcopy(parsed)
+        doc_builder = doc_request.doc_builder(self.request, parsed, cfg)
+        self.assertEqual(cfg, kept_cfg)
+        self.assertEqual(parsed, kept_parsed)
+        dao = doc_builder.node.dao
+        self.assertEqual(dao.submodel, "Aerosols")
+        self.assertEqual(dao.output_dir, "out")
+        self.assertEqual(doc_builder.node.project, "CMIP5")
+
+
+if __name__ == "__main__":
+    unittest.main()
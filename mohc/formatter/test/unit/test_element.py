@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import pyesdoc
+import pyesdoc.ontologies.cim.v1 as cim
+
+from dao.dao_exception import DaoContractException
+from elements import ComponentProperty, GridTile
+from elements.element import ElementFactory, attr_mapper
+import shared
+
+
+class TestElementFactory(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = ElementFactory()
+
+    def test_meta_matches_pyesdoc_create(self):
+        created = pyesdoc.create(
+            cim.ModelComponent, project="cmip5", institute="mohc", version=0)
+        cloned = self.factory.create(cim.ModelComponent, "cmip5", "mohc")
+        for attr in created.meta.__dict__:
+            if attr in ["id", "create_date"]:
+                continue
+            self.assertEqual(
+                getattr(cloned.meta, attr), getattr(created.meta, attr))
+
+    def test_clones_get_fresh_ids(self):
+        first = self.factory.create(cim.ModelComponent, "cmip5", "mohc")
+        second = self.factory.create(cim.ModelComponent, "cmip5", "mohc")
+        self.assertNotEqual(first.meta.id, second.meta.id)
+        self.assertIsNotNone(first.meta.create_date)
+
+    def test_clones_do_not_share_lists(self):
+        first = self.factory.create(cim.ModelComponent, "cmip5", "mohc")
+        second = self.factory.create(cim.ModelComponent, "cmip5", "mohc")
+        first.meta.sub_projects.append(u"foo")
+        first.properties.append(
+            self.factory.create(cim.ComponentProperty, "cmip5", "mohc"))
+        self.assertEqual(len(second.meta.sub_projects), 0)
+        self.assertEqual(len(second.properties), 0)
+
+    def test_one_prototype_per_key(self):
+        self.factory.create(cim.ModelComponent, "cmip5", "mohc")
+        self.factory.create(cim.ModelComponent, "cmip5", "mohc")
+        self.factory.create(cim.ModelComponent, "cmip5", "ukmo")
+        self.factory.create(cim.ComponentProperty, "cmip5", "mohc")
+        self.assertEqual(len(self.factory.prototype), 3)
+
+    def test_validates_like_pyesdoc_create(self):
+        for element_type in [cim.ModelComponent, cim.Platform]:
+            created = pyesdoc.create(
+                element_type, project="cmip5", institute="mohc", version=0)
+            cloned = self.factory.create(element_type, "cmip5", "mohc")
+            self.assertEqual(
+                len(pyesdoc.validate(cloned)),
+                len(pyesdoc.validate(created)))
+            created.meta.id = cloned.meta.id
+            created.meta.create_date = cloned.meta.create_date
+            self.assertEqual(
+                pyesdoc.encode(cloned, "json"),
+                pyesdoc.encode(created, "json"))
+
+
+class TestAttrMapper(unittest.TestCase):
+
+    def setUp(self):
+        self.populate = attr_mapper(["short_name"], ["description", "units"])
+        self.element = shared.make_empty_component(cim.ComponentProperty)
+
+    def test_copies_attributes(self):
+        self.populate(
+            self.element, {"short_name": "Name", "units": "K", "other": 1})
+        self.assertEqual(self.element.short_name, "Name")
+        self.assertEqual(self.element.units, "K")
+        self.assertIsNone(self.element.description)
+        self.assertFalse(hasattr(self.element, "other"))
+
+    def test_missing_required_attr(self):
+        self.assertRaises(
+            DaoContractException, self.populate, self.element,
+            {"description": "No name"})
+
+    def test_invalid_attr_name(self):
+        self.assertRaises(TypeError, attr_mapper, ["bad name"], [])
+
+    def test_compiled_for_each_class(self):
+        self.assertIsNot(ComponentProperty.populate, GridTile.populate)
+        element = shared.make_empty_component(cim.GridTile)
+        GridTile.populate(element, {
+            "discretization_type": "logically_rectangular",
+            "is_regular": True})
+        self.assertEqual(element.discretization_type, "logically_rectangular")
+        self.assertTrue(element.is_regular)
+
+
+if __name__ == "__main__":
+    unittest.main()
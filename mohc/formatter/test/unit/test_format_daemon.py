@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import httplib
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+import unittest
+
+from dao import crem_csv
+import formatDaemon
+from formatDaemon import FormatService, RequestError
+
+
+class TestFormatService(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self._write("format.cfg", "[global]\ndaopkg: dao.crem_csv\n")
+        self.service = FormatService(self.work_dir)
+
+    def tearDown(self):
+        crem_csv.table_cache = None
+        shutil.rmtree(self.work_dir)
+
+    def _write(self, name, text, mtime=None):
+        path = os.path.join(self.work_dir, name)
+        with open(path, "w") as out:
+            out.write(text)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_uses_table_cache(self):
+        self.assertIs(crem_csv.table_cache, self.service.table_cache)
+
+    def test_config_read_again_when_changed(self):
+        cfg = self.service.config()
+        self.assertIs(self.service.config(), cfg)
+        self._write(
+            "format.cfg", "[global]\ndaopkg: dao.crem\ninstitute: mohc\n")
+        self.assertEqual(self.service.config()["global"]["daopkg"], "dao.crem")
+
+    def test_config_needs_daopkg(self):
+        self._write("format.cfg", "[global]\ninstitute: mohc\n")
+        self.assertRaises(RequestError, self.service.config)
+
+    def test_template_parsed_again_when_changed(self):
+        path = self._write("test.fmt", '{"Model": {}}', mtime=1000)
+        parsed = self.service.template(path)
+        self.assertIs(self.service.template(path), parsed)
+        self._write("test.fmt", '{"Platform": {}}', mtime=2000)
+        self.assertEqual(self.service.template(path), {"Platform": {}})
+
+    def test_missing_template(self):
+        self.assertRaises(
+            RequestError, self.service.template,
+            os.path.join(self.work_dir, "missing.fmt"))
+
+    def test_check_request(self):
+        request = {
+            "doc": "experiment", "format": "xml", "output": "out",
+            "project": "CMIP5", "template": "experiment.fmt",
+            "model": "HadGEM2-ES"}
+        self.assertRaises(RequestError, formatDaemon._check_request, request)
+        request["experiment"] = "rcp85"
+        formatDaemon._check_request(request)
+        request["doc"] = "platform"
+        self.assertRaises(RequestError, formatDaemon._check_request, request)
+
+    def test_unknown_format(self):
+        self.assertRaises(
+            RequestError, self.service._encodings, "xml,pdf")
+
+
+class TestFormatServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = formatDaemon.make_server(FormatService(), 0)
+        self.server.RequestHandlerClass.log_message = lambda *args: None
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        crem_csv.table_cache = None
+
+    def _request(self, method, path, body=None):
+        connection = httplib.HTTPConnection(
+            "127.0.0.1", self.server.server_port)
+        connection.request(method, path, body)
+        response = connection.getresponse()
+        result = response.status, json.loads(response.read())
+        connection.close()
+        return result
+
+    def test_bad_request(self):
+        status, body = self._request("POST", "/build", '{"doc": "model"}')
+        self.assertEqual(status, 400)
+        self.assertIn("error", body)
+
+    def test_invalid_json(self):
+        status, body = self._request("POST", "/build", "{")
+        self.assertEqual(status, 400)
+
+    def test_status(self):
+        status, body = self._request("GET", "/status")
+        self.assertEqual(status, 200)
+        self.assertEqual(body["templates"], [])
+
+    def test_unknown_path(self):
+        status, body = self._request("GET", "/build")
+        self.assertEqual(status, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,6 +3,8 @@
 import unittest
 import sys
 
+import mock
+
 import formatCIM
 
 
@@ -23,6 +25,55 @@ class TestFormatCIMUsage(unittest.TestCase):
         formatCIM.check_usage()
         self.assertTrue(True)
 
+    def test_profile_options(self):
+        valid = [
+            "-f", "xml", "-d", "model", "-m", "HadGEM2-ES",
+            "-o", "foo", "-p", "CMIP5", "-t", "foo",
+            "--profile", "foo.prof", "--timings"]
+        sys.argv = sys.argv + valid
+        option = formatCIM.check_usage()
+        self.assertEqual(option["--profile"], "foo.prof")
+        self.assertIn("--timings", option)
+
+    def test_several_formats(self):
+        valid = [
+            "-f", "xml,json,html", "-d", "model", "-m", "HadGEM2-ES",
+            "-o", "foo", "-p", "CMIP5", "-t", "foo", "--parallel"]
+        sys.argv = sys.argv + valid
+        option = formatCIM.check_usage()
+        self.assertEqual(option["-f"], "xml,json,html")
+        self.assertIn("--parallel", option)
+
+    def test_invalid_format_in_list(self):
+        invalid = [
+            "-f", "xml,pdf", "-d", "model", "-m", "HadGEM2-ES",
+            "-o", "foo", "-p", "CMIP5", "-t", "foo"]
+        sys.argv = sys.argv + invalid
+        self.assertRaises(SystemExit, formatCIM.check_usage)
+
+    def test_output_layout(self):
+        valid = [
+            "-f", "xml", "-d", "model", "-m", "HadGEM2-ES", "-o", "foo",
+            "-p", "CMIP5", "-t", "foo", "--layout", "tree", "--gzip"]
+        sys.argv = sys.argv + valid
+        writer = formatCIM.output_writer(formatCIM.check_usage())
+        self.assertEqual(writer.layout, "tree")
+        self.assertTrue(writer.compress)
+
+    def test_unknown_layout(self):
+        invalid = [
+            "-f", "xml", "-d", "model", "-m", "HadGEM2-ES", "-o", "foo",
+            "-p", "CMIP5", "-t", "foo", "--layout", "deep"]
+        sys.argv = sys.argv + invalid
+        self.assertRaises(SystemExit, formatCIM.check_usage)
+
+    def test_submodels_need_model(self):
+        invalid = [
+            "-f", "xml", "-d", "submodel", "-m", "HadGEM2-ES", "-s", "Ocean",
+            "-o", "foo", "-p", "CMIP5", "-t", "foo", "--submodels", "all"]
+        sys.argv = sys.argv + invalid
+        self.assertRaises(SystemExit, formatCIM.check_usage)
+
     def test_project_mandatory(self):
         invalid = [
             "-f", "xml", "-d", "model", "-m", "HadGEM2-ES",
@@ -62,5 +113,41 @@ class TestFormatCIMUsage(unittest.TestCase):
         self.assertRaises(SystemExit, formatCIM.check_usage)
 
 
+class TestWriteDoc(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = object()
+        self.patcher = mock.patch.object(
+            formatCIM.pyesdoc, "write", side_effect=_fake_write)
+        self.write = self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_one_path_per_format(self):
+        paths = formatCIM.write_doc(self.doc, "out", ["xml", "json", "html"])
+        self.assertEqual(
+            paths, ["out/doc.xml", "out/doc.json", "out/doc.html"])
+        self.assertEqual(self.write.call_count, 3)
+
+    def test_parallel(self):
+        paths = formatCIM.write_doc(
+            self.doc, "out", ["xml", "json", "html"], parallel=True)
+        self.assertEqual(
+            paths, ["out/doc.xml", "out/doc.json", "out/doc.html"])
+        self.assertIsNone(formatCIM._writing)
+
+    def test_parallel_error(self):
+        self.assertRaises(
+            Exception, formatCIM.write_doc, self.doc, "out",
+            ["xml", "pdf"], parallel=True)
+
+
+def _fake_write(doc, output_path, encoding):
+    if encoding == "pdf":
+        raise ValueError("Unknown encoding")
+    return "%s/doc.%s" % (output_path, encoding)
+
+
 if __name__ == "__main__":
     unittest.main()
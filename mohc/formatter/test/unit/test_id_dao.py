@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 
 from mock import Mock
+import multiprocessing
+import os.path
+import shutil
+import sys
+import tempfile
 import unittest
 
-from dao.id_dao import DocIdDao
+from dao.id_dao import DocIdDao, DocIdRecord, PersistentDocIdDao
 from dao.dao_exception import DaoConnectionException, DaoMetadataException
 
 
@@ -11,13 +16,15 @@ class TestLDocIdDao(unittest.TestCase):
 
     def setUp(self):
         self.dao = DocIdDao()
-        self.dao.id = {
-            "ModelComponent:HadGEM2-ES": "mod1",
-            "ModelComponent:HadGEM2-ES:Atmosphere": "mod1.1",
-            "NumericalExperiment:rcp85": "id2",
-            "DataObject:name1": "id23",
-            "DataObject:name2": "id24",
-            "DataObject:name3": "id25"}
+        self.dao.add_ids([
+            ("ModelComponent", "HadGEM2-ES", "mod1"),
+            ("ModelComponent", "HadGEM2-ES:Atmosphere", "mod1.1"),
+            ("ModelComponent", "HadGEM2-ES:Atmosphere:Dynamics", "mod1.1.1"),
+            ("ModelComponent", "HadGEM2-ESM:Ocean", "mod2.1"),
+            ("NumericalExperiment", "rcp85", "id2"),
+            ("DataObject", "name1", "id23"),
+            ("DataObject", "name2", "id24"),
+            ("DataObject", "name3", "id25")])
 
     def test_in_memory_id(self):
         constraint = self._constraint("NumericalExperiment", "rcp85")
@@ -43,10 +50,200 @@ class TestLDocIdDao(unittest.TestCase):
             "type": "DataObject", "name": "",
             "container_dao": fake_container_dao})
         self.assertEqual(len(daos), 3)
+        self.assertEqual(
+            [d.metadata({})["id"] for d in daos], ["id23", "id24", "id25"])
+        self.assertEqual(self.dao.name, "")
+
+    def test_daos_for_node_missing_name(self):
+        fake_container_dao = Mock()
+        fake_container_dao.name_for_reference.return_value = [
+            "name1", "name4"]
+        self.assertRaises(
+            DaoMetadataException, self.dao.daos_for_node, {
+                "type": "DataObject", "name": "",
+                "container_dao": fake_container_dao})
+
+    def test_daos_for_named_node(self):
+        daos = self.dao.daos_for_node(
+            self._constraint("NumericalExperiment", "rcp85"))
+        self.assertEqual(len(daos), 1)
+        self.assertEqual(daos[0].metadata({})["id"], "id2")
+        self.assertEqual(self.dao.name, "")
+
+    def test_resolve(self):
+        records = self.dao.resolve("DataObject", ["name3", "name1"])
+        self.assertEqual([r["id"] for r in records], ["id25", "id23"])
+        self.assertEqual(records[0]["name"], "name3")
+
+    def test_resolve_reports_all_missing(self):
+        try:
+            self.dao.resolve("DataObject", ["name1", "name4", "name5"])
+            self.fail("Missing names should raise an error")
+        except DaoMetadataException as err:
+            self.assertTrue("DataObject:name4" in str(err))
+            self.assertTrue("DataObject:name5" in str(err))
+
+    def test_ids_under(self):
+        records = self.dao.ids_under("ModelComponent", "HadGEM2-ES")
+        self.assertEqual(
+            sorted(r["id"] for r in records), ["mod1", "mod1.1", "mod1.1.1"])
+        records = self.dao.ids_under("ModelComponent", "HadGEM2-ES:Atmosphere")
+        self.assertEqual(
+            sorted(r["name"] for r in records), [
+                "HadGEM2-ES:Atmosphere", "HadGEM2-ES:Atmosphere:Dynamics"])
+        self.assertEqual(self.dao.ids_under("DataObject", "name"), [])
+
+    def test_ids_under_sees_new_ids(self):
+        self.dao.ids_under("ModelComponent", "HadGEM2-ES")
+        self.dao.add_id("ModelComponent", "HadGEM2-ES:Ocean", "mod1.2")
+        records = self.dao.ids_under("ModelComponent", "HadGEM2-ES")
+        self.assertEqual(len(records), 4)
+
+    def test_name_parts_shared(self):
+        keys = sorted(self.dao.index["ModelComponent"])
+        self.assertIs(keys[0][0], keys[1][0])
+
+    def test_replace_ids(self):
+        self.dao.ids_under("ModelComponent", "HadGEM2-ES")
+        self.dao.replace_ids({"mod1.1": "old1.1", "id2": "old2"})
+        records = self.dao.ids_under("ModelComponent", "HadGEM2-ES")
+        self.assertEqual(
+            sorted(r["id"] for r in records),
+            ["mod1", "mod1.1.1", "old1.1"])
+        constraint = self._constraint("NumericalExperiment", "rcp85")
+        self.assertEqual(self.dao.metadata(constraint)["id"], "old2")
+
+    def test_id_record(self):
+        constraint = self._constraint("NumericalExperiment", "rcp85")
+        record = self.dao.metadata(constraint)
+        self.assertIsInstance(record, DocIdRecord)
+        self.assertEqual(record, {
+            "id": "id2", "type": "NumericalExperiment", "name": "rcp85"})
+        self.assertTrue("id" in record)
+        self.assertRaises(KeyError, record.__getitem__, "short_name")
+        self.assertFalse(hasattr(record, "__dict__"))
+        self.assertLess(
+            sys.getsizeof(record), sys.getsizeof(dict(record.items())))
 
     def _constraint(self, type, name):
         return {"type": type, "name": name}
 
 
+class TestPersistentDocIdDao(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.dao = self._make_dao()
+
+    def tearDown(self):
+        self.dao.disconnect()
+        shutil.rmtree(self.output_dir)
+
+    def test_db_in_output_dir(self):
+        self.dao.add_id("ModelComponent", "HadGEM2-ES", "mod1")
+        self.dao.flush()
+        self.assertTrue(os.path.exists(
+            os.path.join(self.output_dir, "doc_ids.sqlite")))
+
+    def test_needs_location(self):
+        self.dao.output_dir = ""
+        self.assertRaises(DaoConnectionException, self.dao.connect)
+
+    def test_in_memory_before_flush(self):
+        self.dao.add_id("ModelComponent", "HadGEM2-ES", "mod1")
+        metadata = self.dao.metadata(
+            {"type": "ModelComponent", "name": "HadGEM2-ES"})
+        self.assertEqual(metadata["id"], "mod1")
+
+    def test_read_through_to_earlier_run(self):
+        self.dao.add_ids([
+            ("ModelComponent", "HadGEM2-ES", "mod1"),
+            ("ModelComponent", "HadGEM2-ES:Atmosphere", "mod1.1")])
+        self.dao.disconnect()
+        later_run = self._make_dao()
+        metadata = later_run.metadata(
+            {"type": "ModelComponent", "name": "HadGEM2-ES:Atmosphere"})
+        self.assertEqual(metadata["id"], "mod1.1")
+        self.assertRaises(
+            DaoMetadataException, later_run.metadata,
+            {"type": "ModelComponent", "name": "HadGEM2-AO"})
+        later_run.disconnect()
+
+    def test_resolve_reads_through(self):
+        self.dao.add_ids([
+            ("DataObject", "name%s" % idx, "id%s" % idx)
+            for idx in range(1200)])
+        later_run = self._make_dao()
+        later_run.add_id("DataObject", "local", "id_local")
+        names = ["local"] + ["name%s" % idx for idx in range(1200)]
+        records = later_run.resolve("DataObject", names)
+        self.assertEqual(records[0]["id"], "id_local")
+        self.assertEqual(records[-1]["id"], "id1199")
+        later_run.disconnect()
+
+    def test_ids_under_reads_through(self):
+        self.dao.add_ids([
+            ("ModelComponent", "HadGEM2-ES", "mod1"),
+            ("ModelComponent", "HadGEM2-ES:Atmosphere", "mod1.1"),
+            ("ModelComponent", "HadGEM2-ESM", "mod2")])
+        later_run = self._make_dao()
+        later_run.add_id("ModelComponent", "HadGEM2-ES:Ocean", "mod1.2")
+        records = later_run.ids_under("ModelComponent", "HadGEM2-ES")
+        self.assertEqual(
+            sorted(r["id"] for r in records), ["mod1", "mod1.1", "mod1.2"])
+        later_run.disconnect()
+
+    def test_rebuild_replaces_id(self):
+        self.dao.add_ids([("ModelComponent", "HadGEM2-ES", "mod1")])
+        self.dao.add_ids([("ModelComponent", "HadGEM2-ES", "mod2")])
+        later_run = self._make_dao()
+        metadata = later_run.metadata(
+            {"type": "ModelComponent", "name": "HadGEM2-ES"})
+        self.assertEqual(metadata["id"], "mod2")
+        later_run.disconnect()
+
+    def test_replaced_ids_saved(self):
+        self.dao.add_id("ModelComponent", "HadGEM2-ES", "new")
+        self.dao.replace_ids({"new": "old"})
+        self.dao.flush()
+        later_run = self._make_dao()
+        metadata = later_run.metadata(
+            {"type": "ModelComponent", "name": "HadGEM2-ES"})
+        self.assertEqual(metadata["id"], "old")
+        later_run.disconnect()
+
+    def test_concurrent_writers(self):
+        workers = [
+            multiprocessing.Process(
+                target=_add_ids, args=(self.output_dir, worker))
+            for worker in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        for worker in range(4):
+            for idx in range(50):
+                name = "member%s_%s" % (worker, idx)
+                metadata = self.dao.metadata(
+                    {"type": "EnsembleMember", "name": name})
+                self.assertEqual(metadata["id"], "id_%s" % name)
+
+    def _make_dao(self):
+        dao = PersistentDocIdDao()
+        dao.output_dir = self.output_dir
+        return dao
+
+
+def _add_ids(output_dir, worker):
+    # Writes ids one at a time from a separate process.
+    dao = PersistentDocIdDao()
+    dao.output_dir = output_dir
+    for idx in range(50):
+        name = "member%s_%s" % (worker, idx)
+        dao.add_id("EnsembleMember", name, "id_%s" % name)
+        dao.flush()
+    dao.disconnect()
+
+
 if __name__ == "__main__":
     unittest.main()
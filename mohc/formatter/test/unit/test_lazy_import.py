@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os.path
+import subprocess
+import sys
+import unittest
+
+from lazy_import import lazy_module
+
+# Importing formatCIM.py must take less than this many seconds. With
+# pyesdoc and the elements imported up front it takes more than twice
+# as long.
+IMPORT_BUDGET = 0.25
+
+# Modules formatCIM.py mustn't import until it needs them.
+HEAVY_MODULES = [
+    "pyesdoc", "elements", "template", "dao", "MySQLdb", "HTMLParser",
+    "sqlite3"]
+
+FORMATTER_DIR = os.path.join(os.path.dirname(__file__), "..", "..")
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.time()
+import formatCIM
+seconds = time.time() - start
+if len(sys.argv) > 1:
+    sys.argv = ["formatCIM.py"] + sys.argv[1:]
+    try:
+        formatCIM.check_usage()
+    except SystemExit:
+        pass
+print json.dumps({"seconds": seconds, "modules": sorted(sys.modules)})
+"""
+
+
+def _import_formatCIM(*args):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([
+        os.path.join(FORMATTER_DIR, "lib"),
+        os.path.join(FORMATTER_DIR, "bin")])
+    process = subprocess.Popen(
+        [sys.executable, "-c", IMPORT_SCRIPT] + list(args), env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    return json.loads(out.splitlines()[-1])
+
+
+def _heavy(modules):
+    return [
+        name for name in modules if name.split(".")[0] in HEAVY_MODULES]
+
+
+class TestLazyModule(unittest.TestCase):
+
+    def test_not_imported_until_used(self):
+        module = lazy_module("colorsys")
+        self.assertIsNone(module._module)
+        self.assertEqual(module.rgb_to_hsv(0, 0, 0), (0, 0, 0))
+        self.assertIs(module._module, sys.modules["colorsys"])
+
+    def test_submodule(self):
+        module = lazy_module("os.path")
+        self.assertEqual(module.join("a", "b"), os.path.join("a", "b"))
+
+    def test_missing_module(self):
+        module = lazy_module("no_such_module_here")
+        self.assertRaises(ImportError, getattr, module, "anything")
+
+    def test_missing_attribute(self):
+        module = lazy_module("colorsys")
+        self.assertRaises(AttributeError, getattr, module, "no_such_name")
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_import_loads_no_heavy_modules(self):
+        self.assertEqual(_heavy(_import_formatCIM()["modules"]), [])
+
+    def test_usage_error_loads_no_heavy_modules(self):
+        result = _import_formatCIM("-f", "pdf")
+        self.assertEqual(_heavy(result["modules"]), [])
+
+    def test_import_time_budget(self):
+        # Best of three, to allow for a busy machine.
+        seconds = min(_import_formatCIM()["seconds"] for _ in range(3))
+        self.assertLess(seconds, IMPORT_BUDGET)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import unittest
+
+import pyesdoc.ontologies.cim.v1 as cim
+
+import dao.crem_csv
+from dao.dao_handle import row_handle
+from memprofile import MemoryProfiler, retained_size
+
+
+class TestRetainedSize(unittest.TestCase):
+
+    def test_includes_referents(self):
+        inner = ["x" * 1000]
+        outer = {"inner": inner}
+        self.assertGreaterEqual(
+            retained_size(outer),
+            sys.getsizeof(outer) + sys.getsizeof(inner) +
+            sys.getsizeof(inner[0]))
+
+    def test_shared_objects_counted_once(self):
+        shared = "y" * 1000
+        self.assertLess(retained_size([shared, shared]), 2000)
+
+    def test_classes_left_out(self):
+        self.assertLess(retained_size([dao.crem_csv.CsvDao]), 1000)
+
+
+class TestMemoryProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = MemoryProfiler(top=5)
+
+    def test_snapshot_counts(self):
+        parent = dao.crem_csv.CitationDao({})
+        handles = [row_handle(parent, cite_id=str(i)) for i in range(3)]
+        properties = [cim.ComponentProperty() for i in range(4)]
+        snapshot = self.profiler.snapshot("build_doc")
+        self.assertGreaterEqual(snapshot["daos"]["CitationDaoHandle"], 3)
+        self.assertGreaterEqual(snapshot["pyesdoc"]["ComponentProperty"], 4)
+        self.assertGreater(snapshot["rss_kb"], 0)
+
+    def test_report(self):
+        tree = {"nodes": range(100)}
+        self.profiler.watch("build tree", tree)
+        self.profiler.snapshot("parse_template")
+        self.profiler.snapshot("build_doc")
+        report = self.profiler.report()
+        self.assertIn("== after parse_template", report)
+        self.assertIn("== after build_doc", report)
+        self.assertIn("retained size of build tree", report)
+        self.assertIn("pyesdoc objects:", report)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import formatCIM
+import output
+
+FORMATTER_DIR = os.path.join(os.path.dirname(__file__), "..", "..")
+
+
+class TestOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cfg = {
+            "global": {
+                "institute": "mohc", "daopkg": "dao.crem_csv",
+                "project": "CMIP5"},
+            "database": {"db_dir": os.path.join(FORMATTER_DIR, "csv")}}
+        self.key = output.doc_key(
+            "CMIP5", "submodel", ["HadGEM2-ES", "Aerosols"])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _build(self, submodel="Aerosols"):
+        dao_env = {
+            "model": "HadGEM2-ES", "submodel": submodel,
+            "project": "CMIP5", "output_dir": self.dir}
+        doc_builder = formatCIM.parse_template(
+            os.path.join(FORMATTER_DIR, "templates", "submodel.fmt"),
+            dao_env, self.cfg)
+        return formatCIM.build_doc(doc_builder)
+
+    def _write(self, doc):
+        manifest = output.OutputManifest(self.dir)
+        version = manifest.compare(self.key, doc, ["json"])
+        paths = [output.OutputLayout().write(doc, self.dir, "json")]
+        manifest.record(version, ["json"], paths)
+        manifest.save()
+        return version, paths
+
+    def test_doc_key(self):
+        self.assertEqual(self.key, "CMIP5 submodel HadGEM2-ES:Aerosols")
+
+    def test_masked(self):
+        first, second = self._build(), self._build()
+        first_text, first_ids = output.masked(first, "json")
+        second_text, second_ids = output.masked(second, "json")
+        self.assertEqual(first_text, second_text)
+        self.assertIn(first.meta.id, first_ids)
+        self.assertNotIn(first.meta.id, first_text)
+        self.assertEqual(len(first_ids), len(second_ids))
+        self.assertNotEqual(first_ids, second_ids)
+
+    def test_masked_keeps_dates(self):
+        doc = self._build()
+        date = doc.meta.create_date
+        output.masked(doc, "json")
+        self.assertIs(doc.meta.create_date, date)
+
+    def test_unchanged(self):
+        first_doc = self._build()
+        first_version, paths = self._write(first_doc)
+        self.assertFalse(first_version.unchanged())
+        doc = self._build()
+        version = output.OutputManifest(self.dir).compare(
+            self.key, doc, ["json"])
+        self.assertTrue(version.unchanged())
+        self.assertEqual(version.paths, paths)
+        self.assertEqual(version.id_map()[doc.meta.id], first_doc.meta.id)
+
+    def test_changed(self):
+        self._write(self._build("Atmosphere"))
+        version = output.OutputManifest(self.dir).compare(
+            self.key, self._build(), ["json"])
+        self.assertFalse(version.unchanged())
+
+    def test_file_touched(self):
+        version, paths = self._write(self._build())
+        with open(paths[0], "a") as doc_file:
+            doc_file.write(" ")
+        version = output.OutputManifest(self.dir).compare(
+            self.key, self._build(), ["json"])
+        self.assertFalse(version.unchanged())
+
+    def test_new_format(self):
+        self._write(self._build())
+        version = output.OutputManifest(self.dir).compare(
+            self.key, self._build(), ["json", "xml"])
+        self.assertFalse(version.unchanged())
+
+    def test_save_keeps_other_entries(self):
+        self._write(self._build())
+        manifest = output.OutputManifest(self.dir)
+        with open(manifest.path, "w") as manifest_file:
+            json.dump({"other": {}}, manifest_file)
+        manifest.changed.add(self.key)
+        manifest.save()
+        entries = json.load(open(manifest.path))
+        self.assertEqual(sorted(entries), sorted(["other", self.key]))
+
+    def test_write(self):
+        doc = self._build()
+        writer = output.OutputLayout()
+        path = writer.write(doc, self.dir, "json")
+        self.assertEqual(os.path.dirname(path), self.dir)
+        file_path = os.path.join(self.dir, "submodel.json")
+        self.assertEqual(writer.write(doc, file_path, "json"), file_path)
+        self.assertEqual(
+            sorted(os.listdir(self.dir)),
+            sorted([os.path.basename(path), "submodel.json",
+                    output.INDEX_FILE]))
+
+    def test_tree_layout(self):
+        doc = self._build()
+        path = output.OutputLayout("tree").write(doc, self.dir, "json")
+        self.assertEqual(
+            os.path.relpath(os.path.dirname(path), self.dir),
+            os.path.join("mohc", "cmip5", "ModelComponent"))
+
+    def test_hashed_layout(self):
+        doc = self._build()
+        writer = output.OutputLayout("hashed")
+        sub_dirs = writer.sub_dirs(doc)
+        self.assertEqual(len(sub_dirs), 1)
+        self.assertEqual(len(sub_dirs[0]), 2)
+        path = writer.write(doc, self.dir, "json")
+        self.assertEqual(
+            os.path.dirname(path), os.path.join(self.dir, sub_dirs[0]))
+
+    def test_unknown_layout(self):
+        self.assertRaises(ValueError, output.OutputLayout, "deep")
+
+    def test_gzip(self):
+        doc = self._build()
+        path = output.OutputLayout(compress=True).write(doc, self.dir, "json")
+        self.assertTrue(path.endswith(".json.gz"))
+        with gzip.open(path) as doc_file:
+            self.assertEqual(json.load(doc_file)["meta"]["id"], doc.meta.id)
+        # Only the compressed file is written.
+        self.assertEqual(
+            sorted(os.listdir(self.dir)),
+            sorted([os.path.basename(path), output.INDEX_FILE]))
+        with open(path, "rb") as doc_file:
+            header = doc_file.read(256)
+        self.assertIn(os.path.basename(path)[:-3] + "\0", header)
+
+    def test_index(self):
+        docs = [self._build(name) for name in ["Aerosols", "Atmosphere"]]
+        writer = output.OutputLayout("hashed")
+        paths = [writer.write(doc, self.dir, "json") for doc in docs]
+        writer.write(docs[0], self.dir, "json")
+        entries = output.read_index(self.dir)
+        self.assertEqual(
+            sorted((entry["id"], entry["path"]) for entry in entries),
+            sorted((doc.meta.id, os.path.relpath(path, self.dir))
+                   for doc, path in zip(docs, paths)))
+        self.assertEqual(
+            sorted(entry["name"] for entry in entries),
+            ["Aerosols", "Atmosphere"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+
+from pipeline import Pipeline, Stage
+
+
+def _fail_on_three(item):
+    if item == 3:
+        raise ValueError("three")
+    return item
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_results_in_order(self):
+        stages = [
+            Stage("double", lambda item: item * 2, workers=3),
+            Stage("add", lambda item: item + 1, workers=2)]
+        results = Pipeline(stages, queue_size=2).run(range(20))
+        self.assertEqual(
+            [result.item for result in results],
+            [item * 2 + 1 for item in range(20)])
+        self.assertEqual([result.index for result in results], range(20))
+        self.assertEqual(stages[0].stats()["items"], 20)
+
+    def test_error_skips_later_stages(self):
+        later = []
+
+        def record(item):
+            later.append(item)
+            return item
+        stages = [Stage("check", _fail_on_three), Stage("record", record)]
+        results = Pipeline(stages).run(range(5))
+        self.assertEqual(results[3].error, "check: three")
+        self.assertNotIn(3, later)
+        self.assertEqual(len(later), 4)
+        self.assertEqual(stages[0].failed, 1)
+        self.assertIsNone(results[4].error)
+
+    def test_stages_overlap(self):
+        # With the stages running at the same time, both sleeps for
+        # each item overlap with the other stage's sleeps.
+        def slow(item):
+            time.sleep(0.05)
+            return item
+        stages = [Stage("first", slow), Stage("second", slow)]
+        start = time.time()
+        Pipeline(stages).run(range(6))
+        self.assertLess(time.time() - start, 0.55)
+
+    def test_item_seconds(self):
+        def slow_one(item):
+            if item == 1:
+                time.sleep(0.05)
+            return item
+        stages = [Stage("first", slow_one), Stage("second", slow_one)]
+        results = Pipeline(stages).run(range(3))
+        self.assertGreaterEqual(results[1].seconds, 0.1)
+        self.assertLess(results[0].seconds, 0.05)
+
+    def test_bounded_queue(self):
+        fed = []
+        release = threading.Event()
+
+        def items():
+            for item in range(10):
+                fed.append(item)
+                yield item
+
+        def wait(item):
+            release.wait()
+            return item
+        pipeline = Pipeline([Stage("wait", wait)], queue_size=2)
+        thread = threading.Thread(target=pipeline.run, args=(items(),))
+        thread.start()
+        time.sleep(0.1)
+        # One item being worked on, two queued and one waiting to be
+        # queued.
+        self.assertLessEqual(len(fed), 4)
+        release.set()
+        thread.join()
+        self.assertEqual(len(fed), 10)
+
+    def test_no_workers(self):
+        self.assertRaises(ValueError, Stage, "none", len, workers=0)
+
+    def test_no_items(self):
+        self.assertEqual(Pipeline([Stage("one", len)]).run([]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
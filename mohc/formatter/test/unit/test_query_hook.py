@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import StringIO
+import unittest
+
+import dao.crem_csv
+from dao import query_hook
+from dao.query_hook import QueryEvent, QueryStats
+
+
+class TestQueryHook(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        query_hook.add_hook(self.events.append)
+        self.dao = dao.crem_csv.ModelDao({})
+        self.dao.db_dir = "../../csv"
+
+    def tearDown(self):
+        query_hook.remove_hook(self.events.append)
+
+    def test_no_hooks(self):
+        query_hook.remove_hook(self.events.append)
+        self.assertIsNone(query_hook.query_started())
+        query_hook.add_hook(self.events.append)
+        self.assertIsNotNone(query_hook.query_started())
+
+    def test_single_row_query(self):
+        self.dao.id_for_model("HadGEM2-ES")
+        event = self.events[0]
+        self.assertEqual(event.dao_class, "ModelDao")
+        self.assertEqual(event.query, "tblmodel.csv")
+        self.assertEqual(event.parameters, {"shortname": "HadGEM2-ES"})
+        self.assertEqual(event.rows, 1)
+        self.assertEqual(event.rows_scanned, 1)
+        self.assertGreaterEqual(event.duration, 0)
+
+    def test_multi_row_query(self):
+        self.dao.multi_row_query(
+            ["idattribute"], "tblattribute.csv", {"componentid": "56"})
+        with open("../../csv/tblattribute.csv") as table:
+            rows = list(csv.DictReader(table))
+        event = self.events[0]
+        self.assertEqual(
+            event.rows, len([row for row in rows
+                             if row["componentid"] == "56"]))
+        self.assertEqual(event.rows_scanned, len(rows))
+        self.assertEqual(event.shape(), "tblattribute.csv where componentid")
+
+
+class TestQueryStats(unittest.TestCase):
+
+    def setUp(self):
+        self.log = StringIO.StringIO()
+        self.stats = QueryStats(slow_ms=10, log=self.log)
+
+    def test_totals(self):
+        for comp_id, duration in [("1", 0.002), ("2", 0.003)]:
+            self.stats(QueryEvent(
+                "SubModelDao", "tblmodelcomponent.csv",
+                {"idtModelComponent": comp_id}, duration, 1, 60))
+        self.stats(QueryEvent(
+            "ModelDao", "SELECT name\n  FROM tblmodel WHERE id = %s",
+            ("7",), 0.001, 1))
+        self.assertEqual(len(self.stats.stats), 2)
+        totals = self.stats.stats[(
+            "SubModelDao", "tblmodelcomponent.csv where idtModelComponent")]
+        self.assertEqual(totals["count"], 2)
+        self.assertAlmostEqual(totals["time"], 0.005)
+        self.assertEqual(totals["rows_scanned"], 120)
+        self.assertIn(
+            ("ModelDao", "SELECT name FROM tblmodel WHERE id = %s"),
+            self.stats.stats)
+        report = self.stats.report().splitlines()
+        self.assertTrue(report[1].endswith("idtModelComponent"))
+        self.assertEqual(report[-1], "0 queries took 10ms or more")
+
+    def test_slow_query_log(self):
+        self.stats(QueryEvent(
+            "CitationDao", "tblreference.csv", {"idtblCitation": "5"},
+            0.02, 1, 96))
+        self.assertEqual(self.stats.slow, 1)
+        self.assertIn("CitationDao tblreference.csv", self.log.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
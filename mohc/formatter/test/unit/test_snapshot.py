@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import decimal
+import json
+import os.path
+import re
+import shutil
+import tempfile
+import unittest
+
+import pyesdoc
+
+from dao.dao_exception import DaoMetadataException
+import formatCIM
+import snapshot
+
+FORMATTER_DIR = os.path.join(os.path.dirname(__file__), "..", "..")
+
+UUID = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+DATE = re.compile(r"\d{4}-\d\d-\d\d[ T]\d\d:\d\d:\d\d(\.\d+)?")
+
+
+class FakeDao(object):
+
+    def __init__(self, rows=None, record=None):
+        self.rows = rows or []
+        self.record = record or {}
+        self.container = None
+
+    def daos_for_node(self, constraint):
+        return self.rows or [self]
+
+    def metadata(self, constraint):
+        return dict(self.record)
+
+    def id(self):
+        return 42
+
+    def container_metadata(self, container_dao):
+        self.container = container_dao
+        return
+
+
+class TestEncode(unittest.TestCase):
+
+    def test_round_trip(self):
+        value = {
+            "date": datetime.datetime(1859, 1, 2, 3, 4, 5, 6),
+            "day": datetime.date(2015, 6, 7),
+            "number": decimal.Decimal("1.50"),
+            "list": [1, u"two", None, True, 2.5]}
+        encoded = snapshot.encode(value)
+        self.assertEqual(json.loads(json.dumps(encoded)), encoded)
+        self.assertEqual(snapshot.decode(encoded), value)
+
+    def test_unknown_type(self):
+        self.assertRaises(snapshot.SnapshotError, snapshot.encode, object())
+
+
+class TestRecordAndReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = [FakeDao(record={"short_name": name})
+                     for name in ["a", "b"]]
+        self.recorded = snapshot.Snapshot()
+        self.template_dao = self.recorded.record(FakeDao(self.rows))
+
+    def test_records_rows(self):
+        rows = self.template_dao.daos_for_node({})
+        names = [row.metadata({})["short_name"] for row in rows]
+        self.assertEqual(names, ["a", "b"])
+        self.assertEqual(self.recorded.daos[0], {"daos_for_node": [[1, 2]]})
+        self.assertEqual(
+            self.recorded.daos[2], {"metadata": [{"short_name": "b"}]})
+
+    def test_dao_as_own_row(self):
+        recorder = self.recorded.record(FakeDao())
+        self.assertEqual(recorder.daos_for_node({}), [recorder])
+
+    def test_container_unwrapped(self):
+        rows = self.template_dao.daos_for_node({})
+        rows[0].container_metadata(self.template_dao)
+        self.assertIs(self.rows[0].container, self.template_dao.dao)
+
+    def test_replay(self):
+        for row in self.template_dao.daos_for_node({}):
+            row.metadata({})
+        self.assertEqual(self.template_dao.id(), 42)
+        replayer = self.recorded.replay(0)
+        self.assertEqual(replayer.id(), 42)
+        rows = replayer.daos_for_node({})
+        self.assertEqual(
+            [row.metadata({}) for row in rows],
+            [{"short_name": "a"}, {"short_name": "b"}])
+        self.assertIs(rows[0], self.recorded.replay(1))
+
+    def test_replay_too_many_calls(self):
+        self.template_dao.id()
+        replayer = self.recorded.replay(0)
+        replayer.id()
+        self.assertRaises(DaoMetadataException, replayer.id)
+
+
+class TestSnapshotFile(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.recorded = snapshot.Snapshot(
+            {"Model": {}}, {"institute": "mohc"}, {"model": "HadGEM2-ES"})
+        self.recorded.record(FakeDao(record={"a": 1})).metadata({})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_save_and_load(self):
+        for name in ["snapshot.json", "snapshot.json.gz"]:
+            path = os.path.join(self.dir, name)
+            self.recorded.save(path)
+            loaded = snapshot.load(path)
+            self.assertEqual(loaded.as_dict(), self.recorded.as_dict())
+
+    def test_wrong_version(self):
+        path = os.path.join(self.dir, "snapshot.json")
+        with open(path, "w") as snapshot_file:
+            json.dump({"version": 0}, snapshot_file)
+        self.assertRaises(snapshot.SnapshotError, snapshot.load, path)
+
+    def test_not_json(self):
+        path = os.path.join(self.dir, "snapshot.json")
+        with open(path, "w") as snapshot_file:
+            snapshot_file.write("{")
+        self.assertRaises(snapshot.SnapshotError, snapshot.load, path)
+
+
+class TestRenderFromSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cfg = {
+            "global": {
+                "institute": "mohc", "daopkg": "dao.crem_csv",
+                "project": "CMIP5"},
+            "database": {"db_dir": os.path.join(FORMATTER_DIR, "csv")}}
+        self.template = os.path.join(
+            FORMATTER_DIR, "templates", "submodel.fmt")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _dao_env(self):
+        return {
+            "model": "HadGEM2-ES", "submodel": "Aerosols",
+            "project": "CMIP5", "output_dir": self.dir}
+
+    def test_same_document(self):
+        doc_builder = formatCIM.parse_template(
+            self.template, self._dao_env(), self.cfg)
+        expected = formatCIM.build_doc(doc_builder)
+
+        recorded = snapshot.Snapshot()
+        doc_builder = formatCIM.parse_template(
+            self.template, self._dao_env(), self.cfg, recorded)
+        formatCIM.build_doc(doc_builder)
+        path = os.path.join(self.dir, "submodel.json.gz")
+        recorded.save(path)
+        self.assertNotIn("db_dir", recorded.names)
+
+        doc_builder = snapshot.load(path).replay_builder(self.dir)
+        rendered = formatCIM.build_doc(doc_builder)
+        self.assertEqual(_encode(rendered), _encode(expected))
+
+
+def _encode(doc):
+    # Ids and creation dates differ between builds.
+    seen = {}
+
+    def renumber(match):
+        return seen.setdefault(match.group(0), "ID%d" % len(seen))
+    text = UUID.sub(renumber, pyesdoc.encode(doc, "json"))
+    return DATE.sub("DATE", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
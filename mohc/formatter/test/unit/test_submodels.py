@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import formatCIM
+import output
+import submodels
+
+FORMATTER_DIR = os.path.join(os.path.dirname(__file__), "..", "..")
+
+
+class TestSubModels(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+        cls.model_doc = cls._build("model")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir)
+
+    @classmethod
+    def _build(cls, doc_type, **dao_env):
+        dao_env.update(
+            {"model": "HadGEM2-ES", "project": "CMIP5", "output_dir": cls.dir})
+        cfg = {
+            "global": {
+                "institute": "mohc", "daopkg": "dao.crem_csv",
+                "project": "CMIP5"},
+            "database": {"db_dir": os.path.join(FORMATTER_DIR, "csv")}}
+        doc_builder = formatCIM.parse_template(
+            os.path.join(FORMATTER_DIR, "templates", "%s.fmt" % doc_type),
+            dao_env, cfg)
+        return formatCIM.build_doc(doc_builder)
+
+    def test_find_all(self):
+        components = submodels.find(self.model_doc)
+        self.assertEqual(components[0].short_name, "Aerosols")
+        self.assertEqual(components[1].short_name, "Aerosol Transport")
+        self.assertEqual(len(components), len(set(map(id, components))))
+
+    def test_find_named(self):
+        components = submodels.find(
+            self.model_doc, ["Atmospheric Advection", "Aerosols"])
+        self.assertEqual(
+            [component.short_name for component in components],
+            ["Aerosols", "Atmospheric Advection"])
+
+    def test_find_missing(self):
+        self.assertRaises(
+            submodels.SubModelError, submodels.find, self.model_doc,
+            ["Aerosols", "Sea Ice Cream"])
+
+    def test_standalone(self):
+        component = submodels.find(self.model_doc, ["Aerosols"])[0]
+        sub_component = component.sub_components[0]
+        old_ids = [component.meta.id, sub_component.meta.id]
+        with submodels.standalone(component):
+            new_ids = [component.meta.id, sub_component.meta.id]
+        self.assertNotIn(new_ids[0], old_ids)
+        self.assertNotIn(new_ids[1], old_ids)
+        self.assertEqual([component.meta.id, sub_component.meta.id], old_ids)
+
+    def test_same_as_submodel_build(self):
+        for name in ["Aerosols", "Atmospheric Dynamical Core"]:
+            component = submodels.find(self.model_doc, [name])[0]
+            with submodels.standalone(component):
+                sliced = output.masked(component, "json")[0]
+            built = self._build("submodel", submodel=name)
+            self.assertEqual(sliced, output.masked(built, "json")[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import formatCIM
+import output
+import subtree_cache
+
+FORMATTER_DIR = os.path.join(os.path.dirname(__file__), "..", "..")
+
+
+class TestSubtreeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        subtree_cache.cache = None
+        shutil.rmtree(self.dir)
+
+    def _build(self, doc_type, **dao_env):
+        dao_env.update(
+            {"model": "HadGEM2-ES", "project": "CMIP5",
+             "output_dir": self.dir})
+        cfg = {
+            "global": {
+                "institute": "mohc", "daopkg": "dao.crem_csv",
+                "project": "CMIP5"},
+            "database": {"db_dir": os.path.join(FORMATTER_DIR, "csv")}}
+        self.doc_builder = formatCIM.parse_template(
+            os.path.join(FORMATTER_DIR, "templates", "%s.fmt" % doc_type),
+            dao_env, cfg)
+        return formatCIM.build_doc(self.doc_builder)
+
+    def _same(self, doc_type, **dao_env):
+        expected = output.masked(self._build(doc_type, **dao_env), "json")
+        subtree_cache.cache = subtree_cache.SubtreeCache()
+        first = self._build(doc_type, **dao_env)
+        misses = subtree_cache.cache.misses
+        second = self._build(doc_type, **dao_env)
+        self.assertEqual(subtree_cache.cache.misses, misses)
+        for doc in [first, second]:
+            self.assertEqual(output.masked(doc, "json")[0], expected[0])
+        return first, second
+
+    def test_same_model(self):
+        first, second = self._same("model")
+        self.assertGreater(subtree_cache.cache.hits, 0)
+        first_ids = set(output.masked(first, "json")[1])
+        second_ids = set(output.masked(second, "json")[1])
+        self.assertFalse(first_ids & second_ids)
+
+    def test_same_experiment(self):
+        self._same("experiment", experiment="rcp85")
+        self.assertGreater(subtree_cache.cache.hits, 0)
+
+    def test_submodel_after_model(self):
+        subtree_cache.cache = subtree_cache.SubtreeCache()
+        self._build("model")
+        hits = subtree_cache.cache.hits
+        self._build("submodel", submodel="Aerosols")
+        self.assertGreater(subtree_cache.cache.hits, hits)
+
+    def test_ids_replayed(self):
+        # Some data objects turn up twice in an experiment, and the
+        # last one built is the one that's referred to.
+        subtree_cache.cache = subtree_cache.SubtreeCache()
+        doc = self._build("experiment", experiment="rcp85")
+        self.assertGreater(subtree_cache.cache.hits, 0)
+        index = self.doc_builder.node.id_dao.index["DataObject"]
+        last = dict((data.acronym, data.meta.id) for data in doc.data)
+        for acronym, id in last.items():
+            self.assertEqual(index[(acronym, )], id)
+
+    def test_not_cacheable(self):
+        cache = subtree_cache.SubtreeCache()
+        self._build("model")
+        nodes = [self.doc_builder]
+        while nodes:
+            node = nodes.pop()
+            if node.refers_to:
+                self.assertFalse(cache.cacheable(node))
+            nodes.extend(node.contents)
+        self.assertIsNone(cache._key(self.doc_builder, object()))
+
+    def test_constraint(self):
+        cache = subtree_cache.SubtreeCache()
+        self._build("model")
+        node = self.doc_builder.contents[-1]
+        dao = node.node.daos_for_node({"id": "1"})[0]
+
+        def build_row(constraint):
+            return (constraint["id"], object())
+        first = cache.build(node, dao, {"id": "1"}, build_row)
+        self.assertEqual(cache.build(node, dao, {"id": "2"}, build_row)[0],
+                         "2")
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.build(node, dao, {"id": "2"}, build_row)[0],
+                         "2")
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(first[0], "1")
+
+
+if __name__ == "__main__":
+    unittest.main()
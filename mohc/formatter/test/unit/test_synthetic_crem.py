@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import syntheticCREM
+
+
+class TestSyntheticCrem(unittest.TestCase):
+
+    def setUp(self):
+        self.tables = syntheticCREM.read_tables(
+            os.path.join(syntheticCREM.PACKAGE_DIR, "csv"))
+
+    def _ids(self, tables, name):
+        key = syntheticCREM.PRIMARY_KEY[name]
+        return [row[key] for row in tables[name].rows]
+
+    def _check_references(self, tables):
+        for name, columns in syntheticCREM.FOREIGN_KEY.items():
+            for column, target in columns.items():
+                ids = set(self._ids(tables, target)) | set(["NULL", ""])
+                for row in tables[name].rows:
+                    self.assertIn(row[column], ids, "%s.%s" % (name, column))
+        for row in tables["tblreferencelist"].rows:
+            target = syntheticCREM.OBJECT_TYPE[row["objectType"]]
+            self.assertIn(row["objectID"], self._ids(tables, target))
+
+    def test_scale(self):
+        scaled = syntheticCREM.scale_tables(self.tables, 3)
+        for name in syntheticCREM.PRIMARY_KEY:
+            ids = self._ids(scaled, name)
+            input_ids = self._ids(self.tables, name)
+            self.assertEqual(len(ids), 3 * len(input_ids))
+            # Copies never share ids.
+            self.assertEqual(len(set(ids)), 3 * len(set(input_ids)))
+        self.assertEqual(
+            len(scaled["tblactivity"].rows),
+            len(self.tables["tblactivity"].rows))
+        self._check_references(scaled)
+
+    def test_copies_renamed(self):
+        scaled = syntheticCREM.scale_tables(self.tables, 2)
+        names = [row["shortname"] for row in scaled["tblmodel"].rows]
+        self.assertEqual(names, ["HadGEM2-ES", "SYN_7_0001"])
+        expt_names = [row["name"] for row in scaled["tblexperiment"].rows]
+        self.assertIn("HadGEM2-ES", expt_names[0])
+        self.assertNotIn("HadGEM2-ES", expt_names[1])
+        self.assertIn("SYN_7_0001", expt_names[1])
+
+    def test_synthetic_trees(self):
+        tables = syntheticCREM.synthetic_trees(self.tables, 3, 2)
+        components = tables["tblmodelcomponent"].rows
+        self.assertEqual(len(components), 2 + 4 + 8)
+        self.assertEqual(
+            len([row for row in components if row["level"] == "3"]), 8)
+        names = [row["name"] for row in components]
+        self.assertEqual(len(names), len(set(names)))
+        self.assertIn("Aerosols", names)
+        self.assertGreater(len(tables["tblattribute"].rows), 0)
+        self._check_references(syntheticCREM.scale_tables(tables, 2))
+
+    def test_write_tables(self):
+        output_dir = tempfile.mkdtemp()
+        try:
+            syntheticCREM.write_tables(
+                syntheticCREM.scale_tables(self.tables, 2), output_dir)
+            written = syntheticCREM.read_tables(output_dir)
+        finally:
+            shutil.rmtree(output_dir)
+        self.assertEqual(sorted(written), sorted(self.tables))
+        self.assertEqual(
+            len(written["tblattribute"].rows),
+            2 * len(self.tables["tblattribute"].rows))
+
+
+if __name__ == "__main__":
+    unittest.main()
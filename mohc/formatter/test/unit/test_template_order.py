@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import sys
 import unittest
 
 import elements
@@ -112,6 +113,18 @@ class TestTemplateOrder(unittest.TestCase):
             self.assertTrue(
                 actual_position[referred_to] < actual_position["Ensemble"])
 
+    def test_build_nodes_are_compact(self):
+        self.template["DocumentSet"] = self._experiment_template()
+        tree = template.doc_builder(self.template, self.dao_env, self.cfg)
+        self.assertIsInstance(tree, template.BuildNode)
+        self.assertFalse(hasattr(tree, "__dict__"))
+        self.assertIs(tree["contents"], tree.contents)
+        self.assertRaises(KeyError, tree.__getitem__, "no_such_key")
+        as_dict = {
+            "node": tree.node, "contents": tree.contents,
+            "below": tree.below, "refers_to": tree.refers_to}
+        self.assertLess(sys.getsizeof(tree), sys.getsizeof(as_dict))
+
     def _experiment_template(self):
         expt = {
             "dao": {"NullDao": {}},
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from timings import PhaseTimer
+
+
+class TestPhaseTimer(unittest.TestCase):
+
+    def setUp(self):
+        self.timer = PhaseTimer()
+
+    def test_phases_in_order(self):
+        with self.timer.phase("parse"):
+            pass
+        with self.timer.phase("build"):
+            pass
+        names = [phase["name"] for phase in self.timer.phases]
+        self.assertEqual(names, ["parse", "build"])
+        self.assertGreaterEqual(self.timer.phases[0]["wall"], 0)
+
+    def test_phase_recorded_on_exit(self):
+        def exit_in_phase():
+            with self.timer.phase("write"):
+                raise SystemExit(1)
+        self.assertRaises(SystemExit, exit_in_phase)
+        self.assertEqual(self.timer.phases[0]["name"], "write")
+
+    def test_listeners(self):
+        finished = []
+        self.timer.listeners.append(finished.append)
+        with self.timer.phase("parse"):
+            self.assertEqual(finished, [])
+        self.assertEqual(finished, ["parse"])
+
+    def test_total(self):
+        self.timer.phases = [
+            {"name": "parse", "wall": 1.0, "cpu": 0.5},
+            {"name": "build", "wall": 3.0, "cpu": 2.5}]
+        self.assertEqual(self.timer.total(), {"wall": 4.0, "cpu": 3.0})
+        summary = self.timer.summary().splitlines()
+        self.assertEqual(len(summary), 4)
+        self.assertTrue(summary[2].startswith("build"))
+        self.assertTrue(summary[2].endswith("75.0"))
+
+    def test_save(self):
+        output_dir = tempfile.mkdtemp()
+        try:
+            with self.timer.phase("parse"):
+                pass
+            path = os.path.join(output_dir, "timings.json")
+            self.timer.save(path)
+            with open(path) as timings_file:
+                saved = json.load(timings_file)
+        finally:
+            shutil.rmtree(output_dir)
+        self.assertEqual(saved["phases"][0]["name"], "parse")
+        self.assertIn("total", saved)
+
+
+if __name__ == "__main__":
+    unittest.main()